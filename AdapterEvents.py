@@ -0,0 +1,390 @@
+import sys
+import time
+import base64
+import socket
+import struct
+import threading
+import subprocess
+import MyLogger as log
+import WinterfacePS as win
+import Metrics
+import Capture
+
+# Tells the rest of the program when an adapter changes (its link goes up or down,
+# it's enabled or disabled, or an address is added or removed) as it happens,
+# instead of everything having to poll for it.
+#
+# The changes come from a source running on its own thread:
+#   - Windows: CIM indications for MSFT_NetAdapter and MSFT_NetIPAddress, from
+#     one long-lived powershell.exe that only prints when something changes
+#   - Linux: an rtnetlink socket
+#   - anywhere else, or if those can't be started: polling Get-NetAdapter and
+#     ipconfig through the persistent shell every couple of seconds
+#
+# While events are running:
+#   - The state cache is told which adapters changed before each lookup, and
+#     re-queries just those. The rest stays cached, and checking the link of an
+#     adapter no longer costs a command.
+#   - `wait_for_change()` wakes up as soon as something changes, so waiting for an
+#     adapter to recover doesn't poll at all.
+#
+# Events arrive at unpredictable times, so what the rest of the program actually
+# saw of them (which adapters had changed at each lookup, and how each wait
+# ended) is recorded in the capture, and replayed from it.
+
+use_adapter_events = True
+
+# If set, called with the delivery function to make the source, instead of
+# picking one for the OS (e.g. OfflineBenchmark's simulated one).
+source_factory = None
+
+class AdapterEvent:
+    # kind: "link" (`up` is whether it has a link), "admin" (`up` is whether it's
+    # enabled), "address" (`detail` is the address, and whether it was added or
+    # removed), or "changed" (something else, e.g. it appeared or went away).
+    def __init__(self, kind, name, up=None, detail=""):
+        self.kind = kind
+        self.name = name
+        self.up = up
+        self.detail = detail
+
+    def __str__(self):
+        state = "" if self.up is None else (" up" if self.up else " down")
+        detail = f" ({self.detail})" if self.detail else ""
+        return f"{self.name}: {self.kind}{state}{detail}"
+
+
+########## Windows ##########
+_cim_script = r"""
+[Console]::OutputEncoding = [Text.Encoding]::UTF8
+$ns = 'root/StandardCimv2'
+Register-CimIndicationEvent -Namespace $ns -SourceIdentifier nt_adapter -Query "SELECT * FROM __InstanceModificationEvent WITHIN 1 WHERE TargetInstance ISA 'MSFT_NetAdapter'" | Out-Null
+Register-CimIndicationEvent -Namespace $ns -SourceIdentifier nt_address -Query "SELECT * FROM __InstanceOperationEvent WITHIN 1 WHERE TargetInstance ISA 'MSFT_NetIPAddress'" | Out-Null
+[Console]::Out.WriteLine('READY')
+[Console]::Out.Flush()
+while ($true) {
+    $e = Wait-Event
+    Remove-Event -EventIdentifier $e.EventIdentifier
+    $new = $e.SourceEventArgs.NewEvent
+    $t = $new.TargetInstance
+    if ($e.SourceIdentifier -eq 'nt_adapter') {
+        $p = $new.PreviousInstance
+        $fields = 'adapter', $t.Name, $t.InterfaceOperationalStatus, $p.InterfaceOperationalStatus, $t.InterfaceAdminStatus, $p.InterfaceAdminStatus
+    } else {
+        $fields = 'address', $t.InterfaceAlias, $t.IPAddress, $new.CimClass.CimClassName
+    }
+    [Console]::Out.WriteLine($fields -join "`t")
+    [Console]::Out.Flush()
+}
+"""
+
+class CimEventSource:
+    name = "CIM indications"
+
+    def __init__(self, deliver, ready_timeout=15):
+        self.deliver = deliver
+        self.ready_timeout = ready_timeout
+        self.process = None
+
+    def start(self):
+        encoded = base64.b64encode(_cim_script.encode("utf-16-le")).decode()
+        start = time.perf_counter()
+        self.process = subprocess.Popen(["powershell.exe", "-NoLogo", "-NoProfile", "-NonInteractive",
+                                         "-EncodedCommand", encoded],
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        Metrics.record("spawn", "powershell.exe events", time.perf_counter() - start)
+        # Registering can fail (e.g. no CIM on this machine), so wait to hear that it
+        # worked. If PowerShell gives up and exits instead, `ready` is set too.
+        ready = threading.Event()
+        self._registered = False
+        threading.Thread(target=self._run, args=(ready,), name="adapter-events", daemon=True).start()
+        if not ready.wait(self.ready_timeout) or not self._registered:
+            self.stop()
+            raise RuntimeError("The CIM event subscription didn't start")
+
+    def _run(self, ready):
+        try:
+            for raw in self.process.stdout:
+                line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+                if line == "READY":
+                    self._registered = True
+                    ready.set()
+                    continue
+                for event in self.parse(line):
+                    self.deliver(event)
+        finally:
+            ready.set()
+
+    @staticmethod
+    def parse(line):
+        fields = line.split("\t")
+        if fields[0] == "adapter" and len(fields) == 6:
+            name, oper, old_oper, admin, old_admin = fields[1:]
+            if oper != old_oper:
+                status = win._decode_enum("ifOperStatus", int(oper)) if oper.isdigit() else oper
+                yield AdapterEvent("link", name, up=(status == "Up"), detail=str(status))
+            if admin != old_admin:
+                yield AdapterEvent("admin", name, up=(admin == "1"))
+            if oper == old_oper and admin == old_admin:
+                yield AdapterEvent("changed", name)
+        elif fields[0] == "address" and len(fields) == 4:
+            name, address, what = fields[1:]
+            if what == "__InstanceCreationEvent":
+                detail = f"{address} added"
+            elif what == "__InstanceDeletionEvent":
+                detail = f"{address} removed"
+            else:
+                detail = f"{address} changed"
+            yield AdapterEvent("address", name, detail=detail)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+
+########## Linux ##########
+_RTMGRP_LINK = 0x1
+_RTMGRP_IPV4_IFADDR = 0x10
+_RTMGRP_IPV6_IFADDR = 0x100
+_RTM_NEWLINK, _RTM_DELLINK, _RTM_NEWADDR, _RTM_DELADDR = 16, 17, 20, 21
+_IFF_UP = 0x1
+_IFF_LOWER_UP = 0x10000
+
+class NetlinkEventSource:
+    name = "netlink"
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+        self.socket = None
+        self._links = {}  # index: (enabled, has link)
+        self._stop = threading.Event()
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.socket.bind((0, _RTMGRP_LINK | _RTMGRP_IPV4_IFADDR | _RTMGRP_IPV6_IFADDR))
+        self.socket.settimeout(1)  # So that `stop()` is noticed.
+        threading.Thread(target=self._run, name="adapter-events", daemon=True).start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            for event in self.parse(data):
+                self.deliver(event)
+
+    # A message is a 16 byte nlmsghdr, then an ifinfomsg (links) or ifaddrmsg (addresses).
+    def parse(self, data):
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msg_type = struct.unpack_from("=IH", data, offset)
+            if length < 16:
+                break
+            body = offset + 16
+            if msg_type in (_RTM_NEWLINK, _RTM_DELLINK):
+                _, _, _, index, flags, _ = struct.unpack_from("=BBHiII", data, body)
+                name = self._name(index)
+                if msg_type == _RTM_DELLINK:
+                    self._links.pop(index, None)
+                    yield AdapterEvent("changed", name, detail="removed")
+                else:
+                    enabled, link = bool(flags & _IFF_UP), bool(flags & _IFF_LOWER_UP)
+                    old = self._links.get(index)
+                    self._links[index] = (enabled, link)
+                    if old is None or old[0] != enabled:
+                        yield AdapterEvent("admin", name, up=enabled)
+                    if old is None or old[1] != link:
+                        yield AdapterEvent("link", name, up=link)
+            elif msg_type in (_RTM_NEWADDR, _RTM_DELADDR):
+                index = struct.unpack_from("=BBBBI", data, body)[4]
+                yield AdapterEvent("address", self._name(index),
+                                   detail="added" if msg_type == _RTM_NEWADDR else "removed")
+            offset += (length + 3) & ~3
+
+    @staticmethod
+    def _name(index):
+        try:
+            return socket.if_indextoname(index)
+        except OSError:  # It's already gone.
+            return f"#{index}"
+
+    def stop(self):
+        self._stop.set()
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+########## Anywhere else ##########
+# Compares snapshots taken through the persistent shell, so it still costs no
+# process spawns, but a change is only seen at the next poll.
+class PollingEventSource:
+    name = "polling"
+
+    def __init__(self, deliver, interval=2):
+        self.deliver = deliver
+        self.interval = interval
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._last = self.poll()
+        self._thread = threading.Thread(target=self._run, name="adapter-events", daemon=True)
+        self._thread.start()
+
+    # Returns {name: (AdminStatus, ifOperStatus, IPv4 addresses)}.
+    # This doesn't go through the cache, which it's meant to keep up to date. It's
+    # quiet, so that polling every few seconds doesn't bury the log, use up the
+    # run's time budget, or get mixed up with Main's own commands in the capture.
+    @staticmethod
+    def poll():
+        (adapter_lines, _), (ip_lines, _) = win.run_PS_batch(
+            [win._net_adapter_query("limited", False), "ipconfig /all"], display=False, quiet=True)
+        ip_adapters = win.dict_by_name(win.parse_ip_config(ip_lines)[1])
+        state = {}
+        for a in win.parse_net_adapter_list(adapter_lines):
+            ip_a = ip_adapters.get(a['Name'])
+            addresses = tuple(ip_a.typed("IPv4 Address")) if ip_a is not None and "IPv4 Address" in ip_a else ()
+            state[a['Name']] = (a.get('AdminStatus'), a.get('ifOperStatus'), addresses)
+        return state
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                current = self.poll()
+            except Exception as e:  # e.g. the shell being restarted. Try again next time.
+                log.log(f"Polling for adapter changes failed: {e!r}")
+                continue
+            for name in set(self._last).union(current):
+                old, new = self._last.get(name), current.get(name)
+                if old is None or new is None:
+                    self.deliver(AdapterEvent("changed", name, detail="appeared" if old is None else "removed"))
+                    continue
+                if old[0] != new[0]:
+                    self.deliver(AdapterEvent("admin", name, up=(new[0] == "Up")))
+                if old[1] != new[1]:
+                    self.deliver(AdapterEvent("link", name, up=(new[1] == "Up"), detail=new[1]))
+                if old[2] != new[2]:
+                    self.deliver(AdapterEvent("address", name, detail=", ".join(new[2]) or "none"))
+            self._last = current
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+########## Delivering ##########
+_source = None
+_pending = set()  # Names of the adapters that changed since the cache was last told.
+_condition = threading.Condition()
+listeners = []    # Called with each AdapterEvent, on the source's thread.
+
+def running():
+    return _source is not None
+
+def _deliver(event):
+    log.log(f"Adapter event: {event}")
+    log.log_event("adapter_event", kind=event.kind, name=event.name, up=event.up, detail=event.detail)
+    with _condition:
+        _pending.add(event.name)
+        _condition.notify_all()
+    for listener in list(listeners):
+        listener(event)
+
+def _default_source():
+    if sys.platform == "win32":
+        return [CimEventSource(_deliver), PollingEventSource(_deliver)]
+    if sys.platform.startswith("linux"):
+        return [NetlinkEventSource(_deliver), PollingEventSource(_deliver)]
+    return [PollingEventSource(_deliver)]
+
+# Starts listening for adapter changes, with the first source that works.
+# Returns the source's name, or None if events are off.
+def start():
+    global _source
+    if not use_adapter_events or _source is not None:
+        return None if _source is None else _source.name
+    if Capture.replaying():
+        # Whether there were events is in the capture.
+        name = Capture.replayed("adapter_events", "start", missing={"source": None})["source"]
+        if name is not None:
+            _source = _ReplayedSource(name)
+    else:
+        sources = [source_factory(_deliver)] if source_factory is not None else _default_source()
+        for source in sources:
+            try:
+                source.start()
+            except Exception as e:
+                log.log(f"Couldn't start adapter events from {source.name}: {e!r}")
+                continue
+            _source = source
+            break
+        Capture.record("adapter_events", "start", source=None if _source is None else _source.name)
+    if _source is None:
+        return None
+    log.log(f"Listening for adapter changes ({_source.name}).")
+    with _condition:
+        _pending.clear()
+    win.state_cache.follow(take_changes)
+    return _source.name
+
+def stop():
+    global _source
+    source, _source = _source, None
+    if source is not None:
+        source.stop()
+        win.state_cache.follow(None)
+
+class _ReplayedSource:
+    def __init__(self, name):
+        self.name = name + " (replayed)"
+
+    def stop(self):
+        pass
+
+# Returns (and forgets) the names of the adapters that changed since it was last
+# called. The state cache calls this before every lookup.
+def take_changes():
+    if Capture.replaying():
+        return Capture.replayed("adapter_changes", None, missing={"names": []})["names"]
+    with _condition:
+        names = sorted(_pending)
+        _pending.clear()
+    Capture.record("adapter_changes", None, names=names)
+    return names
+
+# Waits until an adapter changes (or `until()` returns True), for at most
+# `timeout` seconds. Returns whether something changed.
+def wait_for_change(timeout, until=None):
+    start = time.perf_counter()
+    if Capture.replaying():
+        changed = Capture.replayed("adapter_wait", None, missing={"changed": None})["changed"]
+        if changed is None:
+            Capture.sleep(timeout)
+            return False
+        return changed
+    _wait(lambda: _pending or (until is not None and until()), timeout)
+    with _condition:
+        changed = bool(_pending)
+    Capture.record("adapter_wait", None, time.perf_counter() - start, changed=changed)
+    Metrics.record("wait", "adapter event" if changed else "no adapter event", time.perf_counter() - start)
+    return changed
+
+# Blocks until `ready()` returns True, for at most `timeout` seconds.
+# (OfflineBenchmark swaps this for one that waits on its virtual clock.)
+def _wait(ready, timeout):
+    with _condition:
+        _condition.wait_for(ready, timeout)
+
+# Wakes up anything in `wait_for_change()`, so it can look at its `until()`.
+def wake():
+    with _condition:
+        _condition.notify_all()
@@ -0,0 +1,207 @@
+import sys
+from enum import Enum
+
+# A compact stand-in for the dicts that adapters used to be (from Get-NetAdapter,
+# ipconfig, or both combined). The monitor and InterfaceDifferenceChecker hold
+# thousands of them at once, and as dicts every one of them had its own hash
+# table of the same keys.
+#
+# - The property names live in a Schema, which every record with the same
+#   properties shares. A record itself is just its schema and a list of values.
+# - Property names and string values are interned, so the "Up"s, "True"s and
+#   addresses that repeat from one sample to the next are stored once.
+# - It reads like the dict did: adapter['Name'], .get(), `in`, iteration,
+#   .items(), and comparing with a dict all still work, and the values are the
+#   same strings as before.
+# - `typed()` gives a property as what it means: the statuses as the enums
+#   below, "True"/"Yes" as bools, indexes as ints and addresses as lists.
+
+
+# In the structured (JSON) mode, these come back as numbers, which are turned into
+# these. They're also strings, so `adapter['AdminStatus'] == "Up"` still works.
+class _StrEnum(str, Enum):
+    def __str__(self):
+        return self.value
+
+class AdminStatus(_StrEnum):  # NET_IF_ADMIN_STATUS
+    UP = "Up"
+    DOWN = "Down"
+    TESTING = "Testing"
+
+class OperStatus(_StrEnum):  # NET_IF_OPER_STATUS
+    UP = "Up"
+    DOWN = "Down"
+    TESTING = "Testing"
+    UNKNOWN = "Unknown"
+    DORMANT = "Dormant"
+    NOT_PRESENT = "NotPresent"
+    LOWER_LAYER_DOWN = "LowerLayerDown"
+
+class MediaConnectionState(_StrEnum):
+    UNKNOWN = "Unknown"
+    CONNECTED = "Connected"
+    DISCONNECTED = "Disconnected"
+
+
+class Schema:
+    __slots__ = ("keys", "index", "_extended")
+
+    def __init__(self, keys):
+        self.keys = tuple(sys.intern(k) for k in keys)
+        self.index = {k: i for i, k in enumerate(self.keys)}
+        self._extended = {}
+
+    # The schema with `key` added at the end.
+    def extended(self, key):
+        schema = self._extended.get(key)
+        if schema is None:
+            schema = self._extended[key] = schema_for(self.keys + (key,))
+        return schema
+
+_schemas = {}
+
+def schema_for(keys):
+    keys = tuple(keys)
+    schema = _schemas.get(keys)
+    if schema is None:
+        schema = _schemas.setdefault(keys, Schema(keys))
+    return schema
+
+_intern_str = sys.intern
+
+def _intern(value):
+    if type(value) is str:
+        return _intern_str(value)
+    if type(value) is list:
+        return [_intern_str(v) if type(v) is str else v for v in value]
+    return value
+
+
+class AdapterRecord:
+    __slots__ = ("_schema", "_values")
+
+    # `fields` is a dict, or anything else dict() takes.
+    def __init__(self, fields=()):
+        if type(fields) is not dict:
+            fields = dict(fields)
+        self._schema = schema_for(fields)
+        self._values = [_intern_str(v) if type(v) is str else _intern(v) for v in fields.values()]
+
+    def __getitem__(self, key):
+        return self._values[self._schema.index[key]]
+
+    def get(self, key, default=None):
+        i = self._schema.index.get(key)
+        return default if i is None else self._values[i]
+
+    def __setitem__(self, key, value):
+        i = self._schema.index.get(key)
+        if i is None:
+            self._schema = self._schema.extended(key)
+            self._values.append(_intern(value))
+        else:
+            self._values[i] = _intern(value)
+
+    def __contains__(self, key):
+        return key in self._schema.index
+
+    def __iter__(self):
+        return iter(self._schema.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return self._schema.keys
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._schema.keys, self._values)
+
+    def to_dict(self):
+        return dict(zip(self._schema.keys, self._values))
+
+    # Returns {key: value} for everything that's different in this record than
+    # in `other`. Keys that are only in `other` are given as None.
+    def changes_from(self, other):
+        if self._schema is other._schema:
+            return {k: v for k, v, old in zip(self._schema.keys, self._values, other._values) if v != old}
+        changes = {k: v for k, v in self.items() if other.get(k) != v}
+        changes.update({k: None for k in other if k not in self._schema.index})
+        return changes
+
+    def __eq__(self, other):
+        if isinstance(other, AdapterRecord):
+            if self._schema is other._schema:
+                return self._values == other._values
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"AdapterRecord({self.to_dict()!r})"
+
+    # Returns the property as what it means, rather than as text (see below).
+    # Raises KeyError like [] does.
+    def typed(self, key):
+        value = self[key]
+        convert = field_types.get(key)
+        if convert is not None:
+            return convert(value)
+        if value == "True" or value == "False":
+            return value == "True"
+        return value
+
+
+def _to_enum(enum):
+    members = {m.value: m for m in enum}
+    def convert(value):
+        return members.get(value, value)  # A status this version doesn't know of stays as it is.
+    return convert
+
+def _to_int(value):
+    if type(value) is str and value.strip().isdigit():
+        return int(value)
+    return value
+
+def _to_bool(value):
+    if value in ("Yes", "True"):
+        return True
+    if value in ("No", "False"):
+        return False
+    return value
+
+# ipconfig gives one address as a string and several as a list, with notes
+# like "(Preferred)" after them.
+def _to_addresses(value):
+    if type(value) is not list:
+        value = [] if value == "" else [value]
+    return [a.split("(")[0] for a in value]
+
+# Property name: function that turns its value into what it means.
+# Anything not in here that says "True" or "False" becomes a bool.
+field_types = {
+    "AdminStatus": _to_enum(AdminStatus),
+    "ifOperStatus": _to_enum(OperStatus),
+    "MediaConnectionState": _to_enum(MediaConnectionState),
+    "ifIndex": _to_int,
+    "InterfaceIndex": _to_int,
+    "MtuSize": _to_int,
+    "DHCPv6 IAID": _to_int,
+    "DHCP Enabled": _to_bool,
+    "Autoconfiguration Enabled": _to_bool,
+    "IP Routing Enabled": _to_bool,
+    "WINS Proxy Enabled": _to_bool,
+    "IPv4 Address": _to_addresses,
+    "IPv6 Address": _to_addresses,
+    "Temporary IPv6 Address": _to_addresses,
+    "Link-local IPv6 Address": _to_addresses,
+    "Autoconfiguration IPv4 Address": _to_addresses,
+    "Default Gateway": _to_addresses,
+    "DNS Servers": _to_addresses,
+}
@@ -0,0 +1,219 @@
+import os
+import re
+import gzip
+import json
+import time
+import base64
+import threading
+import collections
+import MyLogger as log
+import Deadlines
+
+# Records everything a run depends on: every command with its raw output, exit
+# status and duration, probe and DNS results, the admin check, and the answers
+# typed in. That goes to a capture file (log_N.capture, one JSON object per line).
+#
+# A capture can be replayed: the same things are then answered from the file
+# instead of the machine, so a run from someone else's computer can be stepped
+# through again on any OS. Nothing actually waits during a replay. Instead, a
+# virtual clock is moved forward by sleeps, and to the time each recording was
+# made at, and `monotonic` reports that, so timeouts and cache expiry come out the
+# same as they did.
+#
+# Recordings are matched up by kind and key (e.g. the command), in order. If the
+# replay asks for one more than was recorded, the last one is given again.
+
+CAPTURE_VERSION = 1
+
+# The batch markers are random, so they're stored as this and put back on replay.
+_marker_re = re.compile(r"__NT_SECTION_[0-9a-f]{32}")
+MARKER_PLACEHOLDER = "__NT_SECTION_*"
+
+class ReplayMissing(Exception):
+    pass
+
+_recorder = None
+_replay = None
+
+def recording():
+    return _recorder is not None
+
+def replaying():
+    return _replay is not None
+
+
+########## Recording ##########
+class _Recorder:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.start = monotonic()
+
+    def write(self, item):
+        line = json.dumps(item, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()  # So a crash still leaves a usable capture.
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+def start_recording(path):
+    global _recorder
+    stop_recording()
+    _recorder = _Recorder(path)
+    _recorder.write({"capture": CAPTURE_VERSION, "time": time.time()})
+    log.read_input = _recording_input
+    log.log(f"Capturing commands to {path}")
+
+def stop_recording():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+        log.read_input = None
+
+# `key` identifies what was asked for (it must be JSON), `fields` hold the answer.
+def record(kind, key, duration=None, **fields):
+    if _recorder is not None:
+        at = round(monotonic() - _recorder.start, 4)
+        _recorder.write({"kind": kind, "key": key, "at": at, "duration": duration, **fields})
+
+# `timed_out` is the Deadlines error, if the command didn't finish.
+def record_command(command, raw_lines, code, duration, timed_out=None):
+    if _recorder is None:
+        return
+    output = b"".join(raw_lines)
+    try:
+        fields = {"out": _marker_re.sub(MARKER_PLACEHOLDER, output.decode())}
+    except UnicodeDecodeError:
+        fields = {"out64": base64.b64encode(output).decode()}
+    if timed_out is not None:
+        fields.update(timed_out=timed_out.reason, timeout=timed_out.timeout)
+    record("command", _marker_re.sub(MARKER_PLACEHOLDER, command), duration, code=code, **fields)
+
+def _recording_input(prompt=""):
+    start = time.perf_counter()
+    answer = input(prompt)
+    record("input", prompt, time.perf_counter() - start, answer=answer)
+    return answer
+
+
+########## Replaying ##########
+# Returns (header, records) from a capture file, which may be gzipped.
+def load_capture(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip() != ""]
+    if len(items) == 0 or items[0].get("capture") != CAPTURE_VERSION:
+        raise ValueError(f"{path} is not a version {CAPTURE_VERSION} capture file")
+    return items[0], items[1:]
+
+class Replay:
+    def __init__(self, records):
+        self.base = time.monotonic()
+        self.clock = 0          # Seconds of virtual time passed.
+        self.used = 0
+        self.repeated = 0
+        self.missing = []
+        self._queues = collections.defaultdict(collections.deque)
+        self._last = {}
+        self._lock = threading.Lock()
+        for item in records:
+            self._queues[(item["kind"], json.dumps(item["key"]))].append(item)
+
+    def next(self, kind, key, missing=None):
+        queue_key = (kind, json.dumps(key))
+        with self._lock:
+            queue = self._queues.get(queue_key)
+            if queue:
+                item = self._last[queue_key] = queue.popleft()
+                self.used += 1
+            elif queue_key in self._last:
+                item = self._last[queue_key]
+                self.repeated += 1
+            else:
+                self.missing.append((kind, key))
+                if missing is not None:
+                    return missing
+                raise ReplayMissing(f"The capture has no {kind} for {key!r}")
+            self.clock = max(self.clock, item["at"])
+            return item
+
+    def unused(self):
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def log_report(self):
+        log.log(f"Replay: {self.used} recordings used, {self.repeated} repeated, {self.unused()} unused, "
+              + f"{len(self.missing)} missing, {self.clock:.1f}s of virtual time")
+        for kind, key in self.missing:
+            log.log(f"Replay: nothing recorded for {kind} {key!r}")
+
+def start_replay(path):
+    global _replay
+    _, records = load_capture(path)
+    _replay = Replay(records)
+    log.read_input = _replayed_input
+    return _replay
+
+def stop_replay():
+    global _replay
+    replay, _replay = _replay, None
+    log.read_input = None
+    return replay
+
+# Returns the fields of the next recording of `kind` for `key`.
+# If there isn't one, returns `missing`, or raises ReplayMissing if that's None.
+def replayed(kind, key, missing=None):
+    return _replay.next(kind, key, missing)
+
+# Gives back a recorded command's output (as bytes lines), and returns its exit
+# status. If it didn't finish, this raises the same Deadlines error it did.
+def replay_command(command):
+    marker = _marker_re.search(command)
+    item = _replay.next("command", _marker_re.sub(MARKER_PLACEHOLDER, command))
+    if "out64" in item:
+        output = base64.b64decode(item["out64"])
+    else:
+        output = item["out"]
+        if marker is not None:
+            output = output.replace(MARKER_PLACEHOLDER, marker.group(0))
+        output = output.encode()
+    lines = output.split(b"\n")
+    for i, line in enumerate(lines):
+        if i < len(lines) - 1:
+            yield line + b"\n"
+        elif line != b"":
+            yield line
+    if "timed_out" in item:
+        raise Deadlines.error_for(item["timed_out"], command, item["timeout"], output)
+    return item["code"]
+
+def _replayed_input(prompt=""):
+    answer = replayed("input", prompt)["answer"]
+    print(prompt + answer)  # As if it had been typed.
+    return answer
+
+
+########## Clock ##########
+# Waits and timeouts go through these, so that a replay doesn't actually wait.
+def sleep(seconds):
+    if _replay is not None:
+        with _replay._lock:
+            _replay.clock += max(seconds, 0)
+    else:
+        time.sleep(seconds)
+
+def monotonic():
+    if _replay is not None:
+        return _replay.base + _replay.clock
+    return time.monotonic()
+
+# log_N.txt -> log_N.capture
+def capture_path_for(log_path):
+    return os.path.splitext(log_path)[0] + ".capture"
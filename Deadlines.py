@@ -0,0 +1,191 @@
+import os
+import time
+import signal
+import threading
+import contextlib
+import contextvars
+import subprocess
+import MyLogger as log
+
+# A hung `ping`, a stuck `Enable-NetAdapter` or a `curl` that never hears back
+# used to freeze the whole troubleshooter, with nothing on screen to say why.
+#
+# - Every command has a deadline (`command_timeout` seconds, unless it's given
+#   its own). When it passes, the command's process is killed, along with
+#   everything it started, and the command raises CommandTimedOut.
+# - The run can have a budget of time to spend running commands (`start_budget`),
+#   and a piece of work can be given a limit of its own (`limit`). No command is
+#   given longer than what's left of either, and once one is used up, commands
+#   raise BudgetExhausted straight away instead of running at all.
+# - `cancel()` kills every command that's running, and they raise CommandCancelled.
+#
+# All of these are CalledProcessErrors (without an exit status), so anything that
+# already takes a failing command as a "no", like the ping and curl tests, does
+# the same with one that never finished.
+
+command_timeout = 30
+
+
+class CommandTimedOut(subprocess.CalledProcessError):
+    reason = "timeout"
+
+    def __init__(self, command, timeout, output=b""):
+        super().__init__(None, command, output=output)
+        self.timeout = timeout
+
+    def __str__(self):
+        return f"Command '{self.cmd}' {self.describe()}"
+
+    def describe(self):
+        return f"timed out after {self.timeout:g}s"
+
+class CommandCancelled(CommandTimedOut):
+    reason = "cancelled"
+
+    def describe(self):
+        return "was cancelled"
+
+class BudgetExhausted(CommandTimedOut):
+    reason = "budget"
+
+    def describe(self):
+        return "wasn't run, because there was no time left for it"
+
+_errors = {e.reason: e for e in (CommandTimedOut, CommandCancelled, BudgetExhausted)}
+
+# Makes the error for `reason` ("timeout", "cancelled" or "budget"), e.g. one read back from a capture.
+def error_for(reason, command, timeout, output=b""):
+    return _errors[reason](command, timeout, output)
+
+
+########## Budgets ##########
+_lock = threading.Lock()
+_budget = None         # Seconds left for the run's commands, if it has a budget.
+_budget_total = None
+_deadline = contextvars.ContextVar("deadline", default=None)  # Of the innermost `limit`
+
+def start_budget(seconds):
+    global _budget, _budget_total
+    with _lock:
+        _budget = _budget_total = seconds
+
+def budget_left():
+    return _budget
+
+# Takes the time a command ran for off the run's budget.
+def spend(seconds):
+    global _budget
+    with _lock:
+        if _budget is not None:
+            _budget -= seconds
+
+# Commands run within the `with` get at most `seconds` altogether. That's on this
+# thread, and in asyncio tasks started from it. Limits can be nested, and the
+# tighter one wins.
+@contextlib.contextmanager
+def limit(seconds):
+    outer = _deadline.get()
+    deadline = time.monotonic() + seconds
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+# How long `command` may run for: `timeout` (or `command_timeout`), cut down to
+# what's left of the run's budget and of the current `limit`.
+# Raises BudgetExhausted if there's nothing left.
+def timeout_for(command, timeout=None):
+    left = [command_timeout if timeout is None else timeout]
+    if _budget is not None:
+        left.append(_budget)
+    deadline = _deadline.get()
+    if deadline is not None:
+        left.append(deadline - time.monotonic())
+    timeout = min(left)
+    if timeout <= 0:
+        raise BudgetExhausted(command, 0)
+    return timeout
+
+
+########## Killing commands ##########
+# Extra Popen arguments for processes that `kill_process_tree` may have to kill.
+# On POSIX the process gets a process group of its own, so its children can be found.
+popen_options = {} if os.name == "nt" else {"start_new_session": True}
+
+# `process` is a subprocess.Popen, or an asyncio subprocess.
+def _finished(process):
+    if hasattr(process, "poll"):
+        return process.poll() is not None
+    return process.returncode is not None
+
+def kill_process_tree(process):
+    if _finished(process):
+        return
+    if os.name == "nt":
+        # /T takes its children (like the ping that powershell.exe started) with it.
+        result = subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode == 0:
+            return
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except OSError:  # It isn't a group leader (it wasn't started with `popen_options`).
+            pass
+    try:
+        process.kill()
+    except OSError:
+        pass
+
+_running = set()
+
+# Kills `process` if `command` is still running on it `timeout` seconds after
+# `start()`, or if `cancel()` is called in the meantime. Call `stop()` when the
+# command is done. `error()` then says why it was killed, if it was.
+class Watchdog:
+    def __init__(self, process, command, timeout):
+        self.process = process
+        self.command = command
+        self.timeout = timeout
+        self.reason = None
+        self._timer = threading.Timer(timeout, self.kill, ("timeout",))
+        self._timer.daemon = True
+
+    def start(self):
+        with _lock:
+            _running.add(self)
+        self._timer.start()
+        return self
+
+    def stop(self):
+        self._timer.cancel()
+        with _lock:
+            _running.discard(self)
+
+    def kill(self, reason):
+        with _lock:
+            if self.reason is not None or _finished(self.process):
+                return
+            self.reason = reason
+        log.log(f"Killing `{self.command}`: it {error_for(reason, self.command, self.timeout).describe()}.")
+        kill_process_tree(self.process)
+
+    # The error to raise for the command, or None if it wasn't killed.
+    def error(self, output=b""):
+        if self.reason is None:
+            return None
+        return error_for(self.reason, self.command, self.timeout, output)
+
+# Kills every command that's running. Returns how many there were.
+def cancel():
+    with _lock:
+        watchdogs = list(_running)
+    for watchdog in watchdogs:
+        watchdog.kill("cancelled")
+    return len(watchdogs)
+
+def log_budget():
+    if _budget is not None:
+        log.log(f"Commands used {_budget_total - _budget:.1f}s of their {_budget_total:g}s budget.")
@@ -0,0 +1,111 @@
+import time
+import socket
+from concurrent.futures import ThreadPoolExecutor, wait
+import dns.message
+import dns.query
+import dns.rcode
+import dns.exception
+import MyLogger as log
+import Capture
+
+# Checking DNS one domain and one server at a time means that when DNS is blocked,
+# we sit through every timeout back to back. Here every query (the system resolver
+# for each domain, and each server for each domain) is sent at the same time, and
+# the whole thing gets one time budget.
+
+SYSTEM = "system"  # Used in place of a server IP for the system resolver.
+
+class DnsResult:
+    def __init__(self, server, domain, ok=False, latency=None, rcode=None, timed_out=False, error=""):
+        self.server = server
+        self.domain = domain
+        self.ok = ok                # We got an answer (of any kind) back.
+        self.latency = latency      # In seconds.
+        self.rcode = rcode          # e.g. "NOERROR" or "NXDOMAIN". None for the system resolver.
+        self.timed_out = timed_out
+        self.error = error
+
+    def summary(self):
+        if self.timed_out:
+            return "TIMEOUT"
+        if not self.ok:
+            return f"FAILED ({self.error})" if self.error else "FAILED"
+        return f"{self.rcode or 'OK'} {self.latency * 1000:.0f}ms"
+
+def resolve_with_system(domain):
+    start = time.perf_counter()
+    try:
+        socket.getaddrinfo(domain, 53)
+        return DnsResult(SYSTEM, domain, ok=True, latency=time.perf_counter() - start)
+    except socket.gaierror as e:
+        return DnsResult(SYSTEM, domain, error=str(e))
+
+# Queries `server` directly, bypassing the system resolver.
+def query_server(server, domain, timeout, port=53, rdtype="NS"):
+    query = dns.message.make_query(domain, rdtype)
+    start = time.perf_counter()
+    try:
+        response = dns.query.udp(query, server, timeout=timeout, port=port)
+        return DnsResult(server, domain, ok=True, latency=time.perf_counter() - start,
+                         rcode=dns.rcode.to_text(response.rcode()))
+    except dns.exception.Timeout:
+        return DnsResult(server, domain, timed_out=True)
+    except (OSError, dns.exception.DNSException) as e:
+        return DnsResult(server, domain, error=str(e))
+
+# Runs every query at once, and returns a list of DnsResults.
+# Anything that hasn't finished after `budget` seconds is reported as timed out.
+def run_dns_matrix(domains, servers, budget=5, port=53, use_system=True):
+    key = [list(domains), list(servers), use_system]
+    if Capture.replaying():
+        return [DnsResult(**fields) for fields in Capture.replayed("dns", key)["results"]]
+
+    start = time.perf_counter()
+    results = _run_dns_matrix(domains, servers, budget, port, use_system)
+    Capture.record("dns", key, time.perf_counter() - start, results=[vars(r) for r in results])
+    return results
+
+def _run_dns_matrix(domains, servers, budget, port, use_system):
+    jobs = []
+    if use_system:
+        jobs += [(SYSTEM, d) for d in domains]
+    jobs += [(s, d) for s in servers for d in domains]
+
+    executor = ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="dns")
+    try:
+        futures = {}
+        for server, domain in jobs:
+            if server == SYSTEM:
+                futures[executor.submit(resolve_with_system, domain)] = (server, domain)
+            else:
+                futures[executor.submit(query_server, server, domain, budget, port)] = (server, domain)
+
+        wait(futures, timeout=budget)
+
+        results = []
+        for future, (server, domain) in futures.items():
+            if future.done():
+                results.append(future.result())
+            else:
+                results.append(DnsResult(server, domain, timed_out=True))
+        return results
+    finally:
+        # A stuck getaddrinfo can't be interrupted, so don't wait for it.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Writes the results to the log as a table of servers by domains (and as events).
+def log_dns_matrix(results):
+    servers = list(dict.fromkeys(r.server for r in results))
+    domains = list(dict.fromkeys(r.domain for r in results))
+    cells = {(r.server, r.domain): r.summary() for r in results}
+    for r in results:
+        log.log_event("dns", server=r.server, domain=r.domain, ok=r.ok, latency=r.latency,
+                      rcode=r.rcode, timed_out=r.timed_out, error=r.error)
+
+    rows = [["server"] + domains]
+    for server in servers:
+        rows.append([server] + [cells.get((server, d), "") for d in domains])
+
+    widths = [max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+    for row in rows:
+        log.log(" | ".join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip())
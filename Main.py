@@ -1,11 +1,22 @@
 import MyLogger as log
 import WinterfacePS as win
-import sys
-from time import sleep
+import Probes
+import Readiness
+import DnsCheck
+import Metrics
+import Capture
+import Scheduler
+import Monitor
+import AdapterEvents
+import Deadlines
 import os
-import datetime
-import dns.resolver
-import socket
+import sys
+import time
+import select
+import threading
+import contextlib
+from Capture import sleep  # Doesn't actually wait when replaying a capture.
+from concurrent.futures import ThreadPoolExecutor
 
 domains_to_use = ["google.com", "amazon.com", "whitehouse.gov"]
 dns_to_use = ["1.1.1.1", "8.8.8.8", "8.8.4.4"]
@@ -19,12 +30,21 @@ if len(sys.argv) == 1:
     log_dir = "."
 else:
     log_dir = sys.argv[1]
-log_dir += os.path.sep
 
-log_file_num = 1
-while os.path.exists(log_dir + f"log_{log_file_num}.txt"):
-    log_file_num += 1
-log.setup_logfile(log_dir + f"log_{log_file_num}.txt")
+# Also write a log_N.jsonl of typed events next to each log, for tooling.
+write_event_log = True
+log_path = log.setup_log_dir(log_dir, events=write_event_log)
+
+# Also record every command, probe and answer to a log_N.capture, so the run can be
+# replayed elsewhere with tools/ReplayCapture.py. (Not while replaying one, though.)
+capture_commands = True
+if capture_commands and not Capture.replaying():
+    Capture.start_recording(Capture.capture_path_for(log_path))
+
+# The most time (in seconds) all of the run's commands together may take, so that
+# Windows not answering can't keep the user waiting forever (see Deadlines).
+command_budget = 5 * 60
+Deadlines.start_budget(command_budget)
 
 
 adapter_matchers = "Wi-Fi", "Ethernet"
@@ -39,7 +59,7 @@ def match_adapter_name(name):
 
 ########## Utilities ##########
 def print_further_instructions(resolved=True):
-    message = ("Please (somehow) give all log files (i.e. \"log_1\" or \"log_1.txt\") to your resident tech-support person. "
+    message = ("Please (somehow) give all log files (i.e. \"log_1.txt\", \"log_1.txt.gz\" or \"log_1.capture\") to your resident tech-support person. "
              + "It contains details of what this program did, and all the decisions made behind the scenes.")
     if resolved:
         message = "If issues are still unresolved, p" + message[1:]
@@ -75,6 +95,70 @@ def pause_until_enter():
     print("Press ENTER to continue")
     input()
 
+# Returns True if ENTER is pressed within `timeout` seconds, False if it isn't,
+# and None if there's no keyboard to watch. Anything else typed is dropped.
+def _enter_pressed(timeout):
+    if os.name == "nt":
+        import msvcrt
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            while msvcrt.kbhit():
+                if msvcrt.getwch() in "\r\n":
+                    return True
+            time.sleep(0.05)
+        return False
+    try:
+        readable, _, _ = select.select([sys.stdin], [], [], timeout)
+        if not readable:
+            return False
+        return True if sys.stdin.readline() != "" else None
+    except (OSError, ValueError):
+        return None
+
+# While the `with` runs, a thread watches for ENTER. Gives an Event that's set
+# (with AdapterEvents woken up) once it's pressed. Nothing is left reading the
+# keyboard afterwards, so it can't take the answer to the next question.
+@contextlib.contextmanager
+def watching_for_enter():
+    pressed = threading.Event()
+    done = threading.Event()
+    def watch():
+        while not done.is_set():
+            result = _enter_pressed(0.1)
+            if result is None:
+                return
+            if result:
+                pressed.set()
+                AdapterEvents.wake()
+                return
+    if not Capture.replaying():
+        threading.Thread(target=watch, name="enter-watcher", daemon=True).start()
+    try:
+        yield pressed
+    finally:
+        done.set()
+
+# Waits for `name` to get a link, for at most `deadline` seconds, and returns as
+# soon as it does, or as soon as ENTER is pressed. Returns whether it has a link.
+def watch_for_link(name, deadline=60):
+    if win.get_network_adapter_link_status(name):
+        return True
+    print(f"We'll keep an eye on {name} for up to {deadline} seconds, and carry on as soon as it connects.")
+    print("Press ENTER to stop waiting.")
+    with watching_for_enter() as pressed:
+        for _, up in Readiness.watch_links([name], deadline, stop=pressed):
+            if up:
+                return True
+    if pressed.is_set():
+        log.log("ENTER was pressed, so we stopped waiting for a link.")
+    return win.get_network_adapter_link_status(name)
+
+# Waits until the adapters can reach the internet, for at most `deadline` seconds.
+# This replaces fixed sleeps, which were usually much longer than needed.
+recovery_deadline = 20
+def wait_for_adapters(adapter_names=None, deadline=recovery_deadline):
+    return Readiness.wait_until_ready(adapter_names, connectivity_check=test_several_ips, deadline=deadline)
+
 
 
 
@@ -82,8 +166,9 @@ def pause_until_enter():
 
 ########## Diagnostics ##########
 # Returns `True` if it enabled an adapter, and the connection should be rechecked.
+@Metrics.routine
 def check_for_disabled_adapters():
-    log.log("Running check_for_disabled_adapters routine.")
+    log.log_routine("check_for_disabled_adapters")
     found_adapters = {x: [] for x in adapter_matchers}
     found_adapters['Other'] = []
 
@@ -97,7 +182,7 @@ def check_for_disabled_adapters():
     
     log.log("Looking for enabled adapters that are disconnected.")
 
-    enabled_an_adapter = False
+    enabled_names = []
     for adapter_type in found_adapters:
         adapters = found_adapters[adapter_type]
         enabled = [(a["AdminStatus"] == "Up") for a in adapters]
@@ -114,19 +199,20 @@ def check_for_disabled_adapters():
             print("If you don't know, just press enter.")
         if get_confirmation(default_value=False):
             print("Then we will enable it/them for you.")
-            for i, e in enumerate(enabled):
-                if e: # If it is enabled, skip it.
-                    continue
-                name = adapters[i]['Name']
+            to_enable = [adapters[i]['Name'] for i, e in enumerate(enabled) if not e]
+            for name in to_enable:
                 print(f"Enabling {name}")
-                win.set_net_adapter_enable_state(name, True)
-                enabled_an_adapter = True
+            for name, worked in win.set_net_adapters_enable_state(to_enable, True).items():
+                if worked:
+                    enabled_names.append(name)
+                else:
+                    print(f"We couldn't enable {name}.")
         else:
             print("Then we will leave it alone.")
 
-    if enabled_an_adapter:
+    if len(enabled_names) > 0:
         print("Giving time for adapters to reinitialize and connect...")
-        sleep(20)
+        wait_for_adapters(enabled_names)
 
         if test_several_ips():
             print("It seems that this has resolved your issues.")
@@ -138,9 +224,11 @@ def check_for_disabled_adapters():
     return False
 
 
+@Metrics.routine
 def reset_adapters():
-    log.log("Running reset_adapters routine.")
+    log.log_routine("reset_adapters")
     ### Reset network adapters with phyiscal connectors
+    to_disable = []
     disabled = []
     print("Getting adapters...")
     log.log("Resetting hardware network adapters that are not disabled.")
@@ -160,9 +248,15 @@ def reset_adapters():
 
         name = adapter['Name']
         print(f"Disabling {name}...")
-        disabled.append(name)
-        win.set_net_adapter_enable_state(name, False)
+        to_disable.append(name)
 
+    # All of them go down and come back up together, in one command each way.
+    outage_start = Capture.monotonic()
+    for name, worked in win.set_net_adapters_enable_state(to_disable, False).items():
+        if worked:
+            disabled.append(name)
+        else:
+            print(f"We couldn't disable {name}, so we'll leave it as it is.")
     
     if len(disabled) > 0:
         print("Waiting for a few seconds...")
@@ -170,11 +264,16 @@ def reset_adapters():
 
         for name in disabled:
             print(f"Reenabling {name}...")
-            win.set_net_adapter_enable_state(name, True)
+        for name, worked in win.set_net_adapters_enable_state(disabled, True).items():
+            if not worked:
+                print(f"We couldn't reenable {name}. It's still disabled.")
+        outage = Capture.monotonic() - outage_start
+        log.log(f"The adapters were down for {outage:.1f}s.")
+        Metrics.record("outage", "reset_adapters", outage)
 
         print("Done resetting adapters.")
         print("Waiting for adapters to reinitialize and connect...")
-        sleep(20)
+        wait_for_adapters(disabled)
         print("Checking to see if internet connection is restored...")
         if test_several_ips():
             print("That fixed it. You should be able to connect now.")
@@ -182,15 +281,19 @@ def reset_adapters():
         else:
             print("We're still unable to connect to the internet.")
             win.invalidate_network_state_cache()
+    elif len(to_disable) > 0:
+        print("We were unable to disable any of your physical network adapters.")
     else:
         print("We were unable to find any enabled physical network adapters.")
 
     return False
 
-def check_for_static_ips():
-    log.log("Running check_for_static_ips routine.")
-    ip_conf_adapters = win.get_ip_config()[1]
-    adapters = win.get_network_adapters()
+# Returns the names of the enabled hardware adapters that have DHCP disabled.
+@Metrics.routine
+def find_static_ip_adapters(snapshot=None):
+    log.log_routine("find_static_ip_adapters")
+    adapters, (_, ip_conf_adapters) = snapshot or win.get_network_snapshot()
+    static_adapters = []
 
     log.log("Cross-referencing ipconfig and Get-NetAdapters to find hardware adapters with DHCP disabled and no link.")
     log.log("To detect no link, we reference the 'ifOperStatus'")
@@ -220,26 +323,39 @@ def check_for_static_ips():
                     break
         
         if static_ip_hardware:
-            print("It seems you have a network adapter with DHCP disabled (static IP)")
-            print("Static IPs are a fairly advanced feature.")
-            print("Are you aware that your computer was configured this way?")
-            if get_confirmation():
-                print("Try disabling it, and then we'll check your connection after that.")
-                print("\nDo you want us to test your connection now?")
-                if get_confirmation() and test_several_ips():
-                    print("Great, it worked! Good luck figuring out why the IP was a problem, though.")
-                    return True
-                win.invalidate_network_state_cache()
-            else:
-                print("Issues with this feature are difficult to fix with a program like this.")
-                print("The feature is also intentially and usually configured in a specific way.")
-                print("We will continue trying other things to fix it.")
-                print("If we cannot, I advise you to contact whoever set your network up.")
+            static_adapters.append(name)
+    return static_adapters
+
+# `static_adapters` is what `find_static_ip_adapters` returned, if it's already been run.
+@Metrics.routine
+def check_for_static_ips(static_adapters=None):
+    log.log_routine("check_for_static_ips")
+    if static_adapters is None:
+        static_adapters = find_static_ip_adapters()
+
+    for name in static_adapters:
+        log.log(f"Adapter {name} is both a 'HardwareInterface' and has DHCP disabled")
+        print("It seems you have a network adapter with DHCP disabled (static IP)")
+        print("Static IPs are a fairly advanced feature.")
+        print("Are you aware that your computer was configured this way?")
+        if get_confirmation():
+            print("Try disabling it, and then we'll check your connection after that.")
+            print("\nDo you want us to test your connection now?")
+            if get_confirmation() and test_several_ips():
+                print("Great, it worked! Good luck figuring out why the IP was a problem, though.")
+                return True
+            win.invalidate_network_state_cache()
+        else:
+            print("Issues with this feature are difficult to fix with a program like this.")
+            print("The feature is also intentially and usually configured in a specific way.")
+            print("We will continue trying other things to fix it.")
+            print("If we cannot, I advise you to contact whoever set your network up.")
     
     return False
 
+@Metrics.routine
 def check_for_down_adapters():
-    log.log("Running check_for_down_adapters routine.")
+    log.log_routine("check_for_down_adapters")
     adapters = win.get_network_adapters()
     
     log.log("Looking for enabled hardware adapters that have an 'ifOperStatus' of 'Down'")
@@ -288,8 +404,7 @@ def check_for_down_adapters():
                             run_test = False
                     
                     if run_test:
-                        pause_until_enter()
-                        if win.get_network_adapter_link_status(name):
+                        if watch_for_link(name, deadline=120):
                             print("We're detecting a connection now.")
                         else:
                             print("We still don't detect a connetion, but we'll test it anyway.")
@@ -319,8 +434,7 @@ def check_for_down_adapters():
                     if not get_confirmation("Are the lights flashing?"):
                         print("Please try another ethernet cable.")
                         print("The goal is to get the lights to flash.")
-                        pause_until_enter()
-                        if win.get_network_adapter_link_status(name):
+                        if watch_for_link(name):
                             got_link = True
                             print("We've detected a connection.")
                             print("We'll test for connectivity.")
@@ -329,7 +443,7 @@ def check_for_down_adapters():
                             print("Testing for a connection anyway.")
                         
                         print("Let's give it a few seconds...")
-                        sleep(5)
+                        wait_for_adapters([name], deadline=5)
                         if test_several_ips():
                             print("Great! That seems to have worked.")
                             return True
@@ -343,7 +457,7 @@ def check_for_down_adapters():
                             print("That's odd. We're still not detecting anything. We'll test it anyway.")
                         
                         print("Let's give it a few seconds to connect...")
-                        sleep(5)
+                        wait_for_adapters([name], deadline=5)
                         if test_several_ips():
                             print("Excellent! We were able to connect to the internet.")
                             return True
@@ -362,8 +476,7 @@ def check_for_down_adapters():
                     else:
                         print("Well, we're still not detecting a connection.")
                         print("Try changing Ethernet cables.")
-                        pause_until_enter()
-                        if win.get_network_adapter_link_status(name):
+                        if watch_for_link(name):
                             got_link = True
                             print("Great, we're detecting a link, so we'll test your network, then.")
                         else:
@@ -416,10 +529,11 @@ def print_instructions_for_dhcp():
     print("Please try rebooting the router by unplugging it, waiting 30 seconds, and plugging it back in.")
     print("If that doesn't work, contact your preferred technomancer.")
 
-def computer_has_DHCP_issue():
-    log.log("Running check_for_no_DHCP routine.")
-    adapters = win.get_network_adapters()
-    ip_conf_adapters_by_name = win.dict_by_name(win.get_ip_config()[1])
+@Metrics.routine
+def computer_has_DHCP_issue(snapshot=None):
+    log.log_routine("check_for_no_DHCP")
+    adapters, (_, ip_conf_adapters) = snapshot or win.get_network_snapshot()
+    ip_conf_adapters_by_name = win.dict_by_name(ip_conf_adapters)
 
     dhcp_issue = False
 
@@ -440,8 +554,9 @@ def computer_has_DHCP_issue():
     
     return dhcp_issue
 
+@Metrics.routine
 def run_dhcp_issues():
-    log.log("Running run_dhcp_issues routine.")
+    log.log_routine("run_dhcp_issues")
     print("Is the problem limited to wireless devices?")
 
     print("Is there another computer on the same network that has a working internet connection?")
@@ -494,7 +609,7 @@ def run_dhcp_issues():
     
     pause_until_enter()
     print("Waiting a few seconds for a connection...")
-    sleep(5)
+    wait_for_adapters(deadline=5)
     if test_several_ips():
         print("Great! That worked!")
         return True
@@ -523,11 +638,14 @@ def print_can_connect_to_router_instructions():
     # TODO: Explain that the router not working or the ISP not working is hard to discern
 
 default_gateways_to_test = []
-def check_connection_to_router():
-    log.log("Running check_connection_to_router routine.")
+# Probes the Default Gateways of the hardware adapters that are up, all at once.
+# Returns (gateways that answered, gateways that didn't).
+@Metrics.routine
+def probe_routers(snapshot=None):
+    log.log_routine("probe_routers")
     default_gateways = []
-    adapters = win.get_network_adapters()
-    ip_conf_adapters_by_name = win.dict_by_name(win.get_ip_config()[1])
+    adapters, (_, ip_conf_adapters) = snapshot or win.get_network_snapshot()
+    ip_conf_adapters_by_name = win.dict_by_name(ip_conf_adapters)
     log.log("Gathering all the adapter's Default Gateways")
     for a in adapters:
         name = a['Name']
@@ -545,27 +663,44 @@ def check_connection_to_router():
             log.log("I don't know what that means! Maybe nothing?")
             continue
 
-        gateway = ip_a.get("Default Gateway")
-        if gateway is not None:
-            gateway = gateway.sub("(Preferred)","")
-            default_gateways.append(gateway)
-            log.log(f"Adapter {name} has a Default Gateway of {gateway}")
+        # Adapters with both an IPv6 and an IPv4 gateway list both.
+        gateways = ip_a.get("Default Gateway") or []
+        if type(gateways) is not list:
+            gateways = [gateways]
+        gateways = [g.replace("(Preferred)","").strip() for g in gateways if g]
+        if len(gateways) > 0:
+            default_gateways += gateways
+            log.log(f"Adapter {name} has a Default Gateway of {', '.join(gateways)}")
         else:
             log.log(f"Adapter {name} does not have a Default Gateway")
     
-    if len(default_gateways) == 0:
+    reachable = []
+    unreachable = []
+    if len(default_gateways) > 0:
+        with ThreadPoolExecutor(max_workers=len(default_gateways), thread_name_prefix="router") as executor:
+            results = list(executor.map(lambda ip: win.probe_ip_connection(ip, refused_counts=True), default_gateways))
+        for gateway, result in zip(default_gateways, results):
+            if result:
+                log.log(f"Router {gateway} answered in {result.rtt * 1000:.1f} ms ({result.method}).")
+                reachable.append(gateway)
+            else:
+                log.log(f"Router {gateway} did not answer: {result.reason}")
+                unreachable.append(gateway)
+    return reachable, unreachable
+
+# `router_results` is what `probe_routers` returned, if it's already been run.
+@Metrics.routine
+def check_connection_to_router(router_results=None):
+    log.log_routine("check_connection_to_router")
+    reachable, unreachable = router_results or probe_routers()
+    if len(reachable) + len(unreachable) == 0:
         print("We couldn't find a router.")
         log.log("No Default Gateways found. Assuming no connection to router.")
     else:
         print("We're going to try to contact your router.")
-        failures = 0
-        successess = 0
-        for gateway in default_gateways:
-            if win.test_ip_connection(gateway):
-                successess += 1
-            else:
-                failures += 1
-                default_gateways_to_test.append(gateway)
+        failures = len(unreachable)
+        successess = len(reachable)
+        default_gateways_to_test.extend(unreachable)
         
         if failures > 0 and successess > 0:
             print("We're detecting multiple routers, and some fail and some succeed.")
@@ -598,9 +733,12 @@ def test_default_gateways_again():
     successess = 0
     failures = 0
     for gateway in default_gateways_to_test:
-        if win.test_ip_connection(gateway):
+        result = win.probe_ip_connection(gateway, refused_counts=True)
+        if result:
+            log.log(f"Router {gateway} answered in {result.rtt * 1000:.1f} ms ({result.method}).")
             successess += 1
         else:
+            log.log(f"Router {gateway} still did not answer: {result.reason}")
             failures += 1
     
     if failures > 0 and successess > 0:
@@ -619,47 +757,36 @@ def run_dhcp_works_cant_connect_to_router():
     # Well, but that doesn't necessarily hold true. Probably a low-priority TODO
     pass
 
-def check_dns_issues():
-    log.log("Running check_dns_issues routine.")
-    log.log("Using system DNS resolver to attempt to query about 'amazon.com'")
-    
-    for domain in domains_to_use:
-        try:
-            log.log(f"Trying to resolve {domain} with system resolver...")
-            socket.getaddrinfo(domain, 53)
-            log.log("DNS query succeeded. DNS check passed.")
-            print("DNS check passed.")
-            return True
-        except socket.gaierror as e:
-            log.log("Domain resolution failed.")
-    
-    print("I'm detecting some issues with DNS. Let me try using a different system.")
-    print("This may take a bit...")
-
-
-    log.log("Using the 'dnspython' library to attempt to query servers about 'amazon.com'.")
-    log.log("'dnspython' is its own DNS resolver, should bypass the system resolver.")
-    log.log("If it does work, something is wrong with the DNS.")
-    log.log("Specifically using `dns.resolver.resolve_at(dns_ip, domain, 'NS')")
-
-    # print("Trying to use a DNS server...")
+dns_check_budget = 5
+# Returns a list of DnsCheck.DnsResult.
+@Metrics.routine
+def query_dns():
+    log.log_routine("query_dns")
+    log.log(f"Resolving {', '.join(domains_to_use)} with the system resolver,")
+    log.log(f"and asking {', '.join(dns_to_use)} directly for their 'NS' records, all at the same time.")
+    log.log("Asking the servers directly uses the 'dnspython' library, which bypasses the system resolver.")
+    log.log("If that works and the system resolver doesn't, something is wrong with the DNS settings.")
+    log.log(f"Everything gets {dns_check_budget} seconds in total.")
+
+    results = DnsCheck.run_dns_matrix(domains_to_use, dns_to_use, budget=dns_check_budget)
+    DnsCheck.log_dns_matrix(results)
+    return results
+
+# `results` is what `query_dns` returned, if it's already been run.
+@Metrics.routine
+def check_dns_issues(results=None):
+    log.log_routine("check_dns_issues")
+    if results is None:
+        results = query_dns()
+
+    if any(r.ok for r in results if r.server == DnsCheck.SYSTEM):
+        log.log("The system resolver resolved at least one domain. DNS check passed.")
+        print("DNS check passed.")
+        return True
 
-    dns_succeeded = False
-    for dns_ip in dns_to_use:
-        for domain in domains_to_use:
-            try:
-                log.log(f"Attempting to resolve '{domain}' using DNS {dns_ip}")
-                response = dns.resolver.resolve_at(dns_ip, domain, "NS")
-                log.log("Resolve attempt succeeded.")
-                dns_succeeded = True
-                break
-            except dns.resolver.LifetimeTimeout as e:
-                log.log(f"LifetimeTimeout error means we could not connect.")
-        
-        if dns_succeeded:
-            break
-    
-    if dns_succeeded:
+    print("I'm detecting some issues with DNS.")
+    if any(r.ok for r in results if r.server != DnsCheck.SYSTEM):
+        log.log("At least one DNS server answered us directly.")
         print("It seems there's something wrong with your DNS system.")
     else:
         print("We were unable to use DNS in any way.")
@@ -675,12 +802,38 @@ def check_dns_issues():
 
 
 
+
 ########## TESTS ##########
+# All of the IPs are tried at once, so a dead network costs about one ping
+# timeout instead of one per IP.
+probe_deadline = 10
+@Metrics.routine
 def test_several_ips():
-    for ip in dns_to_use:
-        if win.test_ip_connection(ip):
-            return True
-    return False
+    log.log(f"Testing connections to {', '.join(dns_to_use)} all at once. The first success wins.")
+    return Probes.first_success(dns_to_use, win.test_ip_connection, deadline=probe_deadline) is not None
+
+# The checks that only look at things, and what each one needs.
+# They're all run at once up front (see Scheduler), and the results are presented
+# (and acted on) one at a time below. The snapshot of the adapters is taken while
+# the internet is being tested, since it's needed whenever the internet is down.
+def offline(internet, snapshot):
+    return not internet
+
+# Everything but the snapshot can be done without: if they run out of time, the
+# internet counts as down, there's no DHCP issue, and the routers, DNS and static
+# IPs are looked at again when they're needed.
+diagnostic_checks = [
+    Scheduler.Check("internet", test_several_ips, budget=30, required=False),
+    Scheduler.Check("snapshot", win.get_network_snapshot, budget=60),
+    Scheduler.Check("dns", lambda internet: query_dns(), needs=["internet"], when=lambda internet: internet,
+                    budget=30, required=False),
+    Scheduler.Check("dhcp", lambda internet, snapshot: computer_has_DHCP_issue(snapshot),
+                    needs=["internet", "snapshot"], when=offline, budget=30, required=False),
+    Scheduler.Check("routers", lambda internet, snapshot: probe_routers(snapshot),
+                    needs=["internet", "snapshot"], when=offline, budget=30, required=False),
+    Scheduler.Check("static_ips", lambda internet, snapshot: find_static_ip_adapters(snapshot),
+                    needs=["internet", "snapshot"], when=offline, budget=30, required=False),
+]
 
 # def test_several_domains():
 #     domains = "microsoft.com", "google.com", "youtube.com"
@@ -720,12 +873,20 @@ try:
         print("In case you are unfamiliar with it in this context, it basically just means something your computer uses to connect to the internet.")
         print()
 
+        ### Hear about adapter changes as they happen, instead of polling for them.
+        AdapterEvents.start()
+
+        ### If Monitor.py has been watching the network, say what it saw.
+        Monitor.report_history(log_dir)
+
         ### Test connection to 1.1.1.1
         print("We'll start by testing your internet connection.")
-        if test_several_ips():
+        checks = Scheduler.run_checks(diagnostic_checks)
+        checks_version = win.state_cache.version
+        if checks["internet"]:
             print("We successfully connected to an internet server.")
             print("We're going to test your DNS.")
-            if check_dns_issues():
+            if check_dns_issues(checks["dns"]):
                 print("We were unable to find any issues.")
                 break
 
@@ -733,7 +894,7 @@ try:
             print("We were unable to connect to any internet servers.")
             print("Instead, we're going to see if we can connect to your router.")
             print("First, we're going to check for an error in automatic network configuration.")
-            dhcp_issues = computer_has_DHCP_issue() # We'll need this value later.
+            dhcp_issues = checks["dhcp"] # We'll need this value later.
             if dhcp_issues:
                 print("We detected an error in the automatic configuration of your network.")
                 print("Your computer has an issue with network configuration.")
@@ -741,7 +902,7 @@ try:
             else:
                 print("Alright, there's no issue with network configuration at the moment.")
                 print("Next, we're going to try connecting to your router.")
-                if check_connection_to_router():
+                if check_connection_to_router(checks["routers"]):
                     print_can_connect_to_router_instructions()
                     break
                 else:
@@ -773,7 +934,8 @@ try:
                 run_dhcp_works_cant_connect_to_router()
 
             ### Check for static IPs.
-            if check_for_static_ips():
+            # If any of the fixes changed something, look again.
+            if check_for_static_ips(checks["static_ips"] if win.state_cache.version == checks_version else None):
                 break
             
             # TODO: Figure out some way to send the log file. (very-high-priorty, this is a very important thing to be able to do)
@@ -792,6 +954,7 @@ try:
             #    - Connection was broken
             #    - DHCP configuration was renewed
             # If connection was broken at the same time DHCP went was renewed, probably DHCP issue.
+            # Note: Monitor.py records exactly this, but only if it was running at the time.
 
             # TODO: Improve detection of Ethernet/Wi-Fi? (low-priority, doesn't change much)
             # Note: Can use CMD Type, PS MediaType, maybe others
@@ -811,12 +974,20 @@ try:
 
     log.log()
     log.log()
+    win.state_cache.log_stats()
+    Deadlines.log_budget()
     log.log("Here's the state of the network stuff after everything's been done.")
-    win.invalidate_network_state_cache()
-    win.get_network_adapters(prop_list_type="default")
-    win.get_ip_config()
+    try:
+        win.get_network_snapshot(force_update=True, prop_list_type="default")
+    except Deadlines.CommandTimedOut as e:
+        log.log(f"We couldn't get it: {e}")
 
 
+except Deadlines.CommandTimedOut as e:
+    log.log_exception(e)
+    print("Windows took too long to answer us, so we've had to stop here.")
+    print_further_instructions(resolved=False)
+
 except Exception as e:
     log.log_exception(e)
     print("The program has run into an error.")
@@ -826,4 +997,8 @@ except Exception as e:
         print("Please send the above error message to the author of this program.")
 
 finally:
+    AdapterEvents.stop()
+    win.close_shell_sessions()
+    Capture.stop_recording()
+    Metrics.log_summary()
     log.clean_up()
@@ -0,0 +1,79 @@
+import time
+import threading
+import functools
+import MyLogger as log
+
+# Keeps track of where a run spends its time: every command, process start,
+# probe, wait and diagnostic routine is recorded here, grouped by
+# (category, name), and `log_summary` writes a table of it all at the end.
+
+class Histogram:
+    def __init__(self):
+        self.samples = []
+        self.total_bytes = 0
+
+    def add(self, seconds, output_bytes=None):
+        self.samples.append(seconds)
+        if output_bytes is not None:
+            self.total_bytes += output_bytes
+
+    def percentile(self, p):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+_histograms = {}  # (category, name): Histogram
+_lock = threading.Lock()
+
+def record(category, name, seconds, output_bytes=None):
+    with _lock:
+        histogram = _histograms.get((category, name))
+        if histogram is None:
+            histogram = _histograms[(category, name)] = Histogram()
+        histogram.add(seconds, output_bytes)
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+# Turns a command into the kind of command it is, so that e.g. all the
+# `Enable-NetAdapter -name '...'` calls are counted together.
+def command_type(command):
+    if command.startswith("powershell.exe "):
+        command = command[len("powershell.exe "):]
+    words = command.replace("@(", " ").split()
+    if len(words) == 0:
+        return "(empty)"
+    if words[0] == "ConvertTo-Json" and "Get-NetAdapter" in words:
+        return "Get-NetAdapter (json)"
+    return words[0]
+
+# Used as a decorator on the diagnostic routines, to time each of them.
+def routine(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record("routine", function.__name__, time.perf_counter() - start)
+    return wrapper
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}ms" if seconds < 10 else f"{seconds:.1f}s"
+
+def log_summary():
+    with _lock:
+        items = sorted(_histograms.items(), key=lambda item: (item[0][0], -sum(item[1].samples)))
+
+    if len(items) == 0:
+        return
+    rows = [["category", "name", "count", "p50", "p95", "max", "total", "output"]]
+    for (category, name), h in items:
+        rows.append([category, name, str(len(h.samples)), _ms(h.percentile(0.5)), _ms(h.percentile(0.95)),
+                     _ms(max(h.samples)), _ms(sum(h.samples)), f"{h.total_bytes:,}B" if h.total_bytes else ""])
+
+    widths = [max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+    log.log("")
+    log.log("Timing summary:")
+    for row in rows:
+        log.log(" | ".join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip())
@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+import collections
+import MyLogger as log
+import WinterfacePS as win
+import Probes
+import Metrics
+import AdapterEvents
+
+print = log.log_print
+
+# Watches the network in the background, so that a later troubleshooting run can
+# tell *when* things went wrong: when the connection broke, when an adapter lost
+# its link, and whether DHCP renewed at the same moment.
+#
+# Every `interval` seconds, or as soon as an adapter event says something changed,
+# it takes one batched snapshot (Get-NetAdapter and ipconfig, through the
+# persistent shell) and races a few probes. The most recent samples are kept in
+# a fixed-size ring buffer, and only the *changes* between samples are written to
+# disk, so it can run for weeks with flat memory and a history file that only
+# grows when something actually happens.
+#
+# The history file is JSON lines. The first line (and the first one after every
+# restart) has the whole state, the rest only what changed:
+#   {"time": 1760771643.2, "state": {"internet": true, "adapters": {"Ethernet": {...}}}}
+#   {"time": 1760771703.4, "changes": [["Ethernet", "ifOperStatus", "Up", "Down"], [null, "internet", true, false]]}
+#
+# Usage: python Monitor.py [log directory] [interval in seconds]
+
+HISTORY_FILE = "monitor_history.jsonl"
+
+_adapter_fields = ["AdminStatus", "ifOperStatus"]
+_ip_fields = ["IPv4 Address", "Autoconfiguration IPv4 Address", "Default Gateway", "DHCP Server", "Lease Obtained"]
+
+# Returns {"internet": bool, "adapters": {name: {field: value}}} for the hardware adapters.
+def take_sample(probe_targets=("1.1.1.1", "8.8.8.8"), timeout=2):
+    adapters, (_, ip_adapters) = win.get_network_snapshot(force_update=True, display=False)
+    ip_adapters = win.dict_by_name(ip_adapters)
+    state = {}
+    for a in adapters:
+        if a['HardwareInterface'] != "True":
+            continue
+        fields = {f: a[f] for f in _adapter_fields if f in a}
+        ip_a = ip_adapters.get(a['Name'], {})
+        fields.update({f: ip_a[f] for f in _ip_fields if f in ip_a})
+        state[a['Name']] = fields
+
+    winner = Probes.first_success(probe_targets, lambda ip: Probes.probe_ip(ip, timeout=timeout), deadline=timeout)
+    return {"internet": winner is not None, "adapters": state}
+
+# Returns a list of [adapter, field, old, new]. `adapter` is None for "internet",
+# and an adapter appearing or disappearing is a change of its "present" field
+# (followed by all its fields, if it appeared).
+def diff_samples(old, new):
+    changes = []
+    if old["internet"] != new["internet"]:
+        changes.append([None, "internet", old["internet"], new["internet"]])
+    for name in list(old["adapters"]) + [n for n in new["adapters"] if n not in old["adapters"]]:
+        old_fields = old["adapters"].get(name)
+        new_fields = new["adapters"].get(name)
+        if old_fields is None or new_fields is None:
+            changes.append([name, "present", old_fields is not None, new_fields is not None])
+            if new_fields is not None:
+                changes += [[name, field, None, value] for field, value in new_fields.items()]
+            continue
+        for field in list(old_fields) + [f for f in new_fields if f not in old_fields]:
+            if old_fields.get(field) != new_fields.get(field):
+                changes.append([name, field, old_fields.get(field), new_fields.get(field)])
+    return changes
+
+
+class NetworkMonitor:
+    def __init__(self, log_dir=".", interval=30, history_size=120, max_bytes=1024 * 1024):
+        self.path = os.path.join(log_dir, HISTORY_FILE)
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.samples = collections.deque(maxlen=history_size)  # (time, sample), most recent last
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Takes one sample, and writes down whatever changed. Returns the changes.
+    def sample(self):
+        now = time.time()
+        sample = take_sample()
+        # The metrics are only summarised at the end of a troubleshooting run, so
+        # here they'd just pile up.
+        Metrics.reset()
+        self.samples.append((now, sample))
+
+        if self._last is None:
+            self._write({"time": now, "state": sample})
+            changes = []
+        else:
+            changes = diff_samples(self._last, sample)
+            if changes:
+                self._write({"time": now, "changes": changes})
+        self._last = sample
+        return changes
+
+    def _write(self, record):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+            # Keep one older file, and start the new one with the whole state.
+            os.replace(self.path, self.path + ".1")
+            if "state" not in record:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps({"time": record["time"], "state": self._last}) + "\n")
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                for adapter, field, old, new in self.sample():
+                    log.log_print(f"{_format_time(time.time())}  {_describe_change(adapter, field, old, new)}")
+            except Exception as e:  # e.g. PowerShell being restarted. Try again next time.
+                log.log_exception(e)
+            if AdapterEvents.running():
+                AdapterEvents.wait_for_change(self.interval, until=self._stop.is_set)
+            else:
+                self._stop.wait(self.interval)
+
+    # Runs the monitor on a background thread.
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        AdapterEvents.wake()
+        if self._thread is not None:
+            self._thread.join()
+
+
+########## Reading the history ##########
+# Returns a list of (time, [adapter, field, old, new]), oldest first, from the
+# history files in `log_dir`. Anything that changed while the monitor wasn't
+# running shows up as a change at the time it was started again.
+def read_history(log_dir="."):
+    path = os.path.join(log_dir, HISTORY_FILE)
+    events = []
+    state = None
+    for p in (path + ".1", path):
+        if not os.path.exists(p):
+            continue
+        with open(p) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # Cut off by the computer being turned off
+                    continue
+                if "state" in record:
+                    if state is not None:
+                        events += [(record["time"], c) for c in diff_samples(state, record["state"])]
+                    state = record["state"]
+                elif state is not None:
+                    for change in record["changes"]:
+                        _apply_change(state, change)
+                        events.append((record["time"], change))
+    return events
+
+def _apply_change(state, change):
+    adapter, field, _, new = change
+    if adapter is None:
+        state["internet"] = new
+    elif field == "present":
+        if new:
+            state["adapters"][adapter] = {}
+        else:
+            state["adapters"].pop(adapter, None)
+    elif new is None:
+        state["adapters"].get(adapter, {}).pop(field, None)
+    else:
+        state["adapters"].setdefault(adapter, {})[field] = new
+
+def _format_time(t):
+    return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+
+def _describe_change(adapter, field, old, new):
+    if adapter is None:
+        return "The internet connection " + ("came back." if new else "went down.")
+    if field == "present":
+        return f"{adapter} " + ("appeared." if new else "disappeared.")
+    if field == "Lease Obtained" and new is None:
+        return f"{adapter} has no DHCP lease any more."
+    if field == "Lease Obtained":
+        return f"{adapter} renewed its DHCP lease ({new})."
+    return f"{adapter}: {field} changed from {old} to {new}."
+
+# Writes what the monitor saw in the last `hours` to the log, and tells the user
+# about the last time the connection went down. Does nothing if it wasn't running.
+def report_history(log_dir=".", hours=48, window=120):
+    if not os.path.exists(os.path.join(log_dir, HISTORY_FILE)):
+        return
+    events = [e for e in read_history(log_dir) if e[0] >= time.time() - hours * 3600]
+    log.log(f"The network monitor's history for the last {hours} hours:")
+    for t, change in events:
+        log.log(f"    {_format_time(t)}  {_describe_change(*change)}")
+    if len(events) == 0:
+        log.log("    Nothing changed.")
+
+    drops = [t for t, (adapter, field, _, new) in events if adapter is None and new is False]
+    if len(drops) == 0:
+        return
+    dropped = drops[-1]
+    print(f"The network monitor saw your internet connection go down at {_format_time(dropped)}.")
+    nearby = [(t, c) for t, c in events if c[0] is not None and abs(t - dropped) <= window]
+    renewals = [c[0] for t, c in nearby if c[1] == "Lease Obtained" and c[3] is not None]
+    if renewals:
+        print(f"{', '.join(sorted(set(renewals)))} renewed a DHCP lease at about the same time.")
+        log.log("A DHCP renewal at the same time the connection broke points towards a DHCP issue.")
+    for t, change in nearby:
+        if change[1] != "Lease Obtained" or change[3] is None:
+            log.log(f"Around then: {_format_time(t)}  {_describe_change(*change)}")
+
+
+if __name__ == "__main__":
+    log_dir = sys.argv[1] if len(sys.argv) > 1 else "."
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+    monitor = NetworkMonitor(log_dir, interval)
+    print(f"Monitoring the network every {interval:g}s. Changes go to {monitor.path}. Press Ctrl+C to stop.")
+    try:
+        AdapterEvents.start()
+        monitor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        AdapterEvents.stop()
+        win.close_shell_sessions()
@@ -1,10 +1,20 @@
+import os
+import re
 import sys
+import gzip
+import json
+import time
+import shutil
+import collections
+import threading
 import traceback
 
 from colorama import just_fix_windows_console
 just_fix_windows_console()
 
 log_file = None
+event_file = None
+_lock = threading.RLock()  # Probes run in threads, and their log lines shouldn't get mixed up.
 
 class colors:
     CSI = '\033['
@@ -20,65 +30,288 @@ class con_codes:
 def clear_screen():
     print(con_codes.CLEAR_SCREEN + con_codes.CURSUR_TOP_LEFT,end='')
 
-def setup_logfile(filename):
-    global log_file
+# Writing to the log file happens on a background thread, so logging doesn't
+# slow down the program (the log might well be on a slow flash drive).
+# Everything written to the log is appended to `_pending`, which the writer thread
+# empties in batches. Appending to a deque is about as cheap as it gets, which
+# matters since almost every line of the program logs something.
+# `_pending` is bounded: past `_MAX_PENDING` items, logging waits for the writer
+# to catch up rather than piling up memory. `flush()` waits until everything
+# logged so far is on disk.
+_pending = collections.deque()
+_wakeup = threading.Event()
+_writer = None
+_MAX_PENDING = 8192
+_WRITE_INTERVAL = 0.2  # seconds
+
+# If writing ever fails (e.g. the flash drive the logs are on was pulled out, or
+# is full), that's said once on the console, and everything after it is thrown
+# away. Flushes still finish, so nothing waits on a log that can't be written.
+def _write_log_file(file):
+    failed = False
+    while True:
+        _wakeup.wait(_WRITE_INTERVAL)
+        _wakeup.clear()
+
+        batch = []
+        flushes = []
+        stop = False
+        try:
+            while _pending:
+                item = _pending.popleft()
+                if type(item) is threading.Event:
+                    flushes.append(item)
+                if failed:
+                    stop = stop or item is None
+                    continue
+                if type(item) is str:
+                    batch.append(item)
+                    continue
+
+                file.write("".join(batch))
+                batch = []
+                if item is None:
+                    stop = True
+                    break
+                elif type(item) is dict:  # An event
+                    if event_file is not None:
+                        event_file.write(json.dumps(item, default=str) + "\n")
+                elif type(item) is threading.Event:  # A flush request
+                    file.flush()
+                    if event_file is not None:
+                        event_file.flush()
+                else:
+                    _write_command_execution(file, *item)
+
+            if not failed:
+                file.write("".join(batch))
+        except Exception as e:
+            failed = True
+            sys.stderr.write(f"Couldn't write the log file, so the rest of this run won't be logged: {e!r}\n")
+        finally:
+            for done in flushes:
+                done.set()
+
+        if stop:
+            for f in (file, event_file):
+                try:
+                    if f is not None:
+                        f.close()
+                except OSError:
+                    pass
+            return
+
+def _enqueue(item):
+    _pending.append(item)
+    if len(_pending) >= _MAX_PENDING:
+        flush()
+
+# If `event_filename` is given, typed events (see `log_event`) are also written
+# there, one JSON object per line, so tools can read runs without parsing the log.
+def setup_logfile(filename, event_filename=None):
+    global log_file, event_file, _writer
     clean_up()
     log_file = open(filename, "w")
+    if event_filename is not None:
+        event_file = open(event_filename, "w")
+    _writer = threading.Thread(target=_write_log_file, args=(log_file,), name="log-writer", daemon=True)
+    _writer.start()
+
+# Keeps the logs in a directory as log_1.txt, log_2.txt, ...
+# Looking for the next free number one file at a time gets slower with every run,
+# so the next number is kept in an index file (and found with a single directory
+# scan if the index is missing or wrong).
+# Logs from earlier runs are gzipped, and the oldest ones are deleted once there
+# are more than `max_logs` of them or they take up more than `max_bytes`. That way
+# the folder stays small enough to email.
+LOG_INDEX_FILE = "log_index"
+_log_name_re = re.compile(r"^log_(\d+)\.(txt|jsonl|capture)(\.gz)?$")
+
+# Returns {number: set of file names} for all the logs (and event logs and captures) in `log_dir`.
+def _scan_logs(log_dir):
+    logs = {}
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            match = _log_name_re.match(entry.name)
+            if match is not None:
+                logs.setdefault(int(match.group(1)), set()).add(entry.name)
+    return logs
+
+def _next_log_number(log_dir, logs):
+    index_path = os.path.join(log_dir, LOG_INDEX_FILE)
+    try:
+        with open(index_path) as f:
+            number = int(f.read().strip())
+        if number not in logs and (not logs or number > max(logs)):
+            return number
+    except (OSError, ValueError):
+        pass
+    return max(logs, default=0) + 1
+
+# The .gz only appears once it's complete, and the original is removed after that.
+def _compress_log(path):
+    try:
+        with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    except OSError:
+        try:
+            os.remove(path + ".gz.tmp")
+        except OSError:
+            pass
+        raise
+    os.replace(path + ".gz.tmp", path + ".gz")
+    os.remove(path)
+
+def _tidy_logs(log_dir, logs, max_logs, max_bytes):
+    sizes = {}  # number: ([paths], total size)
+    for number, names in logs.items():
+        paths = []
+        for name in names:
+            path = os.path.join(log_dir, name)
+            if name.endswith(".gz"):
+                pass
+            elif name + ".gz" in names:
+                # Compressed already, but removing the original failed. If it still
+                # can't be, it's counted and deleted along with the rest of its log.
+                try:
+                    os.remove(path)
+                    continue
+                except OSError:
+                    pass
+            else:
+                try:
+                    _compress_log(path)
+                    path += ".gz"
+                except OSError:  # Maybe it's open somewhere. Leave it be.
+                    pass
+            paths.append(path)
+        sizes[number] = (paths, sum(os.path.getsize(p) for p in paths))
+
+    # Delete the oldest until we're under both caps.
+    total = sum(size for _, size in sizes.values())
+    for number in sorted(sizes):
+        if len(sizes) <= max_logs and total <= max_bytes:
+            break
+        paths, size = sizes.pop(number)
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+# Sets up logging to the next log file in `log_dir`, and returns its path.
+# With `events=True`, the typed events go to a matching log_N.jsonl.
+# The new log doesn't count towards the caps, so there can be `max_logs` old ones.
+def setup_log_dir(log_dir, max_logs=20, max_bytes=10 * 1024 * 1024, events=False):
+    logs = _scan_logs(log_dir)
+    number = _next_log_number(log_dir, logs)
+    _tidy_logs(log_dir, logs, max_logs, max_bytes)
+
+    with open(os.path.join(log_dir, LOG_INDEX_FILE), "w") as f:
+        f.write(f"{number + 1}\n")
+
+    path = os.path.join(log_dir, f"log_{number}.txt")
+    setup_logfile(path, os.path.join(log_dir, f"log_{number}.jsonl") if events else None)
+    return path
 
 def logger_active():
     return log_file is not None
 
-def log_print(*args, display=True, log=True, prefix="", color="", **kwargs):
+# Waits until everything logged so far has been written to the file.
+def flush():
+    if _writer is None:
+        return
+    done = threading.Event()
+    _pending.append(done)
+    _wakeup.set()
+    while not done.wait(1):
+        if not _writer.is_alive():  # Nothing's left to do the writing.
+            return
+
+def log_print(*args, display=True, log=True, prefix="", color="", sep=" ", end="\n", **kwargs):
+    text = sep.join([a if type(a) is str else str(a) for a in args]) + end
     if display:
-        print(color + prefix, end='')
-        print(*args, **kwargs)
-        print(colors.NORMAL,end='')
-        sys.stdout.flush()
+        with _lock:
+            sys.stdout.write(color + prefix + text + colors.NORMAL)
+            sys.stdout.flush()
 
     if log and log_file:
-        print(prefix, file=log_file, end='')
-        print(*args, **kwargs, file=log_file)
+        _enqueue(prefix + text)
 
 def log(*args, prefix="### ", **kwargs):
     log_print(*args, display=False, prefix=prefix, **kwargs)
 
+# Records a typed event, e.g. log_event("probe", target="1.1.1.1", success=True).
+# Events only go to the event file, not the text log.
+def log_event(event_type, **fields):
+    if event_file is not None:
+        _enqueue({"type": event_type, "time": time.time(), **fields})
+
+def log_routine(name):
+    log(f"Running {name} routine.")
+    log_event("routine", name=name)
+
+# If set, answers are read with this instead of `input` (used to capture and replay them).
+read_input = None
+
 def log_input(prompt=""):
-    result = input(prompt)
+    result = (read_input or input)(prompt)
     
     if log_file:
-        log_file.write(f"{prompt}{result}\n")
+        _enqueue(f"{prompt}{result}\n")
+    log_event("input", prompt=prompt, answer=result)
 
     return result
 
 def print_command_execution(command):
     log_print(command, color=colors.COMMAND, prefix="$ ")
     
+def log_command_start(command):
+    log_event("command_start", command=command)
 
-def log_command_execution(command, output):
-    if log_file:
-        log_file.write(f"\n### Running command: `{command}`")
-        log_file.write(f"\n### ============ COMMAND OUTPUT ============\n")
-        if type(output) == bytes:
-            output = output.decode()
-        # output = re.sub("\r+", "", output)
-        output = "### " + output.replace("\r","").replace("\n","\n### ")
-        log_file.write(output)
-        log_file.write(f"\n### ========== END COMMAND OUTPUT ==========\n")
-        log_file.write(f"")
+# `output` can be bytes, a string, or a list of lines (without line endings).
+# The lines are handed to the writer thread as they are, and it streams them
+# into the file, instead of the whole prefixed output being built up here.
+def log_command_execution(command, output, exit_code=None, duration=None):
+    if not log_file:
+        return
+    if type(output) == bytes:
+        output = output.decode()
+    if type(output) == str:
+        output = output.replace("\r", "").split("\n")
+    _enqueue((command, output))
+    if event_file is not None:
+        log_event("command_finish", command=command, exit_code=exit_code, duration=duration,
+                  output_lines=len(output), output_bytes=sum(len(line) + 1 for line in output))
+
+def _write_command_execution(file, command, lines):
+    file.write(f"\n### Running command: `{command}`")
+    file.write("\n### ============ COMMAND OUTPUT ============\n")
+    for line in lines:
+        file.write("### ")
+        file.write(line)
+        file.write("\n")
+    file.write("### ========== END COMMAND OUTPUT ==========\n")
 
 def log_exception(e):
     if log_file is not None:
         for line in traceback.format_exception(e):
             log_print(line, display=False)
+        flush()
     else:
         traceback.print_exception(e)
 
 def clean_up():
-    global log_file
+    global log_file, event_file, _writer
     if log_file:
-        log_file.close()
+        _pending.append(None)
+        _wakeup.set()
+        _writer.join()
     
     log_file = None
+    event_file = None
+    _writer = None
 
 
 if __name__ == "__main__":
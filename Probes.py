@@ -0,0 +1,249 @@
+import os
+import time
+import socket
+import struct
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import MyLogger as log
+
+# Probing several targets one after another means that when the network is down,
+# we wait for every single timeout in turn. Instead, fire them all at once and
+# stop as soon as one of them gets through.
+
+# Runs `probe(target)` for every target at the same time, and stops at the first
+# truthy result. Returns (winning_target, winning_result, {target: result}), where
+# the winner is None if they all failed or `deadline` (seconds) ran out first.
+# Probes that haven't started yet are cancelled. Ones already running can't be
+# interrupted, so they're left to finish in the background and their results ignored.
+def race(targets, probe, deadline=10):
+    targets = list(targets)
+    results = {}
+    if len(targets) == 0:
+        return None, None, results
+
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="probe")
+    try:
+        pending = {executor.submit(probe, t): t for t in targets}
+        while pending:
+            remaining = deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                log.log(f"Probe deadline of {deadline}s ran out with {len(pending)} probe(s) unfinished.")
+                return None, None, results
+
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                target = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log.log(f"Probe of {target} raised an exception: {e!r}")
+                    continue
+                results[target] = result
+                if result:
+                    log.log(f"Probe of {target} succeeded after {time.monotonic() - start:.2f}s. Cancelling the rest.")
+                    return target, result, results
+        return None, None, results
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Same as `race`, but only returns the target that succeeded first (or None).
+def first_success(targets, probe, deadline=10):
+    return race(targets, probe, deadline)[0]
+
+
+
+
+
+########## Native probes ##########
+# These check whether a host is reachable without starting any processes.
+# Each one returns a ProbeResult, which is truthy if the host answered.
+
+class ProbeResult:
+    def __init__(self, target, method, success, rtt=None, reason="", unsupported=False):
+        self.target = target
+        self.method = method
+        self.success = success
+        self.rtt = rtt                  # Round-trip time in seconds, if we got an answer.
+        self.reason = reason            # Why it failed (or a note on how it succeeded).
+        self.unsupported = unsupported  # This probe type can't be used here at all.
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        if self.success:
+            return f"<{self.method} {self.target}: OK in {self.rtt * 1000:.1f} ms{', ' + self.reason if self.reason else ''}>"
+        return f"<{self.method} {self.target}: FAILED ({self.reason})>"
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+# Probes run on several threads at once, and next() on a count is atomic.
+_icmp_sequences = itertools.count(1)
+
+_icmp_errors = {3: "destination unreachable", 11: "time exceeded"}
+
+# The sequence number of the echo request to `ip` quoted in an ICMP error, or None.
+def _quoted_echo(quoted, ip):
+    if len(quoted) < 20 or (quoted[0] >> 4) != 4 or socket.inet_ntoa(quoted[16:20]) != ip:
+        return None
+    request = quoted[(quoted[0] & 0x0F) * 4:]
+    if len(request) < 8 or request[0] != 8:
+        return None
+    return struct.unpack("!H", request[6:8])[0]
+
+# Sends one ICMP echo request.
+# Linux (and macOS) allow unprivileged "ping sockets" (SOCK_DGRAM). On Windows we
+# need a raw socket, which works because the troubleshooter runs as administrator.
+def icmp_probe(ip, timeout=2):
+    method = "ICMP"
+    if ":" in ip:
+        return ProbeResult(ip, method, False, reason="IPv6 ICMP is not implemented", unsupported=True)
+
+    sock = None
+    for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(socket.AF_INET, sock_type, socket.IPPROTO_ICMP)
+            break
+        except OSError:
+            continue
+    if sock is None:
+        return ProbeResult(ip, method, False, reason="ICMP sockets not permitted", unsupported=True)
+
+    with sock:
+        sequence = next(_icmp_sequences) & 0xFFFF
+        ident = os.getpid() & 0xFFFF
+        payload = struct.pack("!d", time.time()) + b"network-troubleshooter"
+        header = struct.pack("!BBHHH", 8, 0, 0, ident, sequence)
+        packet = struct.pack("!BBHHH", 8, 0, _checksum(header + payload), ident, sequence) + payload
+
+        start = time.perf_counter()
+        try:
+            sock.sendto(packet, (ip, 0))
+            while True:
+                remaining = timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    return ProbeResult(ip, method, False, reason="timed out")
+                sock.settimeout(remaining)
+                data, address = sock.recvfrom(1024)
+
+                # Raw sockets hand us the IP header too.
+                if sock.type == socket.SOCK_RAW and len(data) >= 20 and (data[0] >> 4) == 4:
+                    data = data[(data[0] & 0x0F) * 4:]
+                if len(data) < 8:
+                    continue
+
+                reply_type, code, _, _, reply_sequence = struct.unpack("!BBHHH", data[:8])
+                if reply_type in _icmp_errors:
+                    # These come from a router on the way, and quote the IP header and
+                    # the first 8 bytes of the request they're about.
+                    if _quoted_echo(data[8:], ip) != sequence:
+                        continue
+                    return ProbeResult(ip, method, False,
+                                       reason=f"{_icmp_errors[reply_type]} (code {code}, from {address[0]})")
+
+                # A raw socket sees every echo reply, including ones to the other probes.
+                if address[0] != ip:
+                    continue
+                # The kernel rewrites the identifier of SOCK_DGRAM pings, so match on the rest.
+                if reply_type != 0 or reply_sequence != sequence or data[8:] != payload:
+                    continue
+                return ProbeResult(ip, method, True, rtt=time.perf_counter() - start)
+        except socket.timeout:
+            return ProbeResult(ip, method, False, reason="timed out")
+        except OSError as e:
+            return ProbeResult(ip, method, False, reason=str(e))
+
+
+# Opens a TCP connection. A refused connection only counts if `refused_counts`:
+# the RST could have come from a firewall or captive portal on the way rather than
+# from `ip`, so that's only good enough for the router, which is the first hop anyway.
+def tcp_probe(ip, port, timeout=2, refused_counts=False):
+    method = f"TCP/{port}"
+    start = time.perf_counter()
+    try:
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect((ip, port))
+        return ProbeResult(ip, method, True, rtt=time.perf_counter() - start)
+    except ConnectionRefusedError:
+        if refused_counts:
+            return ProbeResult(ip, method, True, rtt=time.perf_counter() - start, reason="connection refused, but the host answered")
+        return ProbeResult(ip, method, False, reason="connection refused")
+    except socket.timeout:
+        return ProbeResult(ip, method, False, reason="timed out")
+    except OSError as e:
+        return ProbeResult(ip, method, False, reason=str(e))
+
+
+# Returns (id, packet) for a DNS query of `domain`'s A record.
+def dns_query(domain):
+    query_id = int.from_bytes(os.urandom(2), "big")
+    question = b"".join(bytes([len(p)]) + p.encode() for p in domain.split(".")) + b"\0"
+    return query_id, struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0) + question + struct.pack("!HH", 1, 1)
+
+# The response code of `data` if it's the answer to query `query_id`, or None.
+def dns_rcode(data, query_id):
+    if len(data) >= 12 and struct.unpack("!H", data[:2])[0] == query_id:
+        return data[3] & 0x0F
+    return None
+
+# Sends a DNS query over UDP. Any well-formed answer means the server is reachable,
+# whatever the response code is.
+def dns_probe(ip, timeout=2, port=53, domain="google.com"):
+    method = f"DNS/{port}"
+    query_id, query = dns_query(domain)
+
+    start = time.perf_counter()
+    try:
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            sock.sendto(query, (ip, port))
+            while True:
+                remaining = timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    return ProbeResult(ip, method, False, reason="timed out")
+                sock.settimeout(remaining)
+                data, _ = sock.recvfrom(4096)
+                rcode = dns_rcode(data, query_id)
+                if rcode is not None:
+                    return ProbeResult(ip, method, True, rtt=time.perf_counter() - start, reason=f"rcode {rcode}")
+    except socket.timeout:
+        return ProbeResult(ip, method, False, reason="timed out")
+    except OSError as e:
+        return ProbeResult(ip, method, False, reason=str(e))
+
+
+# The probes `probe_ip` uses, by name. TCP to 53 and 443 are the fallbacks for when
+# ICMP is blocked or not permitted, since DNS servers and routers usually listen on one.
+# Each is called with (ip, timeout, refused_counts).
+probe_types = {
+    "icmp": lambda ip, timeout, refused_counts: icmp_probe(ip, timeout),
+    "tcp53": lambda ip, timeout, refused_counts: tcp_probe(ip, 53, timeout, refused_counts),
+    "tcp443": lambda ip, timeout, refused_counts: tcp_probe(ip, 443, timeout, refused_counts),
+    "dns": lambda ip, timeout, refused_counts: dns_probe(ip, timeout),
+}
+default_probes = ("icmp", "tcp53", "tcp443", "dns")
+
+# Tries every probe type on `ip` at once, and returns the first one to succeed.
+# If none do, returns a failed ProbeResult that lists why each of them failed.
+# `refused_counts` is for routers (see `tcp_probe`), never for internet checks.
+def probe_ip(ip, probes=default_probes, timeout=2, refused_counts=False):
+    winner, result, results = race(probes, lambda name: probe_types[name](ip, timeout, refused_counts),
+                                   deadline=timeout + 1)
+    if winner is not None:
+        return result
+
+    reasons = "; ".join(f"{r.method}: {r.reason}" for r in results.values() if not r.unsupported)
+    if reasons == "":
+        reasons = "no usable probe types"
+    return ProbeResult(ip, "any", False, reason=reasons)
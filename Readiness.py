@@ -0,0 +1,128 @@
+import MyLogger as log
+import WinterfacePS as win
+import Metrics
+import Capture
+import AdapterEvents
+
+# After an adapter is enabled or reset, we used to just sleep for a fixed amount of
+# time before testing the connection. A healthy adapter is usually back in a couple
+# of seconds, though, so instead we poll until it's actually usable.
+#
+# "Usable" is checked in stages, and each stage is only checked once the previous
+# one has passed:
+#   1. link: at least one of the adapters has an 'ifOperStatus' of 'Up'
+#   2. address: that adapter has an IPv4 address that isn't an autoconfig (169.254.x.x) one
+#   3. connectivity: `connectivity_check()` returns True (skipped if not given)
+#
+# While adapter events are running, the first two stages don't poll: the state
+# comes from the cache, which the events keep up to date, and the wait in between
+# ends as soon as an adapter changes. Events can be missed, so if none come for
+# `event_timeout` seconds, the state is fetched again anyway.
+
+def _has_usable_address(ip_adapter):
+    if ip_adapter is None:
+        return False
+    address = ip_adapter.get("IPv4 Address")
+    if isinstance(address, list):
+        address = address[0] if address else None
+    if not address:
+        return False
+    return not address.startswith("169.254.")
+
+# Returns True as soon as the adapters are usable, or False once `deadline` seconds
+# have passed. `adapter_names` of None means every hardware adapter.
+# The delay between polls starts at `first_delay` and doubles up to `max_delay`.
+def wait_until_ready(adapter_names=None, connectivity_check=None, deadline=20, first_delay=0.5, max_delay=4,
+                     event_timeout=5):
+    start = Capture.monotonic()
+    stage_times = {}
+    delay = first_delay
+    events = AdapterEvents.running()
+    force_update = True
+    log.log(f"Waiting up to {deadline}s for adapters to become usable: "
+          + ("all hardware adapters" if adapter_names is None else ", ".join(adapter_names)))
+
+    def elapsed():
+        return Capture.monotonic() - start
+
+    while True:
+        up = []
+        for a in win.get_network_adapters(force_update=force_update):
+            if adapter_names is None:
+                if a['HardwareInterface'] != "True":
+                    continue
+            elif a['Name'] not in adapter_names:
+                continue
+            if a['ifOperStatus'] == "Up":
+                up.append(a['Name'])
+
+        if up:
+            stage_times.setdefault("link", elapsed())
+            ip_adapters = win.dict_by_name(win.get_ip_config(force_update=force_update)[1])
+            if any(_has_usable_address(ip_adapters.get(name)) for name in up):
+                stage_times.setdefault("address", elapsed())
+                if connectivity_check is None or connectivity_check():
+                    stage_times.setdefault("connectivity", elapsed())
+                    break
+
+        remaining = deadline - elapsed()
+        if remaining <= 0:
+            reached = ", ".join(f"{stage} at {t:.1f}s" for stage, t in stage_times.items()) or "nothing"
+            log.log(f"Adapters were not usable after {deadline}s. Reached: {reached}.")
+            Metrics.record("wait", "adapters not ready", elapsed())
+            return False
+
+        if events and "address" not in stage_times:
+            force_update = not AdapterEvents.wait_for_change(min(event_timeout, remaining))
+        else:
+            Capture.sleep(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
+            force_update = not events
+
+    stages = ", ".join(f"{stage} at {t:.1f}s" for stage, t in stage_times.items())
+    log.log(f"Adapters recovered after {elapsed():.1f}s of at most {deadline}s ({stages}).")
+    Metrics.record("wait", "adapters ready", elapsed())
+    return True
+
+# Watches the links of `adapter_names` for at most `deadline` seconds, and yields
+# (name, has link) each time one changes, as soon as it's seen. With adapter
+# events that's the moment it happens. Without them, the links are checked every
+# `poll_interval` seconds (one query for all of them, through the persistent shell).
+# It also stops early once `stop` (a threading.Event) is set. Call
+# AdapterEvents.wake() after setting it, so a wait for events notices.
+def watch_links(adapter_names, deadline=60, poll_interval=1, event_timeout=5, stop=None):
+    start = Capture.monotonic()
+    events = AdapterEvents.running()
+    last = win.get_network_adapter_link_statuses(adapter_names)
+    log.log(f"Watching the links of {', '.join(adapter_names)} for up to {deadline}s. "
+          + "Now: " + ", ".join(f"{name} {'up' if up else 'down'}" for name, up in last.items()))
+    force_update = None
+    while True:
+        remaining = deadline - (Capture.monotonic() - start)
+        if remaining <= 0 or _stopped(stop):
+            return
+        if events:
+            until = None if stop is None else stop.is_set
+            force_update = None if AdapterEvents.wait_for_change(min(event_timeout, remaining), until) else True
+        else:
+            Capture.sleep(min(poll_interval, remaining))
+
+        current = win.get_network_adapter_link_statuses(adapter_names, force_update=force_update)
+        for name in adapter_names:
+            if current.get(name) != last.get(name):
+                log.log(f"{name}'s link went {'up' if current.get(name) else 'down'} after "
+                      + f"{Capture.monotonic() - start:.1f}s.")
+                Metrics.record("wait", "link change", Capture.monotonic() - start)
+                yield name, current.get(name)
+        last = current
+
+# Whether `watch_links` was told to stop. That's captured, like the adapter
+# waits, so a replay stops at the same point.
+def _stopped(stop):
+    if stop is None:
+        return False
+    if Capture.replaying():
+        return Capture.replayed("watch_stop", None, missing={"stopped": False})["stopped"]
+    stopped = stop.is_set()
+    Capture.record("watch_stop", None, stopped=stopped)
+    return stopped
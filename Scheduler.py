@@ -0,0 +1,123 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import MyLogger as log
+import Metrics
+import Deadlines
+
+# Runs a set of diagnostic checks, each as soon as the checks it needs are done.
+#
+# Checks that only look at things (adapters, ipconfig, probes, DNS) don't get in
+# each other's way, so they run at the same time on a small pool of threads, and
+# the whole diagnosis takes as long as its slowest chain of checks instead of the
+# sum of all of them. Checks that change something (`mutates=True`) wait for
+# everything running to finish and then run on their own, and nothing listed
+# after them starts until they're done, so fixes never overlap with anything.
+#
+# A check can be given a `budget`: the seconds its commands get altogether (see
+# Deadlines). A check that isn't `required` and runs out of time (or has a command
+# time out) gives None instead, and the rest go on without it.
+
+class Check:
+    # `function` is called with the results of the checks named in `needs`, in order.
+    # `when`, if given, is called with the same results first. If it returns False
+    # the check is skipped, and its result is None.
+    def __init__(self, name, function, needs=(), when=None, mutates=False, budget=None, required=True):
+        self.name = name
+        self.function = function
+        self.needs = list(needs)
+        self.when = when
+        self.mutates = mutates
+        self.budget = budget
+        self.required = required
+
+# Runs `checks` and returns {name: result}.
+# If a check raises, nothing new is started, and the exception is raised once
+# the running checks have finished.
+def run_checks(checks, max_workers=4):
+    by_name = {c.name: c for c in checks}
+    for check in checks:
+        for need in check.needs:
+            if need not in by_name:
+                raise ValueError(f"Check '{check.name}' needs '{need}', which isn't a check")
+
+    results = {}
+    durations = {}
+    waiting = list(checks)
+    running = {}  # future: check
+    error = None
+    start = time.perf_counter()
+    log.log("Running checks: " + ", ".join(c.name for c in checks))
+
+    def timed(check, args):
+        check_start = time.perf_counter()
+        try:
+            if check.budget is None:
+                return check.function(*args)
+            with Deadlines.limit(check.budget):
+                return check.function(*args)
+        except Deadlines.CommandTimedOut as e:
+            if check.required:
+                raise
+            log.log(f"Check '{check.name}' ran out of time ({e}). Going on without it.")
+            log.log_event("check_timeout", check=check.name, reason=e.reason)
+            return None
+        finally:
+            durations[check.name] = time.perf_counter() - check_start
+            Metrics.record("check", check.name, durations[check.name])
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="check")
+    try:
+        while waiting or running:
+            # Start everything whose inputs are ready. A check that's skipped or
+            # that mutates finishes right away, which may make others ready.
+            progress = True
+            while progress and error is None:
+                progress = False
+                for check in list(waiting):
+                    ready = all(need in results for need in check.needs)
+                    if check.mutates and (running or not ready):
+                        break  # Nothing listed after a fix starts before it.
+                    if not ready:
+                        continue
+
+                    waiting.remove(check)
+                    progress = True
+                    args = [results[need] for need in check.needs]
+                    if check.when is not None and not check.when(*args):
+                        log.log(f"Skipping check '{check.name}'.")
+                        results[check.name] = None
+                    elif check.mutates:
+                        results[check.name] = timed(check, args)
+                    else:
+                        running[executor.submit(timed, check, args)] = check
+                    break  # Look again from the start, in case this changed what's ready.
+
+            if not running:
+                if error is not None or not waiting:
+                    break
+                raise ValueError("Checks can never run (their needs form a cycle, or come after them): "
+                               + ", ".join(c.name for c in waiting))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                check = running.pop(future)
+                try:
+                    results[check.name] = future.result()
+                except Exception as e:
+                    log.log(f"Check '{check.name}' raised an exception: {e!r}")
+                    if error is None:
+                        error = e
+    except KeyboardInterrupt:
+        # Don't sit and wait for whatever the running checks are waiting on.
+        Deadlines.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+    if error is not None:
+        raise error
+
+    elapsed = time.perf_counter() - start
+    log.log(f"Checks took {elapsed:.2f}s ({sum(durations.values()):.2f}s if run one after another): "
+          + ", ".join(f"{name} {d:.2f}s" for name, d in durations.items()))
+    return results
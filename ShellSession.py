@@ -0,0 +1,276 @@
+import subprocess
+import threading
+import queue
+import uuid
+import time
+import Metrics
+import Deadlines
+
+# Starting powershell.exe takes anywhere from a few hundred milliseconds to a few
+# seconds, and a single troubleshooting run can easily run dozens of commands.
+# So instead of spawning a new shell for every command, we keep a shell (or a few)
+# running and feed it commands over stdin.
+#
+# Every command is followed by a small "framing" command that prints a marker line
+# with the exit status. We read stdout until we see that marker, and everything
+# before it is the command's output.
+#
+# A command can be given a timeout. If it's still running after that, the shell
+# (and whatever the command started) is killed, the command raises
+# Deadlines.CommandTimedOut, and the next command gets a fresh shell.
+#
+# Nothing in here is Windows-specific. Give it a different argv and framer and
+# it'll happily drive bash, which is how it can be tested on Linux.
+
+POWERSHELL_ARGV = ["powershell.exe", "-NoLogo", "-NoProfile", "-NonInteractive", "-Command", "-"]
+POSIX_ARGV = ["bash", "--noprofile", "--norc"]
+
+
+# PowerShell reads `-Command -` one line at a time, so the whole thing must be on one line.
+# It only uses single quotes, so it also survives being passed on a command line.
+# The try/catch is there so a terminating error can't skip the marker (which would hang us).
+# `$?` is False if a cmdlet wrote an error, or if a native command (like ping) returned non-zero.
+def powershell_framer(command, marker):
+    return ("$global:LASTEXITCODE = 0; $__nt_code = 0; "
+          + f"try {{ {command}; if (-not $?) {{ $__nt_code = if ($LASTEXITCODE) {{ $LASTEXITCODE }} else {{ 1 }} }} }} "
+          + "catch { [Console]::Error.WriteLine($_); $__nt_code = 1 }; "
+          + f"[Console]::Out.WriteLine('{marker} ' + $__nt_code)\n")
+
+def posix_framer(command, marker):
+    return f"{command}\nprintf '%s %d\\n' '{marker}' \"$?\"\n"
+
+# Sent to a new session before any commands, by framer.
+# PowerShell decodes what it reads from a pipe with the console's (OEM) code page,
+# which garbles adapter names like "Connexion au réseau local" in the commands we
+# send as UTF-8. And it writes its output in that code page too.
+session_setup = {
+    powershell_framer: "[Console]::InputEncoding = [Console]::OutputEncoding = New-Object System.Text.UTF8Encoding $false\n",
+}
+
+
+# Several commands can be sent as one, with each one framed by its own marker.
+# That saves a round trip (or a whole process, when not using a session) per command.
+def batch_command(commands, framer, marker):
+    return "; ".join(framer(c, f"{marker}_{i}").rstrip("\n") for i, c in enumerate(commands))
+
+# Splits the (str) output lines of a `batch_command` back up.
+# Returns a list of (lines, exit_code), one for each command. Commands that never
+# reported back (because the batch was cut short) get an exit code of None.
+def split_batch(lines, marker, count):
+    results = []
+    current = []
+    expected = f"{marker}_0 "
+    for line in lines:
+        index = line.find(expected)
+        if index == -1:
+            current.append(line)
+            continue
+        if index > 0:
+            current.append(line[:index])
+        code = int(line[index + len(expected):].strip() or 1)
+        results.append((current, code))
+        current = []
+        expected = f"{marker}_{len(results)} "
+    while len(results) < count:
+        results.append((current, None))
+        current = []
+    return results
+
+
+# A CalledProcessError (without an exit status), like the Deadlines errors, so
+# anything that already takes a failing command as a "no" does the same here.
+class ShellCrashed(subprocess.CalledProcessError):
+    def __init__(self, message, command, output=b""):
+        super().__init__(None, command, output=output)
+        self.message = message
+
+    def __str__(self):
+        return f"Command '{self.cmd}' failed: {self.message}"
+
+
+class ShellSession:
+    def __init__(self, argv=POWERSHELL_ARGV, framer=powershell_framer):
+        self.argv = argv
+        self.framer = framer
+        self.process = None
+        self.starts = 0
+        self._marker_base = f"__NT_END_{uuid.uuid4().hex}"
+        self._counter = 0
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.starts += 1
+        start = time.perf_counter()
+        # stderr is left alone, just like `subprocess.check_output` did.
+        self.process = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        **Deadlines.popen_options)
+        Metrics.record("spawn", f"{self.argv[0]} session", time.perf_counter() - start)
+        setup = session_setup.get(self.framer)
+        if setup is not None:
+            self.process.stdin.write(setup.encode())
+            self.process.stdin.flush()
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+    # Runs one command, yielding its output (as bytes) one line at a time as it
+    # arrives. The generator's return value is the exit code.
+    # If the caller stops early, the rest of the output is read and thrown away,
+    # so the session is ready for the next command.
+    # If `timeout` (seconds) runs out first, or the command is cancelled (see
+    # Deadlines), the session is killed and this raises.
+    def stream(self, command, timeout=None):
+        if not self.is_alive():
+            self.start()
+
+        self._counter += 1
+        marker = f"{self._marker_base}_{self._counter}".encode()
+
+        try:
+            self.process.stdin.write(self.framer(command, marker.decode()).encode())
+            self.process.stdin.flush()
+        except OSError as e:
+            raise ShellCrashed(f"Shell session stopped accepting input: {e}", command) from e
+
+        watchdog = None
+        if timeout is not None:
+            watchdog = Deadlines.Watchdog(self.process, command, timeout).start()
+        finished = False
+        try:
+            while True:
+                line = self.process.stdout.readline()
+                if line == b"":
+                    finished = True
+                    error = watchdog and watchdog.error()
+                    if error:
+                        self.close()
+                        raise error
+                    raise ShellCrashed("Shell session exited before the command finished.", command)
+
+                # The marker might not be at the start of the line if the command's
+                # output didn't end with a newline.
+                index = line.find(marker)
+                if index == -1:
+                    yield line
+                    continue
+
+                finished = True
+                if index > 0:
+                    yield line[:index]
+                return int(line[index + len(marker):].strip() or 1)
+        finally:
+            if not finished:
+                self._drain(marker)
+            if watchdog is not None:
+                watchdog.stop()
+
+    def _drain(self, marker):
+        while True:
+            line = self.process.stdout.readline()
+            if line == b"" or marker in line:
+                return
+
+    # Runs one command and returns (output, exit_code).
+    # `output` is bytes, exactly like `subprocess.check_output` returns.
+    def run(self, command, timeout=None):
+        return collect(self.stream(command, timeout))
+
+
+# Runs a generator from `stream` to completion, and returns (output, exit_code).
+def collect(stream):
+    output = []
+    while True:
+        try:
+            output.append(next(stream))
+        except StopIteration as e:
+            return b"".join(output), e.value
+
+
+# A small pool of sessions, so that several commands can run at the same time.
+# Sessions are only started when they're actually needed.
+class ShellSessionPool:
+    def __init__(self, size=1, argv=POWERSHELL_ARGV, framer=powershell_framer):
+        self.size = size
+        self.argv = argv
+        self.framer = framer
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.size:
+                session = ShellSession(self.argv, self.framer)
+                self._all.append(session)
+                return session
+
+        return self._idle.get()
+
+    def _release(self, session):
+        if self._closed:
+            session.close()
+        else:
+            self._idle.put(session)
+
+    # If the session dies while running a command, it's restarted and the command
+    # is tried once more. Everything we send is safe to repeat (queries, pings, and
+    # enabling/disabling adapters). A command that times out isn't tried again.
+    def run(self, command, timeout=None):
+        return collect(self.stream(command, timeout))
+
+    # Like `ShellSession.stream`. A crash is only retried if none of the output
+    # had been passed on yet.
+    def stream(self, command, timeout=None):
+        session = self._acquire()
+        lines = None
+        try:
+            started = False
+            try:
+                lines = session.stream(command, timeout)
+                while True:
+                    try:
+                        line = next(lines)
+                    except StopIteration as e:
+                        return e.value
+                    started = True
+                    yield line
+            except ShellCrashed:
+                if started:
+                    raise
+                session.close()
+                session.start()
+                lines = session.stream(command, timeout)
+                return (yield from lines)
+        finally:
+            # Make sure the session has finished with this command before anyone else gets it.
+            if lines is not None:
+                lines.close()
+            self._release(session)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            sessions = list(self._all)
+            self._all = []
+        for session in sessions:
+            session.close()
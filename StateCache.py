@@ -0,0 +1,124 @@
+import threading
+import MyLogger as log
+import Capture
+
+# Caches the results of the queries about network state (Get-NetAdapter, ipconfig),
+# so that looking the same thing up again between fixes doesn't cost a command.
+#
+# - Entries are keyed by the query *and* the properties asked for, so asking for
+#   "all" properties never gets a cached "limited" result.
+# - Entries expire after `ttl` seconds.
+# - Anything that changes the network state calls `invalidate`, which bumps
+#   `version`. Invalidating a single adapter only marks that adapter as stale.
+#   Entries that know how to refresh a single adapter do just that the next time
+#   they're asked for. The rest are fetched again in full.
+# - Ages are measured with Capture.monotonic, so a replayed run expires entries
+#   when the original did.
+# - While adapter events are running (see AdapterEvents), the cache `follow`s
+#   them: the adapters they say changed are invalidated before each lookup.
+
+class _Entry:
+    def __init__(self, value, version, refresh_adapter):
+        self.value = value
+        self.version = version
+        self.fetched_at = Capture.monotonic()
+        self.refresh_adapter = refresh_adapter
+        self.stale_adapters = set()
+
+class NetworkStateCache:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.partial_refreshes = 0
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._take_changes = None
+
+    # `take_changes()` returns the names of the adapters that changed since it was
+    # last called. None stops following.
+    def follow(self, take_changes):
+        self._take_changes = take_changes
+
+    def following(self):
+        return self._take_changes is not None
+
+    def _apply_changes(self):
+        take_changes = self._take_changes
+        if take_changes is None:
+            return
+        for name in take_changes():
+            log.log(f"Cache: '{name}' changed (adapter event)")
+            self.invalidate(name)
+
+    # Returns the cached value for `key`, calling `fetch()` to get it if needed.
+    # `refresh_adapter(value, name)`, if given, brings just one adapter up to date
+    # in `value` (in place).
+    def get(self, key, fetch, refresh_adapter=None, force_update=False):
+        with self._lock:
+            self._apply_changes()
+            entry = self._entries.get(key)
+            reason = None
+            if force_update:
+                reason = "update forced"
+            elif entry is None:
+                reason = "not cached"
+            elif Capture.monotonic() - entry.fetched_at > self.ttl:
+                reason = f"older than {self.ttl}s"
+            elif entry.stale_adapters and entry.refresh_adapter is None:
+                reason = "adapters changed: " + ", ".join(sorted(entry.stale_adapters))
+
+            if reason is None:
+                if entry.stale_adapters:
+                    for name in sorted(entry.stale_adapters):
+                        log.log(f"Cache: refreshing only '{name}' in {self._describe(key)}")
+                        entry.refresh_adapter(entry.value, name)
+                        self.partial_refreshes += 1
+                    entry.stale_adapters.clear()
+                    entry.version = self.version
+                else:
+                    log.log(f"Cache hit for {self._describe(key)}")
+                self.hits += 1
+                return entry.value
+
+            log.log(f"Cache miss for {self._describe(key)} ({reason})")
+            self.misses += 1
+            value = fetch()
+            self._entries[key] = _Entry(value, self.version, refresh_adapter)
+            return value
+
+    # True if `get(key, ...)` would be answered without a full fetch.
+    def is_fresh(self, key):
+        with self._lock:
+            self._apply_changes()
+            entry = self._entries.get(key)
+            if entry is None or Capture.monotonic() - entry.fetched_at > self.ttl:
+                return False
+            return not (entry.stale_adapters and entry.refresh_adapter is None)
+
+    # Stores a value that was fetched some other way (e.g. in a batch).
+    def put(self, key, value, refresh_adapter=None):
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = _Entry(value, self.version, refresh_adapter)
+
+    # With no name, throws everything away. With a name, only that adapter is stale.
+    def invalidate(self, adapter_name=None):
+        with self._lock:
+            self.version += 1
+            if adapter_name is None:
+                self._entries.clear()
+            else:
+                for entry in self._entries.values():
+                    entry.stale_adapters.add(adapter_name)
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0
+        log.log(f"Network state cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+              + f"{self.partial_refreshes} single-adapter refreshes, state version {self.version}")
+
+    @staticmethod
+    def _describe(key):
+        return " / ".join(str(k) for k in key)
@@ -0,0 +1,291 @@
+import time
+import uuid
+import base64
+import socket
+import asyncio
+import weakref
+import subprocess
+import MyLogger as log
+import WinterfacePS as win
+import ShellSession
+import Probes
+import Capture
+import Deadlines
+import Metrics
+
+# WinterfacePS, as coroutines. Everything in WinterfacePS blocks, so the only way
+# to overlap commands and probes there is to juggle threads. With these, any
+# number of queries, probes and fixes can simply be gathered:
+#
+#   adapters, (_, ip_adapters), internet = WinterfaceAsync.run_all(
+#       WinterfaceAsync.get_network_adapters(),
+#       WinterfaceAsync.get_ip_config(),
+#       WinterfaceAsync.test_ip_connection("1.1.1.1"))
+#
+# - Commands go to the persistent shell pool when it's in use (on threads), since
+#   its shells are already running, which beats starting any process. Without
+#   it, each command is an asyncio subprocess, killed along with its children at
+#   its deadline (see Deadlines). Either way the output is parsed, cached, logged
+#   and captured just like WinterfacePS does it, and captures replay the same.
+# - Probes use asyncio sockets (TCP connects and DNS queries). ICMP needs a raw
+#   socket, which asyncio can't do, so that one runs on a thread.
+# - At most `max_concurrency` commands and probes run at once.
+# - `run()` and `run_all()` call these from ordinary code. Everything else (Main
+#   included) keeps using WinterfacePS as it is.
+
+max_concurrency = 8
+
+_semaphores = weakref.WeakKeyDictionary()  # event loop: Semaphore
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(max_concurrency)
+    return semaphore
+
+# Runs a coroutine from ordinary (not async) code, and returns its result.
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+# Runs all of the coroutines at once, and returns their results, in order.
+def run_all(*coroutines):
+    async def gather():
+        return await asyncio.gather(*coroutines)
+    return asyncio.run(gather())
+
+
+########## Commands ##########
+# How a command is started without the persistent shell: the command, framed by
+# `process_framer`, is passed to `process_argv(script)`. (With
+# ShellSession.posix_framer and ["bash", "-c", script], this runs on Linux.)
+process_framer = ShellSession.powershell_framer
+
+def powershell_argv(script):
+    encoded = base64.b64encode(script.encode("utf-16-le")).decode()
+    return ["powershell.exe", "-NoLogo", "-NoProfile", "-NonInteractive", "-EncodedCommand", encoded]
+
+process_argv = powershell_argv
+
+# The longest line of output a command may give. asyncio's default is 64 KiB,
+# which a single line of JSON (e.g. Get-NetAdapter | ConvertTo-Json -Compress)
+# can go past.
+line_limit = 64 * 1024 * 1024
+
+# Runs a command, and returns (lines, exit_code). Raises if the exit code isn't 0
+# (unless `ignore_error`), or if it runs out of time, like WinterfacePS does.
+async def run_PS(command, display=True, ignore_error=False, timeout=None):
+    async with _semaphore():
+        if Capture.replaying() or win.use_persistent_shell:
+            return await asyncio.to_thread(win._run_PS, command, display, ignore_error, timeout)
+        return await _run_PS_process(command, display, ignore_error, timeout)
+
+async def _run_PS_process(ps_command, display, ignore_error, timeout):
+    command = f"powershell.exe {ps_command}"
+    win._PS_command_started(command, display)
+    start = time.perf_counter()
+    raw_lines = []
+    try:
+        code = await _run_process(ps_command, Deadlines.timeout_for(command, timeout), raw_lines)
+    except Deadlines.CommandTimedOut as e:
+        lines = [win._decode_PS_output(raw) for raw in raw_lines]
+        win._PS_command_timed_out(e, ps_command, raw_lines, lines, time.perf_counter() - start)
+        raise
+    lines = [win._decode_PS_output(raw) for raw in raw_lines]
+    win._PS_command_finished(ps_command, raw_lines, lines, code, time.perf_counter() - start, ignore_error)
+    return lines, code
+
+# Runs the command in a process of its own, adding its output (as bytes lines) to
+# `raw_lines`, and returns its exit code. The process is killed when `timeout`
+# runs out, or if this stops early for any other reason (e.g. the task is cancelled).
+async def _run_process(ps_command, timeout, raw_lines):
+    marker = f"__NT_END_{uuid.uuid4().hex}".encode()
+    argv = process_argv(process_framer(ps_command, marker.decode()))
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(*argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                                   limit=line_limit, **Deadlines.popen_options)
+    Metrics.record("spawn", f"{argv[0]} (async)", time.perf_counter() - start)
+    watchdog = Deadlines.Watchdog(process, ps_command, timeout).start()
+    code = None
+    try:
+        async for line in process.stdout:
+            # Same as ShellSession: the marker may come right after output without a newline.
+            index = line.find(marker)
+            if index == -1:
+                raw_lines.append(line)
+                continue
+            if index > 0:
+                raw_lines.append(line[:index])
+            code = int(line[index + len(marker):].strip() or 1)
+        await process.wait()
+    finally:
+        watchdog.stop()
+        if process.returncode is None:
+            Deadlines.kill_process_tree(process)
+            await process.wait()
+    error = watchdog.error()
+    if error is not None:
+        raise error
+    if code is None:  # It never got as far as the marker.
+        code = process.returncode or 1
+    return code
+
+
+########## Queries ##########
+_fetches = {}  # (event loop, cache key): task fetching it
+
+# Answers from WinterfacePS's cache (with `get_cached()`, on a thread, since that
+# may re-query a single adapter) if it's fresh. Otherwise runs `query` here, and
+# caches what `parse` makes of its output. Callers that ask for the same thing
+# at the same time share the one command.
+async def _cached(key, query, parse, get_cached, refresh_adapter=None, force_update=False):
+    if not force_update and win.state_cache.is_fresh(key):
+        async with _semaphore():
+            return await asyncio.to_thread(get_cached)
+
+    fetch_key = (asyncio.get_running_loop(), key)
+    task = _fetches.get(fetch_key)
+    if task is None:
+        task = _fetches[fetch_key] = asyncio.ensure_future(_fetch(key, query, parse, refresh_adapter))
+        task.add_done_callback(lambda _: _fetches.pop(fetch_key, None))
+    return await asyncio.shield(task)
+
+async def _fetch(key, query, parse, refresh_adapter):
+    version = win.state_cache.version
+    lines, _ = await run_PS(query)
+    value = parse(lines)
+    # If something changed the network in the meantime, this may already be out of date.
+    if win.state_cache.version == version:
+        win.state_cache.put(key, value, refresh_adapter)
+    return value
+
+async def get_network_adapters(force_update=False, prop_list_type="limited", structured=False):
+    def parse(lines):
+        if structured:
+            return win.parse_net_adapter_json("".join(lines))
+        return win.parse_net_adapter_list(lines)
+    return await _cached(
+        win._network_adapters_key(prop_list_type, structured),
+        win._net_adapter_query(prop_list_type, structured),
+        parse,
+        lambda: win.get_network_adapters(prop_list_type=prop_list_type, structured=structured),
+        win._network_adapter_refresher(prop_list_type, structured),
+        force_update,
+    )
+
+# Returns (general_config, adapters), like WinterfacePS's.
+async def get_ip_config(force_update=False):
+    return await _cached(win._ip_config_key, "ipconfig /all", win.parse_ip_config, win.get_ip_config,
+                         force_update=force_update)
+
+
+########## Fixes ##########
+async def set_net_adapter_enable_state(name, state=True):
+    command = "Enable" if (state == True) else "Disable"
+    try:
+        await run_PS(f"{command}-NetAdapter -name {win._quote_PS(name)} -Confirm:$false")
+    finally:
+        win.invalidate_network_state_cache(name)
+
+# Enables (or disables) all of `names` at once. Returns {name: whether it worked}.
+async def set_net_adapters_enable_state(names, state=True):
+    results = await asyncio.gather(*[set_net_adapter_enable_state(name, state) for name in names],
+                                   return_exceptions=True)
+    return {name: not isinstance(result, Exception) for name, result in zip(names, results)}
+
+
+########## Probes ##########
+# Like WinterfacePS's: returns a Probes.ProbeResult, and logs and captures it.
+async def probe_ip_connection(ip, timeout=2, refused_counts=False):
+    if Capture.replaying() or not win.use_native_probes:
+        async with _semaphore():
+            return await asyncio.to_thread(win.probe_ip_connection, ip, timeout, refused_counts)
+    start = time.perf_counter()
+    log.print_command_execution(f"(probe) {ip}")
+    result = await probe_ip(ip, timeout=timeout, refused_counts=refused_counts)
+    log.log(f"Probe result: {result}")
+    win._probe_finished(ip, result, time.perf_counter() - start)
+    return result
+
+async def test_ip_connection(ip):
+    return (await probe_ip_connection(ip)).success
+
+# Like Probes.tcp_probe.
+async def tcp_probe(ip, port, timeout=2, refused_counts=False):
+    method = f"TCP/{port}"
+    start = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        rtt = time.perf_counter() - start
+        writer.close()
+        return Probes.ProbeResult(ip, method, True, rtt=rtt)
+    except ConnectionRefusedError:
+        if refused_counts:
+            return Probes.ProbeResult(ip, method, True, rtt=time.perf_counter() - start,
+                                      reason="connection refused, but the host answered")
+        return Probes.ProbeResult(ip, method, False, reason="connection refused")
+    except asyncio.TimeoutError:
+        return Probes.ProbeResult(ip, method, False, reason="timed out")
+    except OSError as e:
+        return Probes.ProbeResult(ip, method, False, reason=str(e))
+
+# Like Probes.dns_probe.
+async def dns_probe(ip, timeout=2, port=53, domain="google.com"):
+    method = f"DNS/{port}"
+    query_id, query = Probes.dns_query(domain)
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.connect((ip, port))
+            await loop.sock_sendall(sock, query)
+            while True:
+                remaining = timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    return Probes.ProbeResult(ip, method, False, reason="timed out")
+                data = await asyncio.wait_for(loop.sock_recv(sock, 4096), remaining)
+                rcode = Probes.dns_rcode(data, query_id)
+                if rcode is not None:
+                    return Probes.ProbeResult(ip, method, True, rtt=time.perf_counter() - start, reason=f"rcode {rcode}")
+    except asyncio.TimeoutError:
+        return Probes.ProbeResult(ip, method, False, reason="timed out")
+    except OSError as e:
+        return Probes.ProbeResult(ip, method, False, reason=str(e))
+
+# The probes `probe_ip` uses, by name, like Probes.probe_types.
+probe_types = {
+    "icmp": lambda ip, timeout, refused_counts: asyncio.to_thread(Probes.icmp_probe, ip, timeout),
+    "tcp53": lambda ip, timeout, refused_counts: tcp_probe(ip, 53, timeout, refused_counts),
+    "tcp443": lambda ip, timeout, refused_counts: tcp_probe(ip, 443, timeout, refused_counts),
+    "dns": lambda ip, timeout, refused_counts: dns_probe(ip, timeout),
+}
+
+# Like Probes.probe_ip: every probe type at once, and the first to succeed wins.
+# The others are cancelled (except ICMP, whose thread is left to finish).
+async def probe_ip(ip, probes=Probes.default_probes, timeout=2, refused_counts=False):
+    results = []
+    async with _semaphore():
+        tasks = [asyncio.ensure_future(probe_types[name](ip, timeout, refused_counts)) for name in probes]
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=timeout + 1):
+                try:
+                    result = await next_done
+                except asyncio.TimeoutError:
+                    log.log(f"Probe deadline of {timeout + 1}s ran out for {ip}.")
+                    break
+                except Exception as e:
+                    log.log(f"Probe of {ip} raised an exception: {e!r}")
+                    continue
+                if result:
+                    return result
+                results.append(result)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    reasons = "; ".join(f"{r.method}: {r.reason}" for r in results if not r.unsupported)
+    if reasons == "":
+        reasons = "no usable probe types"
+    return Probes.ProbeResult(ip, "any", False, reason=reasons)
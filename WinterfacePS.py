@@ -1,29 +1,208 @@
 import subprocess
-import sys
 import MyLogger as log
 import os
 import time
 import re
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from ShellSession import ShellSessionPool, powershell_framer, batch_command, split_batch
+import Probes
+import StateCache
+import Metrics
+import Capture
+import Deadlines
+from AdapterRecord import AdapterRecord, AdminStatus, OperStatus, MediaConnectionState
 
 print = log.log_print
 input = log.log_input
 
-def _run_PS_get_lines(command, display=True, ignore_error=False):
+# When True, commands are sent to a long-lived PowerShell session instead of
+# starting a new powershell.exe for every single command.
+use_persistent_shell = True
+shell_pool_size = 4
+
+_shell_pool = None
+def _get_shell_pool():
+    global _shell_pool
+    if _shell_pool is None:
+        _shell_pool = ShellSessionPool(size=shell_pool_size)
+    return _shell_pool
+
+def close_shell_sessions():
+    global _shell_pool
+    if _shell_pool is not None:
+        _shell_pool.close()
+    _shell_pool = None
+
+# Runs a command, yielding its output one line at a time (without line endings)
+# while it's still running. The output is logged once the command finishes.
+# It's killed if it runs for longer than `timeout` (or Deadlines.command_timeout),
+# and then raises Deadlines.CommandTimedOut (see Deadlines for the others).
+def _stream_PS_lines(command, display=True, ignore_error=False, log_output=True, metric_name=None, timeout=None):
+    ps_command = command
     command = f"powershell.exe {command}"
+    _PS_command_started(command, display)
+    start = time.perf_counter()
+    raw_lines = []
+    lines = []
+    try:
+        if Capture.replaying():
+            stream = Capture.replay_command(ps_command)
+        else:
+            timeout = Deadlines.timeout_for(command, timeout)
+            if use_persistent_shell:
+                stream = _get_shell_pool().stream(ps_command, timeout)
+            else:
+                stream = _stream_process(command, timeout)
+
+        while True:
+            try:
+                raw = next(stream)
+            except StopIteration as e:
+                code = e.value
+                break
+            raw_lines.append(raw)
+            line = _decode_PS_output(raw)
+            lines.append(line)
+            yield line
+    except Deadlines.CommandTimedOut as e:
+        _PS_command_timed_out(e, ps_command, raw_lines, lines, time.perf_counter() - start)
+        raise
+
+    _PS_command_finished(ps_command, raw_lines, lines, code, time.perf_counter() - start,
+                         ignore_error, log_output, metric_name)
+    return code
+
+# The bookkeeping around every command, however it was run (WinterfaceAsync runs
+# them too): printing it, logging its output, recording it to the capture, and
+# its metrics. `ps_command` is the command without "powershell.exe".
+def _PS_command_started(command, display):
     if display:
         log.print_command_execution(command)
-
+    log.log_command_start(command)
+
+def _decode_PS_output(raw):
+    return raw.decode().replace("\r", "").rstrip("\n") # Unify \r\n and \n commands. In case it matters.
+
+def _PS_command_timed_out(e, ps_command, raw_lines, lines, duration):
+    command = f"powershell.exe {ps_command}"
+    e.cmd, e.output = command, b"".join(raw_lines)
+    Capture.record_command(ps_command, raw_lines, None, duration, timed_out=e)
+    Deadlines.spend(duration)
+    Metrics.record("timeout", e.reason, duration)
+    log.log_command_execution(command, lines, None, duration)
+    log.log(f"Command {e.describe()}.")
+    log.log_event("command_timeout", command=command, reason=e.reason, timeout=e.timeout, duration=duration)
+
+def _PS_command_finished(ps_command, raw_lines, lines, code, duration, ignore_error=False, log_output=True,
+                         metric_name=None):
+    command = f"powershell.exe {ps_command}"
+    Capture.record_command(ps_command, raw_lines, code, duration)
+    Deadlines.spend(duration)
+    Metrics.record("command", metric_name or Metrics.command_type(command), duration, sum(len(raw) for raw in raw_lines))
+    if code != 0 and not ignore_error:
+        log.log_command_execution(command, lines, code, duration)
+        log.log("Command returned non-zero status. Raising exception.")
+        raise subprocess.CalledProcessError(code, command, output=b"".join(raw_lines))
+    if log_output:
+        log.log_command_execution(command, lines, code, duration)
+
+# Runs a command with none of `_stream_PS_lines`' bookkeeping, yielding its lines.
+# Not for anything a replay would need: it isn't captured.
+def _stream_PS_quietly(command, timeout):
+    if use_persistent_shell:
+        stream = _get_shell_pool().stream(command, timeout)
+    else:
+        stream = _stream_process(f"powershell.exe {command}", timeout)
+    for raw in stream:
+        yield _decode_PS_output(raw)
+
+def _stream_process(command, timeout=None):
+    start = time.perf_counter()
+    with subprocess.Popen(command, stdout=subprocess.PIPE, **Deadlines.popen_options) as process:
+        Metrics.record("spawn", "powershell.exe", time.perf_counter() - start)
+        watchdog = Deadlines.Watchdog(process, command, timeout).start() if timeout is not None else None
+        try:
+            for line in process.stdout:
+                yield line
+            process.wait()
+        finally:
+            if watchdog is not None:
+                watchdog.stop()
+    error = watchdog and watchdog.error()
+    if error:
+        raise error
+    return process.returncode
+
+def _run_PS_get_lines(command, display=True, ignore_error=False, timeout=None):
+    return list(_stream_PS_lines(command, display, ignore_error, timeout=timeout))
+
+# Runs a command and returns (lines, exit_code).
+def _run_PS(command, display=True, ignore_error=False, timeout=None):
+    lines = []
+    stream = _stream_PS_lines(command, display, ignore_error, timeout=timeout)
+    while True:
+        try:
+            lines.append(next(stream))
+        except StopIteration as e:
+            return lines, e.value
+
+# Runs a command for its exit status, without raising if it isn't 0.
+# If it didn't finish in time (see Deadlines), that's None.
+def _run_PS_get_code(command, display=True, timeout=None):
+    lines = _stream_PS_lines(command, display, ignore_error=True, timeout=timeout)
+    while True:
+        try:
+            next(lines)
+        except StopIteration as e:
+            return e.value
+        except Deadlines.CommandTimedOut:
+            return None
+
+# Runs several commands in a single invocation.
+# Returns a list of (lines, exit_code), one for each command. Each command's
+# output is logged separately, as if it had been run on its own.
+# The batch gets as long as its commands would altogether. If it runs out of time,
+# what did finish is logged, and then the Deadlines error is raised, unless
+# `keep_unfinished`, in which case the commands that hadn't finished get an exit
+# code of None.
+# A `quiet` batch isn't printed, logged, captured, counted in the metrics or taken
+# off the run's time budget, for polling in the background (see AdapterEvents).
+def run_PS_batch(commands, display=True, quiet=False, keep_unfinished=False):
+    framer = _get_shell_pool().framer if use_persistent_shell else powershell_framer
+    marker = f"__NT_SECTION_{uuid.uuid4().hex}"
+    if display and not quiet:
+        for command in commands:
+            log.print_command_execution(f"powershell.exe {command}")
+
+    batch = batch_command(commands, framer, marker)
+    timeout = Deadlines.command_timeout * len(commands)
+    if quiet:
+        stream = _stream_PS_quietly(batch, timeout)
+    else:
+        metric_name = "batch: " + " + ".join(Metrics.command_type(c) for c in commands)
+        stream = _stream_PS_lines(batch, display=False, ignore_error=True, log_output=False,
+                                  metric_name=metric_name, timeout=timeout)
+    lines = []
+    error = None
     try:
-        output = subprocess.check_output(command).decode()
-    except subprocess.CalledProcessError as e:
-        if ignore_error:
-            output = e.output
-        else:
-            log.log_command_execution(command, e.output)
-            log.log("Command returned non-zero status. Raising exception.")
-            raise e
-    log.log_command_execution(command, output)
-    return re.sub("\r+", "", output).split("\n") # Unify \r\n and \n commands. In case it matters.
+        for line in stream:
+            lines.append(line)
+    except Deadlines.CommandTimedOut as e:
+        error = e
+    results = split_batch(lines, marker, len(commands))
+    if not quiet:
+        for command, (section, code) in zip(commands, results):
+            log.log_command_execution(f"powershell.exe {command}", section, code)
+            if code is None:
+                log.log("Command didn't finish.")
+            elif code != 0:
+                log.log(f"Command returned status {code}.")
+    if not keep_unfinished and any(code is None for _, code in results):
+        # (Without an error, the batch ended without getting through all of its sections.)
+        raise error or Deadlines.CommandTimedOut("powershell.exe " + "; ".join(commands), timeout)
+    return results
 
 def _decode_PS_line(line):
     split = line.split(":")
@@ -35,122 +214,270 @@ def _decode_PS_line(line):
 
 
 
-adapters = None
-def get_network_adapters(force_update=False, prop_list_type="limited"):
-    global adapters
-    if (not force_update) and (adapters is not None):
-        log.log("Using cached adapters")
-        return adapters
-
-    # properties = "'*'"
-    properties = "Name, AdminStatus, HardwareInterface, ifOperStatus"
-
-    assert prop_list_type in ("limited","default","all")
-    if prop_list_type == "limited":
-        properties = "Name, AdminStatus, HardwareInterface, ifOperStatus"
-    elif prop_list_type == "all":
-        properties = "'*'"
-    elif prop_list_type == "default":
-        properties = ""
-    
-    properties = "" if (properties == "") else f"-Property {properties}"
-
-    lines = _run_PS_get_lines(f"Get-NetAdapter | Format-List {properties}")
-
+# `Get-NetAdapter | Format-List` output is a blank-line separated list of
+# "Name : Value" blocks. Long values wrap onto indented lines.
+def parse_net_adapter_list(lines):
     adapters = []
     current = {}
+    last_name = None
     for line in lines:
         if line == '':
             if current != {}:
                 adapters.append(current)
                 current = {}
+        elif line.startswith(" ") and last_name is not None:
+            current[last_name] += line.strip()
         else:
             name, value = _decode_PS_line(line)
             current[name] = value
+            last_name = name
     
     if current != {}:
         adapters.append(current)
     
-    return adapters
+    return [AdapterRecord(a) for a in adapters]
+
+
+# In the structured (JSON) mode, the statuses come back as numbers, which are
+# turned into the enums in AdapterRecord.
+# Property name: (the enum's members, the number its first member has)
+_enum_properties = {
+    "AdminStatus": (list(AdminStatus), 1),
+    "ifOperStatus": (list(OperStatus), 1),
+    "MediaConnectionState": (list(MediaConnectionState), 0),
+}
+
+def _decode_enum(prop_name, value):
+    members, first = _enum_properties[prop_name]
+    if type(value) is int and 0 <= value - first < len(members):
+        return members[value - first]
+    return value
+
+# Parses the output of `ConvertTo-Json`. Booleans and numbers come back typed
+# by JSON already, so only the enums need converting.
+def parse_net_adapter_json(text):
+    text = text.strip()
+    if text == "":
+        return []
+    adapters = json.loads(text)
+    if type(adapters) is dict:  # Just in case it wasn't wrapped in an array
+        adapters = [adapters]
+    for adapter in adapters:
+        for prop_name in _enum_properties:
+            if prop_name in adapter:
+                adapter[prop_name] = _decode_enum(prop_name, adapter[prop_name])
+    return [AdapterRecord(a) for a in adapters]
+
+_structured_properties = {
+    "limited": "Name, AdminStatus, HardwareInterface, ifOperStatus",
+    "default": "Name, InterfaceDescription, ifIndex, Status, MacAddress, LinkSpeed",
+    # The Cim* properties are huge and are just metadata about the query.
+    "all": "* -ExcludeProperty Cim*",
+}
+
+def _quote_PS(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def _net_adapter_query(prop_list_type, structured, name=None):
+    assert prop_list_type in ("limited","default","all")
+    if name is None:
+        selector = "Get-NetAdapter"
+    else:
+        selector = f"Get-NetAdapter -Name {_quote_PS(name)} -ErrorAction SilentlyContinue"
 
-def get_network_adapter_link_status(name):
-    lines = _run_PS_get_lines(f'Get-NetAdapter | Where Name -EQ "{name}" | Format-List -Property ifOperStatus')
-    for line in lines:
-        if line.strip() != "":
-            name, value = _decode_PS_line(line)
-            return value == "Up"
-    raise Exception("No results!")
+    if structured:
+        properties = _structured_properties[prop_list_type]
+        # @() makes sure a single adapter still comes back as an array.
+        return f"ConvertTo-Json -Compress -Depth 1 -InputObject @({selector} | Select-Object -Property {properties})"
 
+    # properties = "'*'"
+    properties = "Name, AdminStatus, HardwareInterface, ifOperStatus"
 
+    if prop_list_type == "limited":
+        properties = "Name, AdminStatus, HardwareInterface, ifOperStatus"
+    elif prop_list_type == "all":
+        properties = "'*'"
+    elif prop_list_type == "default":
+        properties = ""
+    
+    properties = "" if (properties == "") else f"-Property {properties}"
+    return f"{selector} | Format-List {properties}"
+
+def _fetch_network_adapters(prop_list_type, structured, name=None):
+    lines = _run_PS_get_lines(_net_adapter_query(prop_list_type, structured, name), ignore_error=(name is not None))
+    if structured:
+        return parse_net_adapter_json("".join(lines))
+    return parse_net_adapter_list(lines)
+
+# Used by the cache to re-query a single adapter after it changed.
+def _network_adapter_refresher(prop_list_type, structured):
+    def refresh(adapters, name):
+        fresh = _fetch_network_adapters(prop_list_type, structured, name)
+        for i, a in enumerate(adapters):
+            if a['Name'] == name:
+                adapters[i:i + 1] = fresh  # Also removes it, if it's gone.
+                return
+        adapters.extend(fresh)
+    return refresh
+
+
+
+state_cache = StateCache.NetworkStateCache()
+
+# With `structured=True`, the adapters are fetched as JSON instead of by scraping
+# `Format-List` output. That's quicker to parse and doesn't trip over colons or
+# wrapped lines, and the values are typed: HardwareInterface is a bool, ifIndex
+# is an int, and the statuses are the enums above.
+def _network_adapters_key(prop_list_type, structured):
+    return ("Get-NetAdapter", prop_list_type, "json" if structured else "text")
+
+def get_network_adapters(force_update=False, prop_list_type="limited", structured=False):
+    return state_cache.get(
+        _network_adapters_key(prop_list_type, structured),
+        lambda: _fetch_network_adapters(prop_list_type, structured),
+        refresh_adapter=_network_adapter_refresher(prop_list_type, structured),
+        force_update=force_update,
+    )
+
+# Returns {name: whether it has a link} for `names` (or every adapter), from a
+# single Get-NetAdapter for all of them. Adapters that don't exist are left out.
+# While adapter events keep the cache up to date, this doesn't cost a command at
+# all, unless `force_update` is True.
+def get_network_adapter_link_statuses(names=None, force_update=None):
+    if force_update is None:
+        force_update = not state_cache.following()
+    statuses = {}
+    for a in get_network_adapters(force_update=force_update):
+        if names is None or a['Name'] in names:
+            statuses[a['Name']] = (a['ifOperStatus'] == "Up")
+    return statuses
 
+def get_network_adapter_link_status(name):
+    statuses = get_network_adapter_link_statuses([name])
+    if name not in statuses:
+        raise Exception("No results!")
+    return statuses[name]
 
 
 
 
-def _decode_cmd_property_line(line):
-    # Format:     Name. . . . . : Value
-    parts = line.split(":")
-    if len(parts) == 1:  # Additional value to a property
-        return None, parts[0].strip()
-    
-    name = parts[0].replace(".", "").strip()
-    value = ':'.join(parts[1:]).strip()
-    return name, value
 
-ip_config = None
-def get_ip_config(force_update=False):
-    global ip_config
-    if (not force_update) and (ip_config is not None):
-        log.log("Using cached ipconfig")
-        return ip_config
 
-    lines = _run_PS_get_lines("ipconfig /all")
 
-    general_config = {}
+# `ipconfig /all` output looks like this:
+#
+#   Windows IP Configuration
+#
+#      Host Name . . . . . . . . . . . . : DESKTOP
+#      ...
+#
+#   Ethernet adapter Ethernet:
+#
+#      Description . . . . . . . . . . . : Some Network Card
+#      DNS Servers . . . . . . . . . . . : 192.168.1.1
+#                                          8.8.8.8
+#      ...
+#
+# Sections start at column 0, properties are indented by 3 spaces, and extra values
+# for the previous property are indented much further than that.
+# Values can contain colons (IPv6 addresses), so we can't just split on ':'.
+_cmd_property_re = re.compile(r"^   (\S.*?)[ .]*:(?: (.*))?$")
 
-    processing_line = 3 # start on third line, where computer properties start
-    while True:
-        line = lines[processing_line]
-        processing_line += 1
-        if line.strip() == "":
-            break
-        
-        name, value = _decode_cmd_property_line(line)
-        general_config[name] = value
-    
-    adapters = []
+def _decode_cmd_property_line(line):
+    if not line.startswith("    "):
+        match = _cmd_property_re.match(line)
+        if match is not None:
+            return match.group(1), (match.group(2) or "").strip()
+    return None, line.strip()  # Additional value to a property
+
+# Parses `ipconfig /all` output one line at a time, so it can start before the
+# command has finished. Yields (header, properties) for each section, as soon as
+# the section is complete. `header` is the section's title line without the colon,
+# e.g. "Windows IP Configuration" or "Ethernet adapter Ethernet".
+# Properties with more than one value (like DNS Servers) are lists.
+def iter_ip_config_sections(lines):
+    header = None
+    props = None
     last_prop_name = None
-    while processing_line < len(lines):
-        line = lines[processing_line]
-        processing_line += 1
+    for line in lines:
         if line.strip() == "":
             continue
 
-        if not line.startswith(" "):  # New adapter line
-            adapter_type, name = line.split(" adapter ")
-            adapter = {}
-            adapter["Type"] = adapter_type
-            adapter["Name"] = name[:-1]
-            adapters.append(adapter)
-        else:
-            prop_name, value = _decode_cmd_property_line(line)
-            if prop_name is not None:
-                adapters[-1][prop_name] = value
-                last_prop_name = prop_name
-            else:
-                saved_value = adapters[-1][last_prop_name]
-                if type(saved_value) is not list:
-                    if saved_value == "":
-                        saved_value = []
-                    else:
-                        saved_value = [saved_value]
-                saved_value.append(value)
-                adapters[-1][last_prop_name]
-    
-    ip_config = general_config, adapters
+        if not line.startswith(" "):
+            if props is not None:
+                yield header, props
+            header = line.rstrip().rstrip(":")
+            props = {}
+            last_prop_name = None
+            continue
 
+        if props is None:  # Properties before any header. Shouldn't happen.
+            header, props = "", {}
+
+        prop_name, value = _decode_cmd_property_line(line)
+        if prop_name is not None:
+            props[prop_name] = value
+            last_prop_name = prop_name
+        elif last_prop_name is not None:
+            saved_value = props[last_prop_name]
+            if type(saved_value) is not list:
+                saved_value = [] if saved_value == "" else [saved_value]
+                props[last_prop_name] = saved_value
+            saved_value.append(value)
+
+    if props is not None:
+        yield header, props
+
+# Turns the output of `ipconfig /all` into (general_config, adapters).
+def parse_ip_config(lines):
+    general_config = {}
+    adapters = []
+    for header, props in iter_ip_config_sections(lines):
+        if " adapter " in header:
+            adapter_type, name = header.split(" adapter ", 1)
+            adapter = {"Type": adapter_type, "Name": name}
+            adapter.update(props)
+            adapters.append(AdapterRecord(adapter))
+        else:
+            general_config.update(props)
     return general_config, adapters
 
+_ip_config_key = ("ipconfig /all",)
+def get_ip_config(force_update=False):
+    return state_cache.get(
+        _ip_config_key,
+        lambda: parse_ip_config(_stream_PS_lines("ipconfig /all")),
+        force_update=force_update,
+    )
+
+# Gets both `get_network_adapters()` and `get_ip_config()` at once, and returns
+# them as (adapters, (general_config, ip_adapters)).
+# Whatever isn't already cached is fetched in a single invocation.
+def get_network_snapshot(force_update=False, prop_list_type="limited", structured=False, display=True):
+    adapters_key = _network_adapters_key(prop_list_type, structured)
+    # (is_fresh also catches up on adapter events, so they don't cause a refresh right after this.)
+    adapters_fresh = state_cache.is_fresh(adapters_key) and not force_update
+    ip_config_fresh = state_cache.is_fresh(_ip_config_key) and not force_update
+
+    if not (adapters_fresh or ip_config_fresh):
+        log.log("Taking a snapshot of the adapters and ipconfig in one go.")
+        (adapter_lines, adapter_code), (ip_lines, ip_code) = run_PS_batch(
+            [_net_adapter_query(prop_list_type, structured), "ipconfig /all"], display=display)
+        if adapter_code != 0 or ip_code != 0:
+            raise subprocess.CalledProcessError(adapter_code if adapter_code != 0 else ip_code,
+                                                "powershell.exe (network snapshot)")
+
+        if structured:
+            adapters = parse_net_adapter_json("".join(adapter_lines))
+        else:
+            adapters = parse_net_adapter_list(adapter_lines)
+        state_cache.put(adapters_key, adapters, _network_adapter_refresher(prop_list_type, structured))
+        state_cache.put(_ip_config_key, parse_ip_config(ip_lines))
+
+    # If only one of them was missing, this fetches it on its own.
+    return (get_network_adapters(prop_list_type=prop_list_type, structured=structured),
+            get_ip_config())
+
 
 
 # This is to be used for the adapters.
@@ -167,24 +494,60 @@ def dict_by_name(adapter_list):
 
 
 
-def invalidate_network_state_cache():
-    log.log("Invalidating network state cache due to state updates")
-    global adapters, ip_config
-    adapters = None
-    ip_config = None
+# Call this after anything that changes the network state.
+# If only one adapter changed, pass its name, and only that one is re-queried.
+def invalidate_network_state_cache(name=None):
+    if name is None:
+        log.log("Invalidating network state cache due to state updates")
+    else:
+        log.log(f"Invalidating cached state of '{name}' due to state updates")
+    state_cache.invalidate(name)
 
 
     
 
 def set_net_adapter_enable_state(name, state=True):
     command = "Enable" if (state == True) else "Disable"
-    _run_PS_get_lines(f"{command}-NetAdapter -name '{name}' -Confirm:$false")
+    try:
+        _run_PS_get_lines(f"{command}-NetAdapter -name {_quote_PS(name)} -Confirm:$false")
+    finally:
+        invalidate_network_state_cache(name)
+
+# Enables (or disables) all of `names` at once, so they all go down (and come back)
+# together instead of one after another. With the persistent shell, they're run at
+# the same time on the pool's sessions. Without it, they're run in a single
+# powershell.exe instead of one each.
+# Returns {name: whether it worked}, and doesn't raise if some of them didn't.
+def set_net_adapters_enable_state(names, state=True):
+    command = "Enable" if (state == True) else "Disable"
+    commands = [f"{command}-NetAdapter -name {_quote_PS(name)} -Confirm:$false" for name in names]
+    if len(names) == 0:
+        return {}
+    try:
+        if use_persistent_shell and len(names) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(names), shell_pool_size)) as executor:
+                codes = list(executor.map(_run_PS_get_code, commands))
+        else:
+            codes = [code for _, code in run_PS_batch(commands, keep_unfinished=True)]
+    finally:
+        for name in names:
+            invalidate_network_state_cache(name)
+    return {name: code == 0 for name, code in zip(names, codes)}
 
 
 
 # Gotten (modified) from: https://stackoverflow.com/questions/2946746/python-checking-if-a-user-has-administrator-privileges
 def has_admin():
     log.log("Checking admin privileges...")
+    if Capture.replaying():
+        recorded = Capture.replayed("admin", None)
+        log.log(f"Replaying the admin check: {recorded['admin']} as user '{recorded['user']}'")
+        return (recorded["user"], recorded["admin"])
+    user, admin = _check_admin()
+    Capture.record("admin", None, user=user, admin=admin)
+    return (user, admin)
+
+def _check_admin():
     as_user = os.environ['USERNAME']
     try:
         # only windows users with admin privileges can read the C:\windows\temp
@@ -198,14 +561,50 @@ def has_admin():
         return (as_user,True)
 
 
+# When True, reachability is checked from Python (ICMP, with TCP and DNS fallbacks)
+# instead of running `ping` through PowerShell.
+use_native_probes = True
+
+# Like `test_ip_connection`, but returns a Probes.ProbeResult, which has the
+# round-trip time and the reason for a failure. Only pass `refused_counts` for
+# routers (see Probes.tcp_probe).
+def probe_ip_connection(ip, timeout=2, refused_counts=False):
+    start = time.perf_counter()
+    if Capture.replaying():
+        # Probes that lost a race may have been cancelled before they were recorded.
+        recorded = Capture.replayed("probe", ip, missing={"method": "replay", "success": False, "rtt": None,
+                                                          "reason": "not in the capture"})
+        result = Probes.ProbeResult(ip, recorded["method"], recorded["success"], rtt=recorded["rtt"],
+                                    reason=recorded["reason"])
+        log.log(f"Replayed probe result: {result}")
+    elif not use_native_probes:
+        success = _ping_ip_connection(ip)
+        result = Probes.ProbeResult(ip, "ping", success, rtt=time.perf_counter() - start,
+                                    reason="" if success else "ping returned non-zero")
+    else:
+        log.print_command_execution(f"(probe) {ip}")
+        result = Probes.probe_ip(ip, timeout=timeout, refused_counts=refused_counts)
+        log.log(f"Probe result: {result}")
+    _probe_finished(ip, result, time.perf_counter() - start)
+    return result
+
+def _probe_finished(ip, result, duration):
+    Capture.record("probe", ip, duration, method=result.method, success=result.success,
+                   rtt=result.rtt, reason=result.reason)
+    Metrics.record("probe", result.method if result else "failed", duration)
+    log.log_event("probe", target=ip, method=result.method, success=result.success, rtt=result.rtt, reason=result.reason)
+
 def test_ip_connection(ip):
+    return probe_ip_connection(ip).success
+
+def _ping_ip_connection(ip):
     try:
         # # This code will test for IPv6. I don't know if it will autodetect.
         # if ":" in ip:
         #     _run_PS_get_lines(f"ping -n 1 {ip}")
         # else:
         #     _run_PS_get_lines(f"ping -n 1 -6 {ip}")
-        _run_PS_get_lines(f"ping -n 1 {ip}")
+        _run_PS_get_lines(f"ping -n 1 {ip}", timeout=10)
         log.log("Ping returned a 0. Taking that as a successful connection.")
         return True
     except subprocess.CalledProcessError as e:
@@ -215,7 +614,7 @@ def test_ip_connection(ip):
 def test_http_connection(domain):
     # TODO: Doesn't really work, probably. Need alternative.
     try:
-        _run_PS_get_lines(f"curl {domain}")
+        _run_PS_get_lines(f"curl {domain}", timeout=15)
         log.log("Curl returned a 0. Taking that as a successful connection.")
         return True
     except subprocess.CalledProcessError as e:
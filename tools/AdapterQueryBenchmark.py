@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import WinterfacePS as win
+import SyntheticOutputs
+
+# Compares the `Get-NetAdapter | Format-List` text path with the structured
+# `ConvertTo-Json` path: how many bytes come back, and how long they take to parse.
+#
+# Usage: python tools/AdapterQueryBenchmark.py [adapter count]
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+LIMITED = ["Name", "AdminStatus", "HardwareInterface", "ifOperStatus"]
+ALL = ["Name", "InterfaceDescription", "ifIndex", "Status", "MacAddress", "LinkSpeed",
+       "AdminStatus", "HardwareInterface", "ifOperStatus", "MediaConnectionState"]
+ALL_EXTRA = 60  # `-Property *` gives roughly this many more properties.
+
+def parse_text(output):
+    # Same line handling as `_stream_PS_lines`.
+    return win.parse_net_adapter_list([line.replace("\r", "") for line in output.split("\n")])
+
+def parse_json(output):
+    return win.parse_net_adapter_json(output)
+
+def best_of(function, arg, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+print(f"{COUNT} adapters")
+print(f"{'properties':<10} {'mode':<6} {'bytes':>10} {'parse':>10}")
+for label, properties, extra in (("limited", LIMITED, 0), ("all", ALL, ALL_EXTRA)):
+    text = SyntheticOutputs.net_adapter_list_output(COUNT, properties, extra)
+    structured = SyntheticOutputs.net_adapter_json_output(COUNT, properties, extra)
+
+    parsed = parse_json(structured)
+    assert parsed[0]["HardwareInterface"] is True
+    assert parsed[0]["AdminStatus"] == "Up"
+    assert len(parse_text(text)) == len(parsed) == COUNT
+
+    print(f"{label:<10} {'text':<6} {len(text.encode()):>10,} {best_of(parse_text, text) * 1000:>8.2f}ms")
+    print(f"{label:<10} {'json':<6} {len(structured.encode()):>10,} {best_of(parse_json, structured) * 1000:>8.2f}ms")
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import WinterfacePS as win
+import AdapterRecord
+import SyntheticOutputs
+
+# Compares AdapterRecord with the plain dicts adapters used to be: how much
+# memory many snapshots take when they're all kept (like the monitor and
+# InterfaceDifferenceChecker do), how long parsing takes, and how fast the
+# properties can be read.
+#
+# The dicts come from the very same parsers, with AdapterRecord swapped for dict.
+#
+# Usage: python tools/AdapterRecordBenchmark.py [snapshots] [adapter count] [extra properties]
+
+SNAPSHOTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+EXTRA = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+ITERATIONS = 20
+
+_all_properties = ["Name", "InterfaceDescription", "ifIndex", "Status", "MacAddress", "LinkSpeed",
+                   "AdminStatus", "HardwareInterface", "ifOperStatus", "MediaConnectionState"]
+
+def lines_of(output):
+    return output.replace("\r", "").split("\n")
+
+adapter_lines = lines_of(SyntheticOutputs.net_adapter_list_output(COUNT, _all_properties, EXTRA))
+ip_lines = lines_of(SyntheticOutputs.ip_config_output(COUNT))
+
+def snapshot():
+    return win.parse_net_adapter_list(adapter_lines), win.parse_ip_config(ip_lines)[1]
+
+def with_records(use_records):
+    win.AdapterRecord = AdapterRecord.AdapterRecord if use_records else dict
+
+def best_of(function, repeat=ITERATIONS):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_memory(use_records):
+    with_records(use_records)
+    tracemalloc.start()
+    kept = [snapshot() for _ in range(SNAPSHOTS)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    parse = best_of(snapshot)
+    del kept
+    return size, parse
+
+def bench_access(use_records):
+    with_records(use_records)
+    adapters = snapshot()[0] * 100
+    results = {}
+    results["a['Name']"] = best_of(lambda: [a['Name'] for a in adapters])
+    results["a.get(missing)"] = best_of(lambda: [a.get('Missing') for a in adapters])
+    results["'x' in a"] = best_of(lambda: ['ifOperStatus' in a for a in adapters])
+    results["a.items()"] = best_of(lambda: [list(a.items()) for a in adapters])
+    if use_records:
+        results["a.typed('ifOperStatus')"] = best_of(lambda: [a.typed('ifOperStatus') for a in adapters])
+    return len(adapters), results
+
+
+try:
+    print(f"{SNAPSHOTS} snapshots kept, of {COUNT} adapters with {len(adapter_lines)} Get-NetAdapter "
+        + f"and {len(ip_lines)} ipconfig lines each")
+    print(f"{'':<8} {'memory':>10} {'per adapter':>12} {'parse':>9}")
+    memory = {}
+    for label, use_records in (("dict", False), ("record", True)):
+        size, parse = bench_memory(use_records)
+        memory[label] = size
+        print(f"{label:<8} {size / 1e6:>8.1f}MB {size / SNAPSHOTS / COUNT / 2:>10.0f}B {parse * 1000:>7.2f}ms")
+    print(f"Records take {memory['record'] / memory['dict'] * 100:.0f}% of the memory of dicts.")
+
+    print()
+    dict_count, dict_access = bench_access(False)
+    record_count, record_access = bench_access(True)
+    print(f"Access, per adapter ({record_count} adapters)")
+    print(f"{'':<24} {'dict':>9} {'record':>9}")
+    for name, record_time in record_access.items():
+        dict_time = f"{dict_access[name] / dict_count * 1e9:>7.0f}ns" if name in dict_access else f"{'':>9}"
+        print(f"{name:<24} {dict_time} {record_time / record_count * 1e9:>7.0f}ns")
+finally:
+    with_records(True)
@@ -0,0 +1,80 @@
+import io
+import os
+import sys
+import time
+import socket
+import threading
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import WinterfacePS as win
+import WinterfaceAsync
+import ShellSession
+import Probes
+import Deadlines
+
+# Compares running commands and probes one after another with gathering them
+# through WinterfaceAsync, on Linux:
+#   - commands, as asyncio subprocesses (bash instead of powershell.exe)
+#   - DNS probes, against a local server that takes a while to answer
+#   - a command that hangs, which should be killed at its deadline
+#
+# Usage: python tools/AsyncBenchmark.py [count] [delay in seconds] [max concurrency]
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+DELAY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+WinterfaceAsync.max_concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+win.use_persistent_shell = False
+WinterfaceAsync.process_framer = ShellSession.posix_framer
+WinterfaceAsync.process_argv = lambda script: ["bash", "--noprofile", "--norc", "-c", script]
+
+# Answers every DNS query after DELAY seconds (with an empty NOERROR response).
+def start_slow_dns_server():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    def reply(data, address):
+        time.sleep(DELAY)
+        sock.sendto(data[:2] + b"\x81\x80" + data[4:], address)
+    def serve():
+        while True:
+            data, address = sock.recvfrom(512)
+            threading.Thread(target=reply, args=(data, address), daemon=True).start()
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+async def one_at_a_time(coroutines):
+    return [await c for c in coroutines]
+
+
+command = f"sleep {DELAY}; echo done"
+port = start_slow_dns_server()
+
+with contextlib.redirect_stdout(io.StringIO()):
+    serial, _ = timed(lambda: WinterfaceAsync.run(one_at_a_time([WinterfaceAsync.run_PS(command) for _ in range(COUNT)])))
+    gathered, results = timed(lambda: WinterfaceAsync.run_all(*[WinterfaceAsync.run_PS(command) for _ in range(COUNT)]))
+    assert all(lines == ["done"] and code == 0 for lines, code in results), results
+
+    probe_serial, _ = timed(lambda: [Probes.dns_probe("127.0.0.1", port=port) for _ in range(COUNT)])
+    probe_gathered, probes = timed(lambda: WinterfaceAsync.run_all(
+        *[WinterfaceAsync.dns_probe("127.0.0.1", port=port) for _ in range(COUNT)]))
+    assert all(probes), probes
+
+    async def hang():
+        try:
+            await WinterfaceAsync.run_PS("sleep 30 & sleep 30", timeout=0.5)
+        except Deadlines.CommandTimedOut as e:
+            return e
+    hung, error = timed(lambda: WinterfaceAsync.run(hang()))
+
+print(f"{COUNT} of each, {DELAY:g}s apiece, with at most {WinterfaceAsync.max_concurrency} commands at once")
+print(f"{'':<24} {'serial':>9} {'gathered':>9} {'speedup':>8}")
+print(f"{'commands (processes)':<24} {serial:>8.2f}s {gathered:>8.2f}s {serial / gathered:>7.1f}x")
+print(f"{'DNS probes':<24} {probe_serial:>8.2f}s {probe_gathered:>8.2f}s {probe_serial / probe_gathered:>7.1f}x")
+print(f"A hung command: {type(error).__name__} after {hung:.2f}s ({error})")
@@ -1,4 +1,20 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import WinterfacePS as win
+from AdapterRecord import AdapterRecord
+
+# Takes samples of adapters' properties, from both Get-NetAdapter and ipconfig,
+# and shows which ones differ between them (and between the adapters).
+#
+# Usage: python tools/InterfaceDifferenceChecker.py [--interfaces NAMES] [--every SECONDS --for SECONDS]
+#   --interfaces: comma separated adapter names, or "all". Every sample of all
+#                 of them comes from a single snapshot. Ethernet by default.
+#   With no other options, a sample is taken each time ENTER is pressed.
+#   With --every, samples are taken on their own at that rate, for the --for
+#   duration (or until Ctrl+C), e.g. while plugging a cable in and out.
 
 INTERFACE_NAME = "Ethernet"
 
@@ -9,26 +25,26 @@ def combine_adapter(ps, ipconf):
     final = {}
     
     if ps is not None:
-        for key in ps:
+        for key, value in ps.items():
             if key == "Name":
-                final["PS " + meta_prop("Name")] = ps[key]
+                final["PS " + meta_prop("Name")] = value
             else:
-                final["PS " + key] = ps[key]
+                final["PS " + key] = value
         final["PS " + meta_prop("ADAPTER PRESENT")] = "True"
     else:
         final["PS " + meta_prop("ADAPTER PRESENT")] = "False"
 
     if ipconf is not None:
-        for key in ipconf:
+        for key, value in ipconf.items():
             if key == "Name":
-                final["CMD " + meta_prop("Name")] = ipconf[key]
+                final["CMD " + meta_prop("Name")] = value
             else:
-                final["CMD " + key] = ipconf[key]
+                final["CMD " + key] = value
         final["CMD " + meta_prop("ADAPTER PRESENT")] = "True"
     else:
-        final["CMD ADAPTER PRESENT"] = "False"
+        final["CMD " + meta_prop("ADAPTER PRESENT")] = "False"
     
-    return final
+    return AdapterRecord(final)
 
 def apply_mask(mask, to_list):
     assert(len(mask) == len(to_list))
@@ -39,78 +55,213 @@ def apply_mask(mask, to_list):
             result.append(to_list[i])
     return result
 
+# Returns {interface: sample} for a list of interfaces, or for every adapter if
+# `interfaces` is "all". Both commands go out in a single batch, whatever the
+# number of interfaces, and the cache is bypassed.
+def sample_interfaces(interfaces):
+    adapters, (_, ip_adapters) = win.get_network_snapshot(force_update=True, prop_list_type="all", display=False)
+    adapters = win.dict_by_name(adapters)
+    ip_adapters = win.dict_by_name(ip_adapters)
+    if interfaces == "all":
+        interfaces = list(adapters) + [name for name in ip_adapters if name not in adapters]
+    return {name: combine_adapter(adapters.get(name), ip_adapters.get(name)) for name in interfaces}
+
 def sample(interface):
-    win.invalidate_network_state_cache()
-    adapters = win.dict_by_name(win.get_network_adapters(prop_list_type="all"))
-    ip_adapters = win.dict_by_name(win.get_ip_config()[1])
-    sample = combine_adapter(adapters.get(interface), ip_adapters.get(interface))
-    return sample
-
-
-# NOTE: You can easily comment out these lines to get custom samples.
-# For example, if you wanted to compare a Wi-Fi adapter to an Ethernet adapter.
-# Example of such a replacement:
-# samples = [sample("Ethernet"), sample("Wi-Fi")]
-
-print("Press ENTER when ready to take first sample.")
-input()
-samples = [sample(INTERFACE_NAME)]
-print(f"1 sample collected.")
-
-print("Press ENTER to take another sample, or type DONE to stop")
-while input() != "DONE":
-    samples.append(sample(INTERFACE_NAME))
-    print(f"{len(samples)} samples collected.")
-    print("Press ENTER to take another sample, or type DONE to stop")
-print("\n")
-
-
-ps_prop_mask = [(s["PS " + meta_prop("ADAPTER PRESENT")] == "True") for s in samples]
-cmd_prop_mask = [(s["CMD " + meta_prop("ADAPTER PRESENT")] == "True") for s in samples]
-
-# Check for property differences
-set_of_props = set().union(*[list(s.keys()) for s in samples])
-values_differed = 0
-results_table = []
-for prop in sorted(set_of_props):
-    values = [s.get(prop) for s in samples]
-    for i, v in enumerate(values):
-        if v is None:
-            values[i] = "[MISSING]"
-        elif v == "":
-            values[i] = "______"
-        elif v is list:
-            values[i] = ";".join(v)
+    return sample_interfaces([interface])[interface]
+
+def _display_value(v):
+    if v is None:
+        return "[MISSING]"
+    elif v == "":
+        return "______"
+    elif type(v) is list:
+        return ";".join(v)
+    return v
 
+# Whether a row of values (one per sample) should be in the results table.
+# Values from samples where that side's adapter wasn't present don't count.
+def _values_differ(prop, values, ps_prop_mask, cmd_prop_mask):
     if prop.startswith("CMD"):
         check_values = apply_mask(cmd_prop_mask, values)
     else:
         check_values = apply_mask(ps_prop_mask, values)
+    return len(set(check_values)) != 1
 
-    if len(set(check_values)) == 1:
-        continue
-    
-    values_differed += 1
-    table_row = [prop] + values
-    results_table.append(table_row)
-
-    # print(f"{prop}: \t{values[0]}", end='')
-    # for val in values[1:]:
-    #     print(f"\t-> {val}",end='')
-    # print()
-
-if values_differed == 0:
-    print("All samples were identical")
-else:
-    format_str = "|"
-    for col in range(len(results_table[0])):
-        max_width = 0
-        for row in results_table:
-            length = len(row[col])
-            if length > max_width:
-                max_width = length
-        format_str += " {:<" + str(max_width) + "} |"
-
-    for row in results_table:
-        print(format_str.format(*row))
-    print(f"States differed by {values_differed} keys.")
\ No newline at end of file
+
+# Returns a table of the properties that differ between the samples: one row per
+# property, with its name followed by its value in each sample.
+def diff_samples(samples):
+    ps_prop_mask = [(s["PS " + meta_prop("ADAPTER PRESENT")] == "True") for s in samples]
+    cmd_prop_mask = [(s["CMD " + meta_prop("ADAPTER PRESENT")] == "True") for s in samples]
+
+    # Check for property differences
+    set_of_props = set().union(*[list(s.keys()) for s in samples])
+    results_table = []
+    for prop in sorted(set_of_props):
+        values = [_display_value(s.get(prop)) for s in samples]
+        if not _values_differ(prop, values, ps_prop_mask, cmd_prop_mask):
+            continue
+        
+        table_row = [prop] + values
+        results_table.append(table_row)
+
+        # print(f"{prop}: \t{values[0]}", end='')
+        # for val in values[1:]:
+        #     print(f"\t-> {val}",end='')
+        # print()
+    return results_table
+
+# Diffs each sample against the one before as it comes in, and keeps only the
+# first sample and what changed after it, so that a long run of samples takes
+# little memory. `results_table()` gives the same table as `diff_samples()`
+# would for all the samples.
+class SampleStream:
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.deltas = []  # One {prop: new value} per sample after the first. None if it went missing.
+        self.changed = set()
+
+    def __len__(self):
+        return 0 if self.first is None else len(self.deltas) + 1
+
+    # Adds a sample, and returns the properties that changed since the last one.
+    def add(self, sample):
+        if self.first is None:
+            self.first = self.last = sample
+            return {}
+        delta = sample.changes_from(self.last)
+        self.deltas.append(delta)
+        self.changed.update(delta)
+        self.last = sample
+        return delta
+
+    # Returns each sample's value of `props`, rebuilt from the deltas.
+    def columns(self, props):
+        current = {prop: self.first.get(prop) for prop in props}
+        columns = [dict(current)]
+        for delta in self.deltas:
+            current.update({prop: delta[prop] for prop in props if prop in delta})
+            columns.append(dict(current))
+        return columns
+
+    def results_table(self):
+        return streams_results_table([self])
+
+# Like `diff_samples()`, for several SampleStreams side by side (e.g. one per
+# interface): the columns are each stream's samples, one stream after another.
+def streams_results_table(streams):
+    streams = [s for s in streams if s.first is not None]
+    if len(streams) == 0:
+        return []
+    # Anything that differs between two samples of a stream changed between two
+    # in a row, and anything else that differs between streams does so in their
+    # first samples.
+    candidates = set().union(*[s.changed for s in streams])
+    for prop in set().union(*[s.first for s in streams]):
+        if len(set(_display_value(s.first.get(prop)) for s in streams)) > 1:
+            candidates.add(prop)
+
+    present = ["PS " + meta_prop("ADAPTER PRESENT"), "CMD " + meta_prop("ADAPTER PRESENT")]
+    columns = [c for s in streams for c in s.columns(sorted(candidates.union(present)))]
+    ps_prop_mask = [(c[present[0]] == "True") for c in columns]
+    cmd_prop_mask = [(c[present[1]] == "True") for c in columns]
+
+    results_table = []
+    for prop in sorted(candidates):
+        values = [_display_value(c[prop]) for c in columns]
+        if _values_differ(prop, values, ps_prop_mask, cmd_prop_mask):
+            results_table.append([prop] + values)
+    return results_table
+
+# The header row for `streams_results_table()`, given {interface: SampleStream}.
+def streams_header(streams):
+    return ["Property"] + [f"{name} #{i + 1}" for name, stream in streams.items() for i in range(len(stream))]
+
+# Samples `interfaces` (a list, or "all") every `interval` seconds for `duration`
+# seconds (or until Ctrl+C), and returns {interface: SampleStream}.
+# With "all", the interfaces are the adapters there were at the first sample.
+def sample_unattended(interfaces, interval, duration):
+    streams = {}
+    start = time.monotonic()
+    next_sample = start
+    try:
+        while time.monotonic() - start < duration:
+            samples = sample_interfaces(interfaces)
+            interfaces = list(samples)
+            elapsed = time.monotonic() - start
+            for name, new_sample in samples.items():
+                stream = streams.setdefault(name, SampleStream())
+                changed = stream.add(new_sample)
+                if changed:
+                    print(f"{elapsed:7.1f}s  {name} sample {len(stream)}: {', '.join(sorted(changed))} changed")
+            next_sample += interval
+            behind = time.monotonic() - next_sample
+            if behind > 0:  # Sampling took longer than the interval. Skip the ones there was no time for.
+                next_sample += (behind // interval + 1) * interval
+            time.sleep(max(0, next_sample - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    print(f"{max([len(s) for s in streams.values()], default=0)} samples of {len(streams)} interfaces "
+        + f"collected in {time.monotonic() - start:.1f}s, "
+        + f"{sum(len(d) for s in streams.values() for d in s.deltas)} changes stored.")
+    return streams
+
+def print_results_table(results_table, header=None):
+    values_differed = len(results_table)
+    if values_differed == 0:
+        print("All samples were identical")
+    else:
+        rows = results_table if header is None else [header] + results_table
+        format_str = "|"
+        for col in range(len(results_table[0])):
+            max_width = 0
+            for row in rows:
+                length = len(row[col])
+                if length > max_width:
+                    max_width = length
+            format_str += " {:<" + str(max_width) + "} |"
+
+        for row in rows:
+            print(format_str.format(*row))
+        print(f"States differed by {values_differed} keys.")
+
+
+if __name__ == "__main__":
+    # NOTE: Comparing a Wi-Fi adapter to an Ethernet adapter is just:
+    #     --interfaces Ethernet,Wi-Fi
+    # Or, from code:
+    # print_results_table(diff_samples(list(sample_interfaces(["Ethernet", "Wi-Fi"]).values())))
+
+    args = sys.argv[1:]
+    interfaces = [INTERFACE_NAME]
+    if "--interfaces" in args:
+        interfaces = args[args.index("--interfaces") + 1]
+        interfaces = "all" if interfaces == "all" else interfaces.split(",")
+    described = "every interface" if interfaces == "all" else ", ".join(interfaces)
+    try:
+        if "--every" in args:
+            interval = float(args[args.index("--every") + 1])
+            duration = float(args[args.index("--for") + 1]) if "--for" in args else float("inf")
+            print(f"Sampling {described} every {interval:g}s. Press Ctrl+C to stop.")
+            streams = sample_unattended(interfaces, interval, duration)
+        else:
+            streams = {}
+            print(f"Press ENTER when ready to take first sample of {described}.")
+            input()
+            count = 0
+            while True:
+                samples = sample_interfaces(interfaces)
+                interfaces = list(samples)
+                for name, new_sample in samples.items():
+                    streams.setdefault(name, SampleStream()).add(new_sample)
+                count += 1
+                print(f"{count} sample{'s' if count > 1 else ''} collected.")
+                print("Press ENTER to take another sample, or type DONE to stop")
+                if input() == "DONE":
+                    break
+        print("\n")
+
+        print_results_table(streams_results_table(list(streams.values())), streams_header(streams))
+    finally:
+        win.close_shell_sessions()
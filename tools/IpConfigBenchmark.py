@@ -0,0 +1,82 @@
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import WinterfacePS as win
+import SyntheticOutputs
+
+# Compares the `ipconfig /all` parser against the old index-walking one, on
+# synthetic output with lots of adapters.
+#
+# Usage: python tools/IpConfigBenchmark.py [adapter counts...]
+
+COUNTS = [int(c) for c in sys.argv[1:]] or [10, 100, 500]
+
+# The parser as it was before it was rewritten, kept here for comparison.
+def legacy_parse(output):
+    lines = re.sub("\r+", "", output).split("\n")
+    def decode(line):
+        parts = line.split(":")
+        if len(parts) == 1:
+            return None, parts[0].strip()
+        return parts[0].replace(".", "").strip(), ':'.join(parts[1:]).strip()
+
+    general_config = {}
+    processing_line = 3
+    while True:
+        line = lines[processing_line]
+        processing_line += 1
+        if line.strip() == "":
+            break
+        name, value = decode(line)
+        general_config[name] = value
+
+    adapters = []
+    last_prop_name = None
+    while processing_line < len(lines):
+        line = lines[processing_line]
+        processing_line += 1
+        if line.strip() == "":
+            continue
+        if not line.startswith(" "):
+            adapter_type, name = line.split(" adapter ")
+            adapters.append({"Type": adapter_type, "Name": name[:-1]})
+        else:
+            prop_name, value = decode(line)
+            if prop_name is not None:
+                adapters[-1][prop_name] = value
+                last_prop_name = prop_name
+            else:
+                saved_value = adapters[-1][last_prop_name]
+                if type(saved_value) is not list:
+                    saved_value = [] if saved_value == "" else [saved_value]
+                saved_value.append(value)
+    return general_config, adapters
+
+def new_parse(output):
+    # Same line handling as `_stream_PS_lines`.
+    return win.parse_ip_config(line.replace("\r", "") for line in output.split("\n"))
+
+def best_of(function, arg, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+print(f"{'adapters':>8} {'lines':>7} {'legacy':>10} {'streaming':>10} {'lines/s':>12}")
+for count in COUNTS:
+    output = SyntheticOutputs.ip_config_output(count)
+    line_count = output.count("\n")
+
+    _, adapters = new_parse(output)
+    assert len(adapters) == count
+    assert type(adapters[0]["DNS Servers"]) is list, "multi-valued properties should be kept"
+
+    legacy = best_of(legacy_parse, output)
+    streaming = best_of(new_parse, output)
+    print(f"{count:>8} {line_count:>7} {legacy * 1000:>8.2f}ms {streaming * 1000:>8.2f}ms {line_count / streaming:>12,.0f}")
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import MyLogger as log
+import SyntheticOutputs
+
+# Measures how much a logging call costs the caller, comparing the background
+# writer with writing to the file synchronously (the way MyLogger used to).
+# Only log-file lines are measured, since console output costs the same either way.
+#
+# Usage: python tools/LoggerBenchmark.py [line count]
+
+LINES = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+COMMANDS = 200
+OUTPUT = SyntheticOutputs.ip_config_output(20)
+
+# How MyLogger used to write to the file.
+def legacy_log_print(file, *args, display=True, log=True, prefix="", color="", **kwargs):
+    if log and file:
+        print(prefix, file=file, end='')
+        print(*args, **kwargs, file=file)
+
+def legacy_log(file, *args, prefix="### ", **kwargs):
+    legacy_log_print(file, *args, display=False, prefix=prefix, **kwargs)
+
+def legacy_log_command_execution(file, command, output):
+    file.write(f"\n### Running command: `{command}`")
+    file.write("\n### ============ COMMAND OUTPUT ============\n")
+    output = "### " + output.replace("\r","").replace("\n","\n### ")
+    file.write(output)
+    file.write("\n### ========== END COMMAND OUTPUT ==========\n")
+    file.write("")
+
+def bench_legacy(path):
+    with open(path, "w") as file:
+        start = time.perf_counter()
+        for i in range(LINES):
+            legacy_log(file, f"Log line number {i}, with a little bit of text.")
+        lines = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(COMMANDS):
+            legacy_log_command_execution(file, "ipconfig /all", OUTPUT)
+        commands = time.perf_counter() - start
+    return lines, commands, lines + commands
+
+def bench_background(path):
+    log.setup_logfile(path)
+    # WinterfacePS hands over the lines it already split while streaming the output.
+    output_lines = OUTPUT.replace("\r", "").split("\n")
+
+    start = time.perf_counter()
+    for i in range(LINES):
+        log.log(f"Log line number {i}, with a little bit of text.")
+    lines = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(COMMANDS):
+        log.log_command_execution("ipconfig /all", output_lines)
+    commands = time.perf_counter() - start
+
+    log.flush()
+    total = time.perf_counter() - start + lines
+    log.clean_up()
+    return lines, commands, total
+
+def best_of(bench, path, repeat=3):
+    return min((bench(path) for _ in range(repeat)), key=lambda r: r[2])
+
+directory = tempfile.mkdtemp()
+print(f"{LINES} log lines, then {COMMANDS} commands' output ({OUTPUT.count(chr(10))} lines each)")
+print(f"{'':<12} {'per line':>10} {'per command':>12} {'total (incl. flush)':>20}")
+for label, bench in (("synchronous", bench_legacy), ("background", bench_background)):
+    lines, commands, total = best_of(bench, os.path.join(directory, f"{label}.txt"))
+    print(f"{label:<12} {lines / LINES * 1e6:>8.2f}us {commands / COMMANDS * 1e6:>10.1f}us {total * 1000:>18.1f}ms")
+
+with open(os.path.join(directory, "synchronous.txt")) as a, open(os.path.join(directory, "background.txt")) as b:
+    assert a.read() == b.read(), "Both should write exactly the same log"
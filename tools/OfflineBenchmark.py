@@ -0,0 +1,450 @@
+import io
+import os
+import re
+import sys
+import time
+import runpy
+import builtins
+import tempfile
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import WinterfacePS as win
+import Probes
+import DnsCheck
+import StateCache
+import Metrics
+import ShellSession
+import AdapterEvents
+import Deadlines
+import SyntheticOutputs
+import InterfaceDifferenceChecker
+
+# Runs the whole program on Linux, against a simulated Windows machine.
+#
+# The shell session pool is replaced by a fake one that answers each command
+# (Get-NetAdapter, ipconfig, Enable-/Disable-NetAdapter, ...) with synthetic
+# output for a simulated network, after a simulated delay. Everything above the
+# shell (streaming, parsing, caching, logging, batching) runs for real. The
+# probes, the DNS queries and the admin check are replaced too, and sleeps only
+# move a virtual clock forward, so a run that would take minutes takes moments.
+#
+# It reports:
+#   - how fast adapters and ipconfig are fetched and parsed, through the whole
+#     command path (with no simulated delay)
+#   - how fast InterfaceDifferenceChecker combines and diffs samples
+#   - the wall time of the whole of Main, for each scenario below
+#
+# Usage: python tools/OfflineBenchmark.py [latency scale] [adapter count]
+#   latency scale: how much of the simulated latencies to actually wait for.
+#                  1 is as slow as a real machine, 0 doesn't wait at all.
+
+LATENCY_SCALE = float(sys.argv[1]) if len(sys.argv) > 1 else 0.02
+COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+ITERATIONS = 20
+
+# Roughly how long these take on a real machine, in seconds.
+LATENCIES = {
+    "Get-NetAdapter": 0.35,
+    "ipconfig": 0.1,
+    "Enable-NetAdapter": 1.5,
+    "Disable-NetAdapter": 1.0,
+    "ping": 0.05,
+    "probe": 0.03,
+    "dns": 0.04,
+    "timeout": 2,  # Anything that fails by not answering
+}
+
+def simulate(kind):
+    if LATENCY_SCALE > 0:
+        _real_sleep(LATENCIES[kind] * LATENCY_SCALE)
+
+_real_sleep = time.sleep
+_real_monotonic = time.monotonic
+
+# time.sleep, time.monotonic and ThreadPoolExecutor.submit are patched with this
+# while Main runs. Work on other threads (checks, probe races, the enable pool)
+# happens at the same time as the rest, so its sleeps overlap instead of adding up:
+# each task has a virtual time of its own, starting from the time it was submitted
+# at. The main thread waits for them, so whenever it looks at the clock, it carries
+# on from the latest any of them got to, which is `slept`. (Not when it submits:
+# the first task may already have slept by the time the next one is submitted.)
+class VirtualClock:
+    def __init__(self):
+        self.slept = 0
+        self._main = 0
+        self._task = threading.local()
+        self._lock = threading.Lock()
+
+    # The calling thread's virtual time. Must be called with the lock held.
+    def _now(self, catch_up=True):
+        if threading.current_thread() is threading.main_thread():
+            if catch_up:
+                self._main = self.slept
+            return self._main
+        return getattr(self._task, "now", self.slept)
+
+    def sleep(self, seconds):
+        with self._lock:
+            now = self._now() + max(seconds, 0)
+            if threading.current_thread() is threading.main_thread():
+                self._main = now
+            else:
+                self._task.now = now
+            self.slept = max(self.slept, now)
+
+    def monotonic(self):
+        with self._lock:
+            return _real_monotonic() + self._now()
+
+    def submit(self, executor, fn, *args, **kwargs):
+        with self._lock:
+            start = self._now(catch_up=False)
+        def task():
+            self._task.now = start
+            return fn(*args, **kwargs)
+        return _real_submit(executor, task)
+
+_real_submit = ThreadPoolExecutor.submit
+
+
+_all_properties = ["Name", "InterfaceDescription", "ifIndex", "Status", "MacAddress", "LinkSpeed",
+                   "AdminStatus", "HardwareInterface", "ifOperStatus", "MediaConnectionState"]
+_default_properties = ["Name", "InterfaceDescription", "ifIndex", "Status", "MacAddress", "LinkSpeed"]
+
+# The state of the simulated machine and its network.
+class SimulatedNetwork:
+    def __init__(self, count=COUNT, internet=True, router=True, dns=True, states=None, autoconfig=(),
+                 fixed_by_enabling=(), extra=0, hung=()):
+        self.count = count
+        self.internet = internet
+        self.router = router
+        self.dns = dns
+        self.states = dict(states or {})
+        self.autoconfig = set(autoconfig)
+        self.fixed_by_enabling = set(fixed_by_enabling)  # Enabling these brings the internet back.
+        self.extra = extra  # Filler properties for `Format-List -Property *`
+        self.hung = tuple(hung)  # Commands starting with these never finish.
+        self._before_disable = {}
+        self.listener = None  # Told about adapters being enabled and disabled, like adapter events.
+        self.commands = 0
+        self.unknown_commands = []
+
+    def names(self):
+        return [SyntheticOutputs.adapter_name(i) for i in range(self.count)]
+
+    def set_enabled(self, name, enabled):
+        if name not in self.names():
+            return False
+        if enabled:
+            self.states[name] = self._before_disable.pop(name, "up")
+            if name in self.fixed_by_enabling:
+                self.autoconfig.discard(name)
+                self.internet = self.router = True
+        elif self.states.get(name) != "disabled":
+            self._before_disable[name] = SyntheticOutputs.adapter_state(self.names().index(name), self.states)
+            self.states[name] = "disabled"
+        if self.listener is not None:
+            self.listener(AdapterEvents.AdapterEvent("admin", name, up=enabled))
+            self.listener(AdapterEvents.AdapterEvent("link", name, up=(self.states[name] == "up")))
+        return True
+
+    def adapter_output(self, command):
+        json_query = command.startswith("ConvertTo-Json")
+        match = re.search(r"-Name '((?:[^']|'')*)'", command) or re.search(r'Where Name -EQ "([^"]*)"', command)
+        names = None if match is None else [match.group(1).replace("''", "'")]
+
+        if json_query:
+            properties = re.search(r"-Property (.*?)\)$", command).group(1)
+        else:
+            properties = re.search(r"Format-List ?(?:-Property (.*))?$", command).group(1) or ""
+        if properties.startswith("'*'") or properties.startswith("*"):
+            properties, extra = _all_properties, self.extra
+        elif properties == "":
+            properties, extra = _default_properties, 0
+        else:
+            properties, extra = properties.split(", "), 0
+
+        if names is not None and names[0] not in self.names():
+            return ""
+        if json_query:
+            return SyntheticOutputs.net_adapter_json_output(self.count, properties, extra, self.states, names)
+        return SyntheticOutputs.net_adapter_list_output(self.count, properties, extra, self.states, names)
+
+    # Returns (output, exit code, latency kind).
+    def run(self, command):
+        self.commands += 1
+        if self.hung and command.startswith(self.hung):
+            return "", None, "hang"
+        if "Get-NetAdapter" in command and ("Format-List" in command or "ConvertTo-Json" in command):
+            return self.adapter_output(command), 0, "Get-NetAdapter"
+        if command == "ipconfig /all":
+            return SyntheticOutputs.ip_config_output(self.count, self.states, self.autoconfig), 0, "ipconfig"
+        match = re.match(r"(Enable|Disable)-NetAdapter -name '(.*)' -Confirm:\$false$", command)
+        if match is not None:
+            if self.set_enabled(match.group(2), match.group(1) == "Enable"):
+                return "", 0, f"{match.group(1)}-NetAdapter"
+            return f"{match.group(1)}-NetAdapter : No MSFT_NetAdapter objects found\r\n", 1, "Get-NetAdapter"
+        if command.startswith("ping ") or command.startswith("curl "):
+            return "", (0 if self.internet else 1), ("ping" if self.internet else "timeout")
+        self.unknown_commands.append(command)
+        return f"Unknown command: {command}\r\n", 1, "ping"
+
+    def reachable(self, ip):
+        if ip.startswith("10.") or ip.startswith("fe80:"):  # The gateways
+            return self.router
+        return self.internet
+
+
+# Stands in for WinterfacePS's ShellSessionPool.
+class SimulatedShell:
+    def __init__(self, network):
+        self.network = network
+
+    # Batches are framed as they would be for PowerShell, and taken apart again here.
+    framer = staticmethod(ShellSession.powershell_framer)
+    _framed_re = re.compile(r"try \{ (.*?); if \(-not \$\?\).*?WriteLine\('(\S+) ' \+ \$__nt_code\)")
+
+    # A hung command waits out its timeout (in virtual time) and raises, like a real one.
+    def stream(self, command, timeout=None):
+        sections = self._framed_re.findall(command)
+        if len(sections) == 0:
+            output, code, kind = self.network.run(command)
+            if kind == "hang":
+                time.sleep(timeout)
+                raise Deadlines.CommandTimedOut(command, timeout)
+            simulate(kind)
+            for line in output.splitlines(keepends=True):
+                yield line.encode()
+            return code
+
+        for section, marker in sections:
+            output, code, kind = self.network.run(section)
+            if kind == "hang":
+                time.sleep(timeout)
+                raise Deadlines.CommandTimedOut(command, timeout)
+            simulate(kind)
+            for line in output.splitlines(keepends=True):
+                yield line.encode()
+            yield f"{marker} {code}\r\n".encode()
+        return 0
+
+    def run(self, command, timeout=None):
+        lines = []
+        stream = self.stream(command, timeout)
+        while True:
+            try:
+                lines.append(next(stream))
+            except StopIteration as e:
+                return b"".join(lines), e.value
+
+    def close(self):
+        pass
+
+
+network = None
+
+def fake_check_admin():
+    return ("bench", True)
+
+def fake_probe_ip(ip, probes=Probes.default_probes, timeout=2, refused_counts=False):
+    start = time.perf_counter()
+    if network.reachable(ip):
+        simulate("probe")
+        return Probes.ProbeResult(ip, "icmp", True, rtt=time.perf_counter() - start)
+    simulate("timeout")
+    return Probes.ProbeResult(ip, "icmp", False, reason="timed out (simulated)")
+
+def fake_resolve_with_system(domain):
+    start = time.perf_counter()
+    if network.internet and network.dns:
+        simulate("dns")
+        return DnsCheck.DnsResult(DnsCheck.SYSTEM, domain, ok=True, latency=time.perf_counter() - start)
+    simulate("dns")
+    return DnsCheck.DnsResult(DnsCheck.SYSTEM, domain, error="[Errno -3] Temporary failure in name resolution")
+
+def fake_query_server(server, domain, timeout, port=53, rdtype="NS"):
+    start = time.perf_counter()
+    if network.internet:
+        simulate("dns")
+        return DnsCheck.DnsResult(server, domain, ok=True, latency=time.perf_counter() - start, rcode="NOERROR")
+    simulate("timeout")
+    return DnsCheck.DnsResult(server, domain, timed_out=True)
+
+win._check_admin = fake_check_admin
+Probes.probe_ip = fake_probe_ip
+DnsCheck.resolve_with_system = fake_resolve_with_system
+DnsCheck.query_server = fake_query_server
+win.use_persistent_shell = True
+
+# Stands in for AdapterEvents' sources.
+class SimulatedEvents:
+    name = "simulated"
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def start(self):
+        network.listener = self.deliver
+
+    def stop(self):
+        network.listener = None
+
+AdapterEvents.source_factory = SimulatedEvents
+# Waiting for an adapter event moves the virtual clock, like sleeps do.
+AdapterEvents._wait = lambda ready, timeout: None if ready() else time.sleep(timeout)
+
+def use_network(new_network):
+    global network
+    network = new_network
+    win.close_shell_sessions()
+    win._shell_pool = SimulatedShell(network)
+    win.state_cache = StateCache.NetworkStateCache()
+    Metrics.reset()
+
+
+# Scenario name: (network, answers to Main's questions). Once the answers run
+# out, every question is answered "no" (or just ENTER).
+SCENARIOS = {
+    "healthy": (dict(), []),
+    "dns broken": (dict(dns=False), []),
+    "router reachable": (dict(internet=False), []),
+    "dhcp broken": (dict(internet=False, router=False, autoconfig=["Ethernet", "Wi-Fi"]), []),
+    "wi-fi disabled": (dict(internet=False, router=False, fixed_by_enabling=["Wi-Fi"],
+                            states={"Ethernet": "down", "Wi-Fi": "disabled"}), ["y"]),
+    "cable unplugged": (dict(internet=False, router=False, states={"Ethernet": "down", "Wi-Fi": "down"}), []),
+    "enabling hangs": (dict(internet=False, router=False, fixed_by_enabling=["Wi-Fi"],
+                            states={"Ethernet": "down", "Wi-Fi": "disabled"}, hung=["Enable-NetAdapter"]), ["y"]),
+}
+
+def run_main(scenario):
+    network_args, answers = SCENARIOS[scenario]
+    use_network(SimulatedNetwork(**network_args))
+    answers = list(answers)
+    asked = []
+    def scripted_input(prompt=""):
+        asked.append(prompt)
+        return answers.pop(0) if answers else "n"
+
+    clock = VirtualClock()
+    log_dir = tempfile.mkdtemp(prefix="offline_bench_")
+    saved = (sys.argv, builtins.input, time.sleep, time.monotonic)
+    sys.argv = [os.path.join(ROOT, "Main.py"), log_dir]
+    builtins.input = scripted_input
+    time.sleep, time.monotonic = clock.sleep, clock.monotonic
+    ThreadPoolExecutor.submit = lambda executor, fn, /, *args, **kwargs: clock.submit(executor, fn, *args, **kwargs)
+    console = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(console):
+            result = runpy.run_path(os.path.join(ROOT, "Main.py"), run_name="__main__")
+    finally:
+        sys.argv, builtins.input, time.sleep, time.monotonic = saved
+        ThreadPoolExecutor.submit = _real_submit
+    elapsed = time.perf_counter() - start
+
+    if "The program has run into an error." in console.getvalue():
+        outcome = "error (see " + log_dir + ")"
+    else:
+        outcome = "resolved" if result.get("resolved") else "unresolved"
+    with open(os.path.join(log_dir, "log_1.txt")) as f:
+        outages = re.findall(r"The adapters were down for ([\d.]+)s", f.read())
+    outage = max(map(float, outages)) if outages else None
+    return elapsed, clock.slept, network.commands, len(asked), outage, outcome
+
+
+def best_of(function, repeat=ITERATIONS):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_parsing():
+    global LATENCY_SCALE
+    scale, LATENCY_SCALE = LATENCY_SCALE, 0
+    print(f"{'query':<32} {'adapters':>8} {'lines':>7} {'bytes':>8} {'per call':>10} {'MB/s':>7}")
+    try:
+        for count in (COUNT, 100):
+            use_network(SimulatedNetwork(count=count, extra=60))
+            for label, function, command in (
+                    ("Get-NetAdapter (limited)", lambda: win.get_network_adapters(force_update=True),
+                     win._net_adapter_query("limited", False)),
+                    ("Get-NetAdapter (all)", lambda: win.get_network_adapters(force_update=True, prop_list_type="all"),
+                     win._net_adapter_query("all", False)),
+                    ("Get-NetAdapter (limited, json)",
+                     lambda: win.get_network_adapters(force_update=True, structured=True),
+                     win._net_adapter_query("limited", True)),
+                    ("ipconfig /all", lambda: win.get_ip_config(force_update=True), "ipconfig /all"),
+                    ("snapshot (batched)", lambda: win.get_network_snapshot(force_update=True), None)):
+                commands = [command] if command else [win._net_adapter_query("limited", False), "ipconfig /all"]
+                outputs = [network.run(c)[0] for c in commands]
+                lines = sum(o.count("\n") for o in outputs)
+                size = sum(len(o) for o in outputs)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed = best_of(function)
+                print(f"{label:<32} {count:>8} {lines:>7} {size:>8} {elapsed * 1000:>8.2f}ms {size / elapsed / 1e6:>7.1f}")
+    finally:
+        LATENCY_SCALE = scale
+
+def bench_difference_checker(sample_count=20):
+    use_network(SimulatedNetwork(extra=60))
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(sample_count):
+            network.states["Ethernet"] = "up" if i % 2 == 0 else "down"
+            samples.append(InterfaceDifferenceChecker.sample("Ethernet"))
+
+    def combine_all():
+        ps = {a['Name']: a for a in win.get_network_adapters(prop_list_type="all")}
+        ip = {a['Name']: a for a in win.get_ip_config()[1]}
+        for _ in range(sample_count):
+            InterfaceDifferenceChecker.combine_adapter(ps.get("Ethernet"), ip.get("Ethernet"))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        combine = best_of(combine_all)
+    diff = best_of(lambda: InterfaceDifferenceChecker.diff_samples(samples))
+    table = InterfaceDifferenceChecker.diff_samples(samples)
+
+    def stream_all():
+        stream = InterfaceDifferenceChecker.SampleStream()
+        for s in samples:
+            stream.add(s)
+        return stream
+    stream = best_of(stream_all)
+    rebuild = best_of(stream_all().results_table)
+    assert stream_all().results_table() == table
+    print(f"combine_adapter: {combine / sample_count * 1e6:8.1f}us per sample ({len(samples[0])} properties)")
+    print(f"diff_samples:    {diff * 1000:8.2f}ms for {sample_count} samples ({len(table)} properties differ)")
+    print(f"SampleStream:    {stream * 1000:8.2f}ms to add {sample_count} samples, "
+        + f"{rebuild * 1000:.2f}ms for the table ({sum(len(d) for d in stream_all().deltas)} changes stored)")
+
+    commands = network.commands
+    one = best_of(lambda: InterfaceDifferenceChecker.sample_interfaces(["Ethernet"]), 5)
+    every = best_of(lambda: InterfaceDifferenceChecker.sample_interfaces("all"), 5)
+    per_sample = (network.commands - commands) / 10
+    print(f"sample_interfaces: {one * 1000:6.2f}ms for one interface, {every * 1000:.2f}ms for all {COUNT} "
+        + f"({per_sample:g} commands per sample either way)")
+
+
+bench_parsing()
+print()
+bench_difference_checker()
+print()
+print(f"Main, end to end, with {COUNT} adapters and {LATENCY_SCALE:g}x the simulated latencies")
+print("(outage: how long reset_adapters had the adapters down, in virtual time)")
+print(f"{'scenario':<18} {'wall':>9} {'slept':>7} {'commands':>8} {'inputs':>6} {'outage':>7}  outcome")
+total = 0
+for scenario in SCENARIOS:
+    elapsed, slept, commands, inputs, outage, outcome = run_main(scenario)
+    total += elapsed
+    outage = "" if outage is None else f"{outage:.1f}s"
+    print(f"{scenario:<18} {elapsed * 1000:>7.0f}ms {slept:>6.1f}s {commands:>8} {inputs:>6} {outage:>7}  {outcome}")
+    if network.unknown_commands:
+        print(f"    unknown commands: {network.unknown_commands}")
+print(f"{'total':<18} {total * 1000:>7.0f}ms")
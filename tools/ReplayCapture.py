@@ -0,0 +1,109 @@
+import io
+import os
+import re
+import sys
+import time
+import runpy
+import tempfile
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import Capture
+import ShellSession
+import WinterfacePS as win
+
+# Replays a capture (log_N.capture or log_N.capture.gz) through Main, on any OS.
+# The commands, probes, DNS checks and answers all come from the capture, and
+# nothing actually waits, so it takes moments instead of minutes.
+#
+# With --parse, it also times the parsers on every Get-NetAdapter and ipconfig
+# output in the capture, which makes captures from real machines handy as
+# fixtures when working on parser performance.
+#
+# Usage: python tools/ReplayCapture.py <capture file> [--quiet] [--parse ITERATIONS]
+
+args = sys.argv[1:]
+if len(args) == 0:
+    print("Usage: python tools/ReplayCapture.py <capture file> [--quiet] [--parse ITERATIONS]")
+    sys.exit(1)
+CAPTURE = args.pop(0)
+QUIET = "--quiet" in args
+PARSE_ITERATIONS = int(args[args.index("--parse") + 1]) if "--parse" in args else 0
+
+def replay_main():
+    log_dir = tempfile.mkdtemp(prefix="replay_")
+    replay = Capture.start_replay(CAPTURE)
+    saved_argv = sys.argv
+    sys.argv = [os.path.join(ROOT, "Main.py"), log_dir]
+    console = io.StringIO() if QUIET else sys.stdout
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(console):
+            runpy.run_path(os.path.join(ROOT, "Main.py"), run_name="__main__")
+    except SystemExit:
+        pass
+    finally:
+        sys.argv = saved_argv
+        Capture.stop_replay()
+    elapsed = time.perf_counter() - start
+
+    print()
+    print(f"Replayed {CAPTURE} in {elapsed * 1000:.0f}ms "
+        + f"(the original took {replay.clock:.1f}s)")
+    print(f"{replay.used} recordings used, {replay.repeated} repeated, {replay.unused()} unused, "
+        + f"{len(replay.missing)} missing")
+    for kind, key in replay.missing:
+        print(f"    nothing recorded for {kind} {key!r}")
+    print(f"The replay's log is in {log_dir}")
+
+
+# A batch is recorded as one command. Its sections' commands are recovered from
+# the way powershell_framer wrapped them.
+_framed_re = re.compile(r"try \{ (.*?); if \(-not \$\?\)")
+
+def _sections(command, output):
+    if Capture.MARKER_PLACEHOLDER not in command:
+        return [(command, output.replace("\r", "").split("\n"))]
+    commands = _framed_re.findall(command)
+    lines = output.replace("\r", "").split("\n")
+    results = ShellSession.split_batch(lines, Capture.MARKER_PLACEHOLDER, len(commands))
+    return [(c, section) for c, (section, _) in zip(commands, results)]
+
+def _parser_for(command):
+    if command == "ipconfig /all":
+        return "parse_ip_config", win.parse_ip_config
+    if command.startswith("ConvertTo-Json") and "Get-NetAdapter" in command:
+        return "parse_net_adapter_json", lambda lines: win.parse_net_adapter_json("".join(lines))
+    if "Get-NetAdapter" in command and "Format-List" in command:
+        return "parse_net_adapter_list", win.parse_net_adapter_list
+    return None, None
+
+def bench_parsers():
+    _, records = Capture.load_capture(CAPTURE)
+    fixtures = {}  # parser name: (parser, [lines])
+    for item in records:
+        if item["kind"] != "command" or "out" not in item:
+            continue
+        for command, lines in _sections(item["key"], item["out"]):
+            name, parser = _parser_for(command)
+            if parser is not None:
+                fixtures.setdefault(name, (parser, []))[1].append(lines)
+
+    print()
+    print(f"{'parser':<24} {'outputs':>7} {'bytes':>9} {'per pass':>10} {'MB/s':>7}")
+    for name, (parser, outputs) in sorted(fixtures.items()):
+        size = sum(sum(len(line) + 1 for line in lines) for lines in outputs)
+        best = None
+        for _ in range(PARSE_ITERATIONS):
+            start = time.perf_counter()
+            for lines in outputs:
+                parser(lines)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:<24} {len(outputs):>7} {size:>9} {best * 1000:>8.2f}ms {size / best / 1e6:>7.1f}")
+
+
+replay_main()
+if PARSE_ITERATIONS > 0:
+    bench_parsers()
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ShellSession
+
+# Compares the per-command latency of spawning a new shell for every command
+# against sending the commands to a persistent session.
+#
+# On Windows this uses PowerShell, which is what the troubleshooter actually runs.
+# Anywhere else, bash stands in for it.
+#
+# Usage: python tools/ShellSessionBenchmark.py [iterations]
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+if os.name == "nt":
+    SPAWN_ARGV = ["powershell.exe", "-NoLogo", "-NoProfile", "-NonInteractive", "-Command"]
+    ARGV, FRAMER = ShellSession.POWERSHELL_ARGV, ShellSession.powershell_framer
+    COMMAND = "Write-Output hello"
+else:
+    SPAWN_ARGV = ["bash", "--noprofile", "--norc", "-c"]
+    ARGV, FRAMER = ShellSession.POSIX_ARGV, ShellSession.posix_framer
+    COMMAND = "echo hello"
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def report(name, times):
+    print(f"{name:<20} mean {sum(times) / len(times) * 1000:8.2f} ms"
+        + f"   p50 {percentile(times, 0.50) * 1000:8.2f} ms"
+        + f"   p95 {percentile(times, 0.95) * 1000:8.2f} ms")
+
+def bench_spawn():
+    times = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        subprocess.check_output(SPAWN_ARGV + [COMMAND])
+        times.append(time.perf_counter() - start)
+    return times
+
+def bench_session():
+    session = ShellSession.ShellSession(ARGV, FRAMER)
+    session.run(COMMAND)  # Startup is paid once, so leave it out.
+    times = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        session.run(COMMAND)
+        times.append(time.perf_counter() - start)
+    session.close()
+    return times
+
+print(f"Running `{COMMAND}` {ITERATIONS} times each.")
+spawn = bench_spawn()
+session = bench_session()
+report("New process", spawn)
+report("Persistent session", session)
+print(f"Speedup: {sum(spawn) / sum(session):.1f}x")
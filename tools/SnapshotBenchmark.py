@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ShellSession
+import SyntheticOutputs
+
+# Compares taking a network snapshot (Get-NetAdapter + ipconfig /all) as two
+# separate commands against one batched invocation, both when starting a new
+# process per invocation and when using a persistent session.
+#
+# The commands are stood in for by `cat`ing synthetic outputs, through bash
+# anywhere but Windows, so this measures the invocation overhead, not PowerShell.
+#
+# Usage: python tools/SnapshotBenchmark.py [iterations] [adapter count]
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+if os.name == "nt":
+    SPAWN_ARGV = ["powershell.exe", "-NoLogo", "-NoProfile", "-NonInteractive", "-Command"]
+    ARGV, FRAMER = ShellSession.POWERSHELL_ARGV, ShellSession.powershell_framer
+    CAT = "Get-Content -Raw"
+else:
+    SPAWN_ARGV = ["bash", "--noprofile", "--norc", "-c"]
+    ARGV, FRAMER = ShellSession.POSIX_ARGV, ShellSession.posix_framer
+    CAT = "cat"
+
+directory = tempfile.mkdtemp()
+adapter_file = os.path.join(directory, "adapters.txt")
+ip_config_file = os.path.join(directory, "ipconfig.txt")
+with open(adapter_file, "w") as f:
+    f.write(SyntheticOutputs.net_adapter_list_output(COUNT, ["Name", "AdminStatus", "HardwareInterface", "ifOperStatus"]))
+with open(ip_config_file, "w") as f:
+    f.write(SyntheticOutputs.ip_config_output(COUNT))
+COMMANDS = [f"{CAT} '{adapter_file}'", f"{CAT} '{ip_config_file}'"]
+MARKER = "__BENCH_SECTION"
+
+def spawn_sequential():
+    for command in COMMANDS:
+        subprocess.check_output(SPAWN_ARGV + [command])
+
+def spawn_batched():
+    output = subprocess.check_output(SPAWN_ARGV + [ShellSession.batch_command(COMMANDS, FRAMER, MARKER)])
+    ShellSession.split_batch(output.decode().split("\n"), MARKER, len(COMMANDS))
+
+session = ShellSession.ShellSession(ARGV, FRAMER)
+
+def session_sequential():
+    for command in COMMANDS:
+        session.run(command)
+
+def session_batched():
+    output, _ = session.run(ShellSession.batch_command(COMMANDS, FRAMER, MARKER))
+    ShellSession.split_batch(output.decode().split("\n"), MARKER, len(COMMANDS))
+
+def bench(function):
+    function()  # Warm up (and start the session).
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        function()
+    return (time.perf_counter() - start) / ITERATIONS
+
+print(f"Snapshot of {COUNT} adapters, {ITERATIONS} iterations each")
+for label, function, invocations in (
+        ("new process, sequential", spawn_sequential, len(COMMANDS)),
+        ("new process, batched", spawn_batched, 1),
+        ("session, sequential", session_sequential, len(COMMANDS)),
+        ("session, batched", session_batched, 1)):
+    print(f"{label:<25} {invocations} invocation(s)  {bench(function) * 1000:8.2f} ms per snapshot")
+
+session.close()
@@ -0,0 +1,145 @@
+import json
+
+# Generates fake (but realistically shaped) command output, for benchmarking
+# the parsers without needing a Windows machine.
+# Machines with Hyper-V, VPN clients and WSL can have a *lot* of virtual
+# adapters, so these can generate as many as you like.
+
+ADAPTER_KINDS = [
+    ("Ethernet", "Ethernet", "Intel(R) Ethernet Connection I219-V", True),
+    ("Wireless LAN", "Wi-Fi", "Intel(R) Wi-Fi 6 AX201 160MHz", True),
+    ("Ethernet", "vEthernet (WSL)", "Hyper-V Virtual Ethernet Adapter", False),
+    ("Ethernet", "vEthernet (Default Switch)", "Hyper-V Virtual Ethernet Adapter", False),
+    ("Unknown", "Local Area Connection", "TAP-Windows Adapter V9", False),
+    ("Ethernet", "Bluetooth Network Connection", "Bluetooth Device (Personal Area Network)", False),
+]
+
+def adapter_name(i):
+    kind = ADAPTER_KINDS[i % len(ADAPTER_KINDS)]
+    return kind[1] if i < len(ADAPTER_KINDS) else f"{kind[1]} {i}"
+
+# An adapter's state is "up", "down" (no link) or "disabled". `states` can
+# override it by name. Otherwise hardware adapters and every third virtual one
+# are up.
+def adapter_state(i, states=None):
+    name = adapter_name(i)
+    if states and name in states:
+        return states[name]
+    hardware = ADAPTER_KINDS[i % len(ADAPTER_KINDS)][3]
+    return "up" if hardware or i % 3 == 0 else "down"
+
+def _prop(name, value):
+    return f"   {name} ".ljust(39, ".")[:-2] + " : " + value
+
+# Output of `ipconfig /all` with `count` adapters, with Windows line endings.
+# Disabled adapters aren't listed. The adapters named in `autoconfig` didn't get
+# an address from DHCP, so they have a 169.254.x.x one and no gateway.
+def ip_config_output(count, states=None, autoconfig=()):
+    lines = [
+        "",
+        "Windows IP Configuration",
+        "",
+        _prop("Host Name", "DESKTOP-BENCH"),
+        _prop("Primary Dns Suffix", ""),
+        _prop("Node Type", "Hybrid"),
+        _prop("IP Routing Enabled", "No"),
+        _prop("WINS Proxy Enabled", "No"),
+        _prop("DNS Suffix Search List", "lan"),
+        "",
+    ]
+    for i in range(count):
+        adapter_type, _, description, _ = ADAPTER_KINDS[i % len(ADAPTER_KINDS)]
+        state = adapter_state(i, states)
+        if state == "disabled":
+            continue
+        connected = state == "up"
+        lines.append(f"{adapter_type} adapter {adapter_name(i)}:")
+        lines.append("")
+        if not connected:
+            lines.append(_prop("Media State", "Media disconnected"))
+        lines.append(_prop("Connection-specific DNS Suffix", "lan" if connected else ""))
+        lines.append(_prop("Description", description))
+        lines.append(_prop("Physical Address", "-".join(f"{(i * 7 + b) % 256:02X}" for b in range(6))))
+        lines.append(_prop("DHCP Enabled", "Yes"))
+        lines.append(_prop("Autoconfiguration Enabled", "Yes"))
+        if connected:
+            lines.append(_prop("IPv6 Address", f"fd00::{i:x}:1(Preferred)"))
+            lines.append(_prop("Link-local IPv6 Address", f"fe80::{i:x}:2%{i + 2}(Preferred)"))
+        if connected and adapter_name(i) in autoconfig:
+            lines.append(_prop("Autoconfiguration IPv4 Address", f"169.254.{i % 250}.5(Preferred)"))
+            lines.append(_prop("Subnet Mask", "255.255.0.0"))
+            lines.append(_prop("Default Gateway", ""))
+        elif connected:
+            lines.append(_prop("IPv4 Address", f"10.{i // 250}.{i % 250}.5(Preferred)"))
+            lines.append(_prop("Subnet Mask", "255.255.255.0"))
+            lines.append(_prop("Lease Obtained", "Sunday, October 18, 2026 9:14:03 AM"))
+            lines.append(_prop("Lease Expires", "Monday, October 19, 2026 9:14:03 AM"))
+            lines.append(_prop("Default Gateway", f"fe80::1%{i + 2}"))
+            lines.append(" " * 39 + f"10.{i // 250}.{i % 250}.1")
+            lines.append(_prop("DHCP Server", f"10.{i // 250}.{i % 250}.1"))
+            lines.append(_prop("DHCPv6 IAID", str(100000000 + i)))
+            lines.append(_prop("DNS Servers", f"10.{i // 250}.{i % 250}.1"))
+            lines.append(" " * 39 + "1.1.1.1")
+            lines.append(" " * 39 + "2606:4700:4700::1111")
+        lines.append(_prop("NetBIOS over Tcpip", "Enabled"))
+        lines.append("")
+    return "\r\n".join(lines) + "\r\n"
+
+
+# The properties of one adapter, as Get-NetAdapter would report them.
+# `extra` adds filler properties to mimic `Select-Object -Property *`.
+def net_adapter_properties(i, extra=0, states=None):
+    _, _, description, hardware = ADAPTER_KINDS[i % len(ADAPTER_KINDS)]
+    state = adapter_state(i, states)
+    up = state == "up"
+    props = {
+        "Name": adapter_name(i),
+        "InterfaceDescription": description if i < len(ADAPTER_KINDS) else f"{description} #{i}",
+        "ifIndex": i + 2,
+        "Status": {"up": "Up", "down": "Disconnected", "disabled": "Disabled"}[state],
+        "MacAddress": "-".join(f"{(i * 7 + b) % 256:02X}" for b in range(6)),
+        "LinkSpeed": "1 Gbps",
+        "AdminStatus": 2 if state == "disabled" else 1,  # Down, Up
+        "HardwareInterface": hardware,
+        "ifOperStatus": 1 if up else 2,     # Up, Down
+        "MediaConnectionState": 1 if up else 2,
+    }
+    for n in range(extra):
+        props[f"ExtraProperty{n}"] = f"Some value: with a colon {n}" if n % 2 else n
+    return props
+
+_status_names = {
+    "AdminStatus": ["Up", "Down", "Testing"],
+    "ifOperStatus": ["Up", "Down", "Testing", "Unknown", "Dormant", "NotPresent", "LowerLayerDown"],
+    "MediaConnectionState": ["Unknown", "Connected", "Disconnected"],
+}
+
+def _format_list_value(name, value):
+    if name in ("AdminStatus", "ifOperStatus"):
+        return _status_names[name][value - 1]
+    if name == "MediaConnectionState":
+        return _status_names[name][value]
+    return str(value)
+
+# Output of `Get-NetAdapter | Format-List -Property ...` for `count` adapters.
+# `names`, if given, only keeps the adapters with those names.
+def net_adapter_list_output(count, properties, extra=0, states=None, names=None):
+    blocks = []
+    for i in range(count):
+        if names is not None and adapter_name(i) not in names:
+            continue
+        props = net_adapter_properties(i, extra, states)
+        shown = [p for p in props if p in properties or p.startswith("Extra")]
+        width = max(len(p) for p in shown)
+        blocks.append("\r\n".join(f"{p.ljust(width)} : {_format_list_value(p, props[p])}" for p in shown))
+    return "\r\n\r\n" + "\r\n\r\n".join(blocks) + "\r\n\r\n\r\n"
+
+# Output of `ConvertTo-Json -Compress` for the same adapters.
+def net_adapter_json_output(count, properties, extra=0, states=None, names=None):
+    adapters = []
+    for i in range(count):
+        if names is not None and adapter_name(i) not in names:
+            continue
+        props = net_adapter_properties(i, extra, states)
+        adapters.append({p: v for p, v in props.items() if p in properties or p.startswith("Extra")})
+    return json.dumps(adapters, separators=(",", ":")) + "\r\n"